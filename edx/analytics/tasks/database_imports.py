@@ -2,19 +2,42 @@
 Import data from external RDBMS databases into Hive.
 """
 import datetime
+import json
 import logging
+import sys
+import threading
+import time
 import textwrap
 
 import luigi
 from luigi.hive import HiveQueryTask, HivePartitionTarget
 
-from edx.analytics.tasks.sqoop import SqoopImportFromMysql
-from edx.analytics.tasks.url import url_path_join
+from edx.analytics.tasks.mysql_extract import MysqlRangeExtractTask
+from edx.analytics.tasks.sqoop import SqoopImportFromMysql, INCREMENTAL_APPEND, read_checkpoint
+from edx.analytics.tasks.url import ExternalURL, get_existing_urls, get_target_from_url, url_path_join
 from edx.analytics.tasks.util.overwrite import OverwriteOutputMixin
 from edx.analytics.tasks.util.hive import hive_database_name
 
 log = logging.getLogger(__name__)
 
+try:
+    import mysql.connector
+    mysql_client_available = True
+except ImportError:
+    log.warn('Unable to import mysql client libraries')
+    # On hadoop slave nodes we don't have mysql client libraries installed so it is pointless to ship this package to
+    # them, instead just fail noisily if we attempt to use these libraries.
+    mysql_client_available = False
+
+
+# Tables are either imported by Sqoop on the Hadoop cluster, or by MysqlRangeExtractTask.
+SQOOP_IMPORT_ENGINE = 'sqoop'
+PYTHON_IMPORT_ENGINE = 'python'
+IMPORT_ENGINES = (SQOOP_IMPORT_ENGINE, PYTHON_IMPORT_ENGINE)
+
+# Incremental imports continue from the checkpoint of the most recent import in this many days before the import date.
+INCREMENTAL_LOOKBACK_DAYS = 31
+
 
 class DatabaseImportMixin(object):
     """
@@ -27,6 +50,11 @@ class DatabaseImportMixin(object):
         num_mappers: The number of map tasks to ask Sqoop to use.
         verbose: Print more information while working.  Default is False.
         import_date:  Date to assign to Hive partition.  Default is today's date.
+        import_engine:  Either "sqoop" to import the tables with Sqoop, or "python" to extract them with
+            MysqlRangeExtractTask, which writes the same files without needing a Hadoop cluster.  Defaults to the
+            "import_engine" option of the "database-import" section, or "sqoop".
+        incremental:  Only import the rows that were added since the previous import, for the tables that define a
+            `check_column`.  Default is False.
 
     Example Credentials File::
 
@@ -47,6 +75,12 @@ class DatabaseImportMixin(object):
 
     num_mappers = luigi.Parameter(default=None, significant=False)
     verbose = luigi.BooleanParameter(default=False, significant=False)
+    import_engine = luigi.Parameter(
+        default=SQOOP_IMPORT_ENGINE,
+        default_from_config={'section': 'database-import', 'name': 'import_engine'},
+        significant=False
+    )
+    incremental = luigi.BooleanParameter(default=False, significant=False)
 
     def __init__(self, *args, **kwargs):
         super(DatabaseImportMixin, self).__init__(*args, **kwargs)
@@ -85,6 +119,18 @@ class ImportIntoHiveTableTask(OverwriteOutputMixin, HiveQueryTask):
             LOCATION '{location}';
             ALTER TABLE {table_name} ADD PARTITION (dt = '{partition_date}');
         """)
+        if self.keep_previous_partitions:
+            # Each partition only holds the rows added or changed since the previous one, so they are all kept.
+            query_format = textwrap.dedent("""
+                USE {database_name};
+                CREATE EXTERNAL TABLE IF NOT EXISTS {table_name} (
+                    {col_spec}
+                )
+                PARTITIONED BY (dt STRING)
+                {table_format}
+                LOCATION '{location}';
+                ALTER TABLE {table_name} ADD IF NOT EXISTS PARTITION (dt = '{partition_date}');
+            """)
 
         query = query_format.format(
             database_name=hive_database_name(),
@@ -105,6 +151,11 @@ class ImportIntoHiveTableTask(OverwriteOutputMixin, HiveQueryTask):
 
         return query
 
+    @property
+    def keep_previous_partitions(self):
+        """Whether the partitions of previous imports are kept, instead of replacing the table with the new one."""
+        return False
+
     @property
     def partition(self):
         """Provides name of Hive database table partition."""
@@ -163,8 +214,65 @@ class ImportMysqlToHiveTableTask(DatabaseImportMixin, ImportIntoHiveTableTask):
     Dumps data from an RDBMS table, and imports into Hive.
 
     Requires override of `table_name` and `columns` properties.
+
+    Tables that define a `check_column` can be imported incrementally, in which case each partition only contains the
+    rows that were added since the previous import, and the partitions of the previous imports are kept.  If no previous
+    import is found, all of the rows are imported and the table is replaced as usual.  Only tables whose rows are never
+    updated can be imported this way, since the kept partitions would otherwise hold several versions of changed rows.
     """
 
+    # The ever-increasing column that incremental imports are keyed on, such as "id".  None if the table is always
+    # imported in full.
+    check_column = None
+
+    # The checkpoint of the previous import, which is only looked up once.
+    previous_import_checked = False
+    previous_last_value = None
+
+    @property
+    def is_incremental(self):
+        """Whether this import only includes the rows that are new since the previous import."""
+        return self.incremental and self.check_column is not None
+
+    @property
+    def keep_previous_partitions(self):
+        # A first import holds all of the rows, so it replaces any partitions that were imported in full before.
+        return self.is_incremental and self.get_checkpoint() is not None
+
+    def get_checkpoint(self):
+        """Returns the last value checkpointed by the previous import, or None, looking it up the first time only."""
+        if not self.previous_import_checked:
+            self.previous_last_value = self.get_previous_last_value()
+            self.previous_import_checked = True
+        return self.previous_last_value
+
+    def get_previous_last_value(self):
+        """
+        Returns the last value checkpointed by the most recent successful import before this one, or None.
+
+        The checkpoints are read from the import metadata in the partitions of the previous imports.  Failed imports
+        are skipped, since they didn't change the table, but if the most recent successful import wasn't incremental,
+        it replaced the table with all of its rows, so the next import has to start from scratch too.
+        """
+        metadata_urls = []
+        for days_before in xrange(1, INCREMENTAL_LOOKBACK_DAYS + 1):
+            previous_date = self.import_date - datetime.timedelta(days=days_before)
+            metadata_urls.append(
+                url_path_join(self.table_location, 'dt=' + previous_date.isoformat(), '.metadata')
+            )
+
+        existing_urls = get_existing_urls(metadata_urls)
+        for metadata_url in metadata_urls:
+            if metadata_url in existing_urls:
+                succeeded, last_value = read_checkpoint(get_target_from_url(metadata_url), self.check_column)
+                if succeeded:
+                    if last_value is None:
+                        log.info('The previous import of %s was not incremental, importing all rows', self.table_name)
+                    return last_value
+
+        log.info('No previous import of %s was found, importing all rows', self.table_name)
+        return None
+
     @property
     def table_location(self):
         return url_path_join(self.destination, self.table_name)
@@ -180,7 +288,26 @@ class ImportMysqlToHiveTableTask(DatabaseImportMixin, ImportIntoHiveTableTask):
         return self.import_date.isoformat()
 
     def requires(self):
-        return SqoopImportFromMysql(
+        if self.import_engine not in IMPORT_ENGINES:
+            raise ValueError('Unknown import engine {0}, expected one of: {1}'.format(
+                self.import_engine, ', '.join(IMPORT_ENGINES)
+            ))
+        if self.import_engine == PYTHON_IMPORT_ENGINE:
+            if self.is_incremental:
+                raise ValueError('Incremental imports require the {0} import engine'.format(SQOOP_IMPORT_ENGINE))
+            import_class = MysqlRangeExtractTask
+        else:
+            import_class = SqoopImportFromMysql
+
+        incremental_kwargs = {}
+        if self.is_incremental:
+            incremental_kwargs = {
+                'incremental': INCREMENTAL_APPEND,
+                'check_column': self.check_column,
+                'last_value': self.get_checkpoint(),
+            }
+
+        return import_class(
             table_name=self.table_name,
             # TODO: We may want to make the explicit passing in of columns optional as it prevents a direct transfer.
             # Make sure delimiters and nulls etc. still work after removal.
@@ -203,6 +330,7 @@ class ImportMysqlToHiveTableTask(DatabaseImportMixin, ImportIntoHiveTableTask):
             # Replace delimiters with a single space if they appear in the data. This prevents the import of malformed
             # records. Hive does not support escape characters or other reasonable workarounds to this problem.
             delimiter_replacement=' ',
+            **incremental_kwargs
         )
 
 
@@ -267,22 +395,255 @@ class ImportAuthUserProfileTask(ImportMysqlToHiveTableTask):
         ]
 
 
-class ImportAllDatabaseTablesTask(DatabaseImportMixin, OverwriteOutputMixin, luigi.WrapperTask):
-    """Imports a set of database tables from an external LMS RDBMS."""
-    def requires(self):
+class ImportAllDatabaseTablesTask(DatabaseImportMixin, OverwriteOutputMixin, luigi.Task):
+    """
+    Imports a set of database tables from an external LMS RDBMS.
+
+    By default the table imports are required by this task, so how many of them run at once depends on the number of
+    luigi workers.  If a connection budget is given, this task schedules the imports itself instead: they run
+    concurrently, with each table getting a share of the budget for its mappers in proportion to its size (as estimated
+    from information_schema), and imports only start while the mappers of the running imports fit in the budget.  The
+    Hive query that adds each table runs once its import has released its share of the budget.  The throughput of each
+    import is logged once it finishes.
+
+    Parameters:
+        connection_budget: The largest number of connections to the database that the imports may use at once.
+            Defaults to the "connection_budget" option of the "database-import" section.  If not specified, the
+            imports are left to the luigi scheduler.
+    """
+    connection_budget = luigi.IntParameter(
+        default=None,
+        default_from_config={'section': 'database-import', 'name': 'connection_budget'},
+        significant=False
+    )
+
+    def table_tasks(self, num_mappers_for_table=None):
+        """
+        Returns the tasks that import each of the tables into Hive.
+
+        Args:
+            num_mappers_for_table (dict): the number of mappers to use for each table, by table name.  Defaults to the
+                `num_mappers` parameter.
+        """
         kwargs = {
             'destination': self.destination,
             'credentials': self.credentials,
             'num_mappers': self.num_mappers,
             'verbose': self.verbose,
+            'import_engine': self.import_engine,
+            'incremental': self.incremental,
             'import_date': self.import_date,
             'overwrite': self.overwrite,
         }
-        yield (
-            ImportStudentCourseEnrollmentTask(**kwargs),
-            ImportAuthUserTask(**kwargs),
-            ImportAuthUserProfileTask(**kwargs),
-        )
+        tasks = []
+        for task_class in (ImportStudentCourseEnrollmentTask, ImportAuthUserTask, ImportAuthUserProfileTask):
+            task = task_class(**kwargs)
+            if num_mappers_for_table is not None:
+                task = task_class(**dict(kwargs, num_mappers=num_mappers_for_table[task.table_name]))
+            tasks.append(task)
+        return tasks
+
+    def requires(self):
+        if self.connection_budget is None:
+            return self.table_tasks()
+        else:
+            return {
+                'credentials': ExternalURL(url=self.credentials),
+            }
 
     def output(self):
-        return [task.output() for task in self.requires()]
+        return [task.output() for task in self.table_tasks()]
+
+    def run(self):
+        # The table tasks take care of removing their own output.
+        self.attempted_removal = True
+        if self.connection_budget is None:
+            # The tables were imported by the required tasks.
+            return
+
+        tasks = self.table_tasks()
+        table_sizes = self.get_table_sizes(tasks[0].requires().database, [task.table_name for task in tasks])
+
+        if self.num_mappers is not None:
+            num_mappers_for_table = dict((table_name, int(self.num_mappers)) for table_name in table_sizes)
+        else:
+            table_names = table_sizes.keys()
+            num_mappers_for_table = dict(zip(table_names, allocate_mappers(
+                [table_sizes[table_name][1] for table_name in table_names], self.connection_budget
+            )))
+
+        jobs = []
+        for task in sorted(self.table_tasks(num_mappers_for_table), key=lambda t: -table_sizes[t.table_name][1]):
+            if not task.complete():
+                num_mappers = num_mappers_for_table[task.table_name]
+                jobs.append((task.table_name, num_mappers, self.get_import_function(task, num_mappers, table_sizes)))
+
+        ConnectionBudgetScheduler(self.connection_budget).run(jobs)
+
+    def get_import_function(self, task, num_mappers, table_sizes):
+        """Returns a function that imports a table, logs the throughput of the import, and returns the Hive query."""
+        def import_table():
+            """Run the import of the table, and return the function that runs the Hive query that adds it."""
+            import_task = task.requires()
+            if not import_task.complete():
+                start_time = time.time()
+                import_task.run()
+                elapsed_time = max(time.time() - start_time, 0.001)
+
+                num_rows, num_bytes = table_sizes[task.table_name]
+                rows_description = 'estimated'
+                imported_rows = self.get_imported_row_count(import_task)
+                if imported_rows is not None:
+                    num_rows = imported_rows
+                    rows_description = 'actual'
+                log.info(
+                    'Imported %s with %d mappers in %.1f seconds: %d rows (%s, %.1f rows/sec) and %.1f MB (estimated, '
+                    '%.2f MB/sec)', task.table_name, num_mappers, elapsed_time, num_rows, rows_description,
+                    num_rows / elapsed_time, num_bytes / 1048576.0, num_bytes / 1048576.0 / elapsed_time
+                )
+
+            # The Hive query doesn't connect to the database, so it runs after the import's connections are released.
+            return task.run
+
+        return import_table
+
+    def get_imported_row_count(self, import_task):
+        """Returns the number of rows recorded in the metadata of an import, or None if it isn't known."""
+        try:
+            metadata_target = import_task.metadata_output()
+            if not metadata_target.exists():
+                return None
+            with metadata_target.open('r') as metadata_file:
+                return json.load(metadata_file).get('num_rows')
+        except Exception:  # pylint: disable=broad-except
+            log.warning('Unable to read the metadata of the import of %s', import_task.table_name, exc_info=True)
+            return None
+
+    def get_table_sizes(self, database, table_names):
+        """
+        Estimate the size of each of the tables from information_schema.
+
+        Returns:
+            A dict containing a tuple of the approximate number of rows and number of bytes of data for each table.
+        """
+        if not mysql_client_available:
+            raise ImportError('mysql client library not available')
+
+        with self.input()['credentials'].open('r') as credentials_file:
+            cred = json.load(credentials_file)
+        connection = mysql.connector.connect(
+            host=cred['host'],
+            port=int(cred['port']),
+            user=cred['username'],
+            password=cred['password'],
+            database=database,
+        )
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT table_name, table_rows, data_length FROM information_schema.tables"
+                " WHERE table_schema = %s AND table_name IN ({0})".format(','.join(['%s'] * len(table_names))),
+                tuple([database] + table_names)
+            )
+            rows = cursor.fetchall()
+        finally:
+            connection.close()
+
+        table_sizes = dict((table_name, (0, 0)) for table_name in table_names)
+        for table_name, num_rows, num_bytes in rows:
+            table_sizes[table_name] = (int(num_rows or 0), int(num_bytes or 0))
+        return table_sizes
+
+
+def allocate_mappers(sizes, connection_budget):
+    """
+    Share out a connection budget between tables in proportion to their sizes.
+
+    Every table gets at least one mapper and at most the whole budget, so the total may be more than the budget, in
+    which case the imports can't all run at once.
+
+    Returns:
+        A list of the number of mappers for each of the sizes.
+    """
+    total_size = sum(sizes)
+    if total_size == 0:
+        return [1] * len(sizes)
+    return [
+        max(1, min(connection_budget, int(round(connection_budget * size / float(total_size))))) for size in sizes
+    ]
+
+
+class ConnectionBudgetScheduler(object):
+    """
+    Runs jobs concurrently, as long as the total number of connections of the running jobs fits in a budget.
+
+    Whenever connections are released, the first waiting job that fits in the remaining budget is started, so a job
+    that needs many connections doesn't hold up smaller ones.
+
+    A job's function may return another function, which is called once the job's connections have been released, for
+    any work that follows the job without using the database.
+    """
+
+    def __init__(self, connection_budget):
+        self.connection_budget = connection_budget
+        self.available_connections = connection_budget
+        self.condition = threading.Condition()
+        self.errors = []
+
+    def run(self, jobs):
+        """
+        Run the jobs, waiting for all of them to finish.
+
+        If a job raises an exception, no more jobs are started, and the first exception is re-raised once the running
+        jobs have finished.
+
+        Args:
+            jobs (list): a list of (name, number of connections, function) tuples.  Jobs are started in this order as
+                far as the budget allows.  Jobs needing more than the whole budget are given the whole budget.
+        """
+        pending = [(name, min(connections, self.connection_budget), function) for name, connections, function in jobs]
+        threads = []
+        with self.condition:
+            while pending and not self.errors:
+                job = next((job for job in pending if job[1] <= self.available_connections), None)
+                if job is None:
+                    self.condition.wait()
+                    continue
+
+                pending.remove(job)
+                name, connections, function = job
+                self.available_connections -= connections
+                log.info('Starting %s with %d connections, %d of %d left', name, connections,
+                         self.available_connections, self.connection_budget)
+                thread = threading.Thread(target=self._run_job, args=(connections, function))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        if self.errors:
+            exc_info = self.errors[0]
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _run_job(self, connections, function):
+        """Call the function of a job, release its connections once it is done, and then call any function it returned."""
+        follow_up = None
+        try:
+            follow_up = function()
+        except Exception:  # pylint: disable=broad-except
+            with self.condition:
+                self.errors.append(sys.exc_info())
+        finally:
+            with self.condition:
+                self.available_connections += connections
+                self.condition.notify_all()
+
+        if follow_up is not None:
+            try:
+                follow_up()
+            except Exception:  # pylint: disable=broad-except
+                with self.condition:
+                    self.errors.append(sys.exc_info())
+                    self.condition.notify_all()
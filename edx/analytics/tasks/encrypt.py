@@ -1,9 +1,14 @@
 """
 Tasks for performing encryption on export files.
 """
+import atexit
 from contextlib import contextmanager
 import logging
+import shutil
+import subprocess
+import sys
 import tempfile
+import threading
 
 import gnupg
 
@@ -12,10 +17,15 @@ from edx.analytics.tasks.util.tempdir import make_temp_directory
 log = logging.getLogger(__name__)
 
 
+# Plaintext is passed to gpg, and ciphertext copied from it, in large blocks to keep the number of system calls and
+# writes to remote files low.
+ENCRYPTION_BUFFER_SIZE = 1024 * 1024
+
+
 @contextmanager
 def make_encrypted_file(output_file, key_file_targets, recipients=None):
     """
-    Creates a file object to be written to, whose contents will afterwards be encrypted.
+    Creates a file object to be written to, whose contents will be encrypted as they are written.
 
     Parameters:
         output_file:  a file object, opened for writing.
@@ -23,23 +33,73 @@ def make_encrypted_file(output_file, key_file_targets, recipients=None):
         recipients:  an optional list of recipients to be loaded.  If not specified, uses all loaded keys.
     """
     with make_temp_directory(prefix="encrypt") as temp_dir:
-        # Use temp directory to hold gpg keys.
-        gpg = gnupg.GPG(gnupghome=temp_dir)
-        gpg.encoding = 'utf-8'
-        _import_key_files(gpg, key_file_targets)
-
-        # Create a temp file to contain the unencrypted output, in the same temp directory.
-        with tempfile.NamedTemporaryFile(dir=temp_dir, delete=False) as temp_input_file:
-            temp_input_filepath = temp_input_file.name
-            yield temp_input_file
-
-        # Encryption produces a second file in the same temp directory.
-        temp_encrypted_filepath = "{filepath}.gpg".format(filepath=temp_input_filepath)
-        if recipients is None:
-            recipients = [key['keyid'] for key in gpg.list_keys()]
-        with open(temp_input_filepath, 'r') as temp_input_file:
-            _encrypt_file(gpg, temp_input_file, temp_encrypted_filepath, recipients)
-        _copy_file_to_open_file(temp_encrypted_filepath, output_file)
+        gpg_instance = make_keyring(temp_dir, key_file_targets)
+        with _make_encrypted_stream(output_file, gpg_instance, recipients) as encrypted_output_file:
+            yield encrypted_output_file
+
+
+@contextmanager
+def _make_encrypted_stream(output_file, gpg_instance, recipients):
+    """Yields the input of a gpg process that encrypts to the output file, waiting for it to finish afterwards."""
+    encryption = GpgEncryptionProcess(output_file, gpg_instance, recipients)
+    try:
+        yield encryption.input
+    except Exception:
+        exc_info = sys.exc_info()
+        encryption.abort()
+        raise exc_info[0], exc_info[1], exc_info[2]
+    encryption.finish()
+
+
+def make_keyring(gnupghome, key_file_targets):
+    """Return a GPG instance with its home in the given directory, and import the key files into its keyring."""
+    gpg_instance = gnupg.GPG(gnupghome=gnupghome)
+    gpg_instance.encoding = 'utf-8'
+    _import_key_files(gpg_instance, key_file_targets)
+    return gpg_instance
+
+
+class KeyringCache(object):
+    """
+    Keeps a keyring for each distinct set of key files, so that the keys are only read and imported once.
+
+    Each keyring lives in its own temporary GPG home directory, so that data encrypted with it using the implied
+    recipients is only encrypted for the keys in that set. Call cleanup() to delete the directories once the keyrings
+    are no longer needed.
+
+    The `imports_avoided` counter is the number of key file imports that were skipped by reusing a keyring.
+    """
+
+    def __init__(self):
+        self.keyrings = {}
+        self.recipients = {}
+        self.imports_avoided = 0
+
+    def get_keyring(self, key_file_targets):
+        """Return a GPG instance whose keyring contains exactly the keys in the key files."""
+        cache_key = frozenset(key_file_target.path for key_file_target in key_file_targets)
+        if cache_key in self.keyrings:
+            self.imports_avoided += len(cache_key)
+        else:
+            gnupghome = tempfile.mkdtemp(prefix='encrypt')
+            # Make sure the directory is deleted, even if cleanup() is never called.
+            atexit.register(shutil.rmtree, gnupghome, True)
+            self.keyrings[cache_key] = make_keyring(gnupghome, key_file_targets)
+
+        return self.keyrings[cache_key]
+
+    def get_recipients(self, gpg_instance):
+        """Return the key ids of all of the keys in one of the keyrings, only running gpg to list them once."""
+        if gpg_instance.gnupghome not in self.recipients:
+            self.recipients[gpg_instance.gnupghome] = [key['keyid'] for key in gpg_instance.list_keys()]
+        return self.recipients[gpg_instance.gnupghome]
+
+    def cleanup(self):
+        """Delete all of the keyrings."""
+        for gpg_instance in self.keyrings.itervalues():
+            shutil.rmtree(gpg_instance.gnupghome, True)
+        self.keyrings = {}
+        self.recipients = {}
 
 
 def _import_key_files(gpg_instance, key_file_targets):
@@ -54,23 +114,104 @@ def _import_key_files(gpg_instance, key_file_targets):
             gpg_instance.import_keys(gpg_key_file.read())
 
 
-def _encrypt_file(gpg_instance, input_file, encrypted_filepath, recipients):
-    """Encrypts a given file open for read, and writes result to a file."""
-    gpg_instance.encrypt_file(
-        input_file,
-        recipients,
-        always_trust=True,
-        output=encrypted_filepath,
-        armor=False,
-    )
+class GpgEncryptionProcess(object):
+    """
+    Encrypts the data written to `input` with a gpg process, and writes the ciphertext to an open file.
+
+    Nothing is staged on the local disk: the plaintext is piped to gpg and a background thread copies the ciphertext to
+    the output file as gpg produces it, so encryption and writing the output run in parallel with the code producing
+    the data. Call finish() once all of the data has been written, or abort() to give up.
+
+    Parameters:
+        output_file: a file object, opened for writing.
+        gpg_instance: a gnupg.GPG instance whose keyring contains the keys of the recipients.
+        recipients: an optional list of recipients to encrypt to.  If not specified, uses all keys in the keyring.
+        compress: whether gpg should compress the data before encrypting it.  Turn this off for data that is already
+            compressed, since compressing it again only wastes time.
+        buffer_size: the size of the blocks passed to and read from gpg.
+    """
+
+    def __init__(self, output_file, gpg_instance, recipients=None, compress=True, buffer_size=ENCRYPTION_BUFFER_SIZE):
+        if recipients is None:
+            recipients = [key['keyid'] for key in gpg_instance.list_keys()]
+
+        command = [
+            gpg_instance.gpgbinary,
+            '--homedir', gpg_instance.gnupghome,
+            '--batch',
+            '--no-tty',
+            '--quiet',
+            '--trust-model', 'always',
+            '--output', '-',
+            '--encrypt',
+        ]
+        if not compress:
+            command.extend(['--compress-algo', 'none'])
+        for recipient in recipients:
+            command.extend(['--recipient', recipient])
+
+        # gpg only writes diagnostics to stderr, keep them in a file so that a full pipe can never block it.
+        self.stderr_file = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            command, bufsize=buffer_size, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.stderr_file
+        )
+        self.input = self.process.stdin
+
+        self.copy_errors = []
+        self.copy_thread = threading.Thread(
+            target=_copy_stream, args=(self.process.stdout, output_file, buffer_size, self.copy_errors)
+        )
+        self.copy_thread.daemon = True
+        self.copy_thread.start()
+
+    def finish(self):
+        """Wait for all of the data written to `input` to be encrypted and written to the output file."""
+        try:
+            self.input.close()
+        except IOError:
+            # gpg exited before reading all of its input, the exit code explains why.
+            pass
+        self.copy_thread.join()
+        return_code = self.process.wait()
+        self.process.stdout.close()
+
+        self.stderr_file.seek(0)
+        stderr = self.stderr_file.read()
+        self.stderr_file.close()
+
+        if self.copy_errors:
+            exc_info = self.copy_errors[0]
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if return_code != 0:
+            raise IOError('gpg failed with exit code {0}: {1}'.format(return_code, stderr))
+
+    def abort(self):
+        """Stop encrypting, discarding any data that has not been written to the output file yet."""
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.input.close()
+        except IOError:
+            pass
+        self.copy_thread.join()
+        self.process.wait()
+        self.process.stdout.close()
+        self.stderr_file.close()
 
 
-def _copy_file_to_open_file(filepath, output_file):
-    """Copies a filepath to a file object already opened for writing."""
-    with open(filepath, 'r') as src_file:
+def _copy_stream(source_file, destination_file, buffer_size, errors):
+    """Copy a file object to another in large blocks, recording any exception raised in `errors`."""
+    try:
         while True:
-            transfer_buffer = src_file.read(1024)
-            if transfer_buffer:
-                output_file.write(transfer_buffer)
-            else:
+            transfer_buffer = source_file.read(buffer_size)
+            if not transfer_buffer:
                 break
+            destination_file.write(transfer_buffer)
+    except Exception:  # pylint: disable=broad-except
+        errors.append(sys.exc_info())
+        # Keep reading, so that gpg doesn't block writing to a pipe that nobody is reading.
+        try:
+            while source_file.read(buffer_size):
+                pass
+        except IOError:
+            pass
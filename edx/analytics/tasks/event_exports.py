@@ -1,15 +1,20 @@
 """Group events by institution and export them for research purposes"""
 
+from collections import deque
 import logging
+from multiprocessing.pool import ThreadPool
 import os
+import sys
 
 import gnupg
 import luigi
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import CourseKey
 import luigi.date_interval
 import yaml
 import gzip
 
-from edx.analytics.tasks.encrypt import make_encrypted_file
+from edx.analytics.tasks.encrypt import GpgEncryptionProcess, KeyringCache
 from edx.analytics.tasks.mapreduce import MultiOutputMapReduceJobTask
 from edx.analytics.tasks.pathutil import EventLogSelectionMixin
 from edx.analytics.tasks.url import url_path_join, ExternalURL, get_target_from_url
@@ -17,6 +22,13 @@ import edx.analytics.tasks.util.opaque_key_util as opaque_key_util
 
 log = logging.getLogger(__name__)
 
+# The most URLs and course IDs whose organization is remembered by each mapper. The caches are emptied when they fill
+# up, which keeps memory bounded even though URLs can be almost unique for each event.
+MAX_CACHED_ORG_LOOKUPS = 100000
+
+# The number of output files that may be finishing their encryption and upload while the next one is written.
+DEFAULT_CONCURRENT_ENCRYPTIONS = 2
+
 
 class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
     """
@@ -60,6 +72,18 @@ class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
         default_from_config={'section': 'event-export', 'name': 'required_path_text'}
     )
 
+    org_id_for_url = None
+    org_id_for_course_id = None
+    keyring_cache = None
+    concurrent_encryptions = None
+    encryption_pool = None
+    pending_outputs = None
+
+    def __init__(self, *args, **kwargs):
+        super(EventExportTask, self).__init__(*args, **kwargs)
+        self.org_id_for_url = {}
+        self.org_id_for_course_id = {}
+
     def requires_local(self):
         return ExternalURL(url=self.config)
 
@@ -75,7 +99,8 @@ class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
 
         # Map org_ids to recipient names, taking in to account org_id aliases. For example, if an org_id Foo is also
         # known as FooX then two entries will appear in this dictionary ('Foo', 'recipient@foo.org') and
-        # ('FooX', 'recipient@foo.org'). Note that both aliases map to the same recipient.
+        # ('FooX', 'recipient@foo.org'). Note that both aliases map to the same recipient. The recipients are
+        # immutable tuples that already include the master key, so they can be shared by every output file.
         self.recipients_for_org_id = {}
         self.primary_org_ids_for_org_id = {}
         for org_id, org_config in self.organizations.iteritems():
@@ -87,6 +112,9 @@ class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
             if not recipients:
                 # provide fallback to legacy parameter name:
                 recipients = [org_config['recipient']]
+            if self.gpg_master_key is not None and self.gpg_master_key not in recipients:
+                recipients = recipients + [self.gpg_master_key]
+            recipients = tuple(recipients)
             self.recipients_for_org_id[org_id] = recipients
             self.primary_org_ids_for_org_id[org_id] = [org_id]
             for alias in org_config.get('other_names', []):
@@ -164,30 +192,129 @@ class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
             )
         )
 
-    def multi_output_reducer(self, key, values, output_file):
+    def init_reducer(self):
+        super(EventExportTask, self).init_reducer()
+        self.keyring_cache = KeyringCache()
+        self.concurrent_encryptions = luigi.configuration.get_config().getint(
+            'event-export', 'concurrent_encryptions', DEFAULT_CONCURRENT_ENCRYPTIONS
+        )
+        self.encryption_pool = ThreadPool(self.concurrent_encryptions)
+        self.pending_outputs = deque()
+
+    def reducer(self, key, values):
         """
         Write values to the appropriate file as determined by the key.
-        Write to the encrypted file by streaming through gzip, which compresses before encrypting
-        """
-        _date_string, org_id = key
-        recipients = self._get_recipients(org_id)
 
-        key_file_targets = [get_target_from_url(url_path_join(self.gpg_key_dir, recipient)) for recipient in recipients]
-        with make_encrypted_file(output_file, key_file_targets) as encrypted_output_file:
-            outfile = gzip.GzipFile(mode='wb', fileobj=encrypted_output_file)
+        The values are gzipped and streamed through gpg into the output file. Once all of the values have been written,
+        waiting for gpg and the output file to finish is handed off to a thread pool so that the next file can be
+        written in the meantime. Up to "concurrent_encryptions" files in the "event-export" configuration section are
+        finished concurrently.
+
+        If anything fails, the files that are already being finished are waited for before the error is raised, and the
+        thread pool and keyrings are cleaned up.
+        """
+        output_path = self.output_path_for_key(key)
+        if output_path:
             try:
-                for value in values:
-                    outfile.write(value.strip())
-                    outfile.write('\n')
-            finally:
-                outfile.close()
+                self._write_encrypted_output(key, values, output_path)
+            except Exception:
+                exc_info = sys.exc_info()
+                pending_exc_info = self._finish_pending_outputs()
+                if pending_exc_info is not None:
+                    log.error('Failed to finish an earlier output file', exc_info=pending_exc_info)
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+        return iter(tuple())
+
+    def _write_encrypted_output(self, key, values, output_path):
+        """Write the values through gpg to the output file, and hand off finishing the file to the thread pool."""
+        output_file = get_target_from_url(output_path).open('w')
+        encryption = None
+        try:
+            keyring = self._get_keyring(key)
+            # The output is gzipped before it is encrypted, so gpg doesn't need to compress it again.
+            encryption = GpgEncryptionProcess(
+                output_file, keyring, self.keyring_cache.get_recipients(keyring), compress=False
+            )
+            self.multi_output_reducer(key, values, encryption.input)
+
+            while len(self.pending_outputs) >= self.concurrent_encryptions:
+                self.pending_outputs.popleft().get()
+        except Exception:
+            exc_info = sys.exc_info()
+            if encryption is not None:
+                encryption.abort()
+            _abort_output(output_file)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        self.pending_outputs.append(
+            self.encryption_pool.apply_async(_finish_encrypted_output, (encryption, output_file))
+        )
+
+    def multi_output_reducer(self, _key, values, output_file):
+        """Write values to the file, compressing them with gzip."""
+        outfile = gzip.GzipFile(mode='wb', fileobj=output_file)
+        try:
+            for value in values:
+                outfile.write(value.strip() + '\n')
+        finally:
+            outfile.close()
+
+    def final_reducer(self):
+        """Wait for the remaining output files to be finished, and delete the keyrings."""
+        exc_info = self._finish_pending_outputs()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        return tuple()
+
+    def _finish_pending_outputs(self):
+        """
+        Wait for all of the output files that are being finished, then stop the thread pool and delete the keyrings.
+
+        Returns:
+            The exc_info of the first output file that failed, or None if they all succeeded.  Any later failures are
+            logged.
+        """
+        first_exc_info = None
+        try:
+            while self.pending_outputs:
+                try:
+                    self.pending_outputs.popleft().get()
+                except Exception:  # pylint: disable=broad-except
+                    if first_exc_info is None:
+                        first_exc_info = sys.exc_info()
+                    else:
+                        log.exception('Failed to finish an output file')
+        finally:
+            self.encryption_pool.close()
+            self.encryption_pool.join()
+            log.info(
+                'Used %d keyrings, avoiding %d key file imports',
+                len(self.keyring_cache.keyrings), self.keyring_cache.imports_avoided
+            )
+            self.keyring_cache.cleanup()
+
+        return first_exc_info
+
+    def _get_keyring(self, key):
+        """Return a keyring containing the keys of the recipients for this key, importing them the first time."""
+        _date_string, org_id = key
+        key_file_targets = [
+            get_target_from_url(url_path_join(self.gpg_key_dir, recipient))
+            for recipient in self._get_recipients(org_id)
+        ]
+        imports_avoided = self.keyring_cache.imports_avoided
+        keyring = self.keyring_cache.get_keyring(key_file_targets)
+        if self.keyring_cache.imports_avoided > imports_avoided:
+            self.incr_counter(
+                'Event Export', 'GPG Key Imports Avoided', self.keyring_cache.imports_avoided - imports_avoided
+            )
+        return keyring
 
     def _get_recipients(self, org_id):
         """Get the correct recipients for the specified organization."""
-        recipients = self.recipients_for_org_id[org_id]
-        if self.gpg_master_key is not None:
-            recipients.append(self.gpg_master_key)
-        return recipients
+        return self.recipients_for_org_id[org_id]
 
     def get_org_id(self, item):
         """
@@ -198,13 +325,6 @@ class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
 
         None is returned if no org information is found in the item.
         """
-        def get_slash_value(input_value, index):
-            """Return index value after splitting input on slashes."""
-            try:
-                return input_value.split('/')[index]
-            except IndexError:
-                return None
-
         try:
             # Different behavior based on type of event source.
             if item['event_source'] == 'server':
@@ -216,13 +336,7 @@ class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
                 # Try to infer the institution from the event data
                 evt_type = item['event_type']
                 if '/courses/' in evt_type:
-                    course_key = opaque_key_util.get_course_key_from_url(evt_type)
-                    if course_key and '/' not in unicode(course_key):
-                        return course_key.org
-                    else:
-                        # It doesn't matter if we found a good deprecated key.
-                        # We need to provide backwards-compatibility.
-                        return get_slash_value(evt_type, 2)
+                    return self._get_org_id_from_url(evt_type, 2)
                 elif '/' in evt_type:
                     return None
                 else:
@@ -234,24 +348,14 @@ class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
                     # we could extract from.  For newer events, we assume this
                     # won't be needed, because context will be present.
                     try:
-                        return get_slash_value(item['event']['problem_id'], 2)
+                        return _get_slash_value(item['event']['problem_id'], 2)
                     except Exception:  # pylint: disable=broad-except
                         return None
             elif item['event_source'] == 'browser':
                 # Note that the context of browser events is ignored.
                 page = item['page']
                 if 'courses' in page:
-                    # This is different than the original algorithm in that it assumes
-                    # the page contains a valid coursename.  The original code
-                    # merely looked for what followed "http[s]://<host>/courses/"
-                    # (and also hoped there were no extra slashes or different content).
-                    course_key = opaque_key_util.get_course_key_from_url(page)
-                    if course_key and '/' not in unicode(course_key):
-                        return course_key.org
-                    else:
-                        # It doesn't matter if we found a good deprecated key.
-                        # We need to provide backwards-compatibility.
-                        return get_slash_value(page, 4)
+                    return self._get_org_id_from_url(page, 4)
             else:
                 # TODO: Handle other event source values (e.g. task or mobile).
                 return None
@@ -260,3 +364,79 @@ class EventExportTask(EventLogSelectionMixin, MultiOutputMapReduceJobTask):
             log.exception('Unable to determine institution for event: %s', unicode(item).encode('utf8'))
 
         return None
+
+    def _get_org_id_from_url(self, url, legacy_index):
+        """
+        Return the organization of the course in a URL, remembering the result for the URL and for the course ID.
+
+        This is different than the original algorithm in that it assumes the URL contains a valid course ID. The
+        original code merely looked for what followed "/courses/" (and also hoped there were no extra slashes or
+        different content). If the course ID is not an opaque key, the organization is taken from the part of the URL
+        at `legacy_index` when it is split on slashes, to provide backwards-compatibility.
+        """
+        cache_key = (url, legacy_index)
+        try:
+            return self.org_id_for_url[cache_key]
+        except KeyError:
+            pass
+
+        org_id = None
+        match = opaque_key_util.COURSE_REGEX.match(url)
+        if match:
+            org_id = self._get_org_id_for_course_id(match.group('course_id'))
+        if org_id is None:
+            # It doesn't matter if we found a good deprecated key.
+            org_id = _get_slash_value(url, legacy_index)
+
+        if len(self.org_id_for_url) >= MAX_CACHED_ORG_LOOKUPS:
+            self.org_id_for_url.clear()
+        self.org_id_for_url[cache_key] = org_id
+        return org_id
+
+    def _get_org_id_for_course_id(self, course_id):
+        """Return the organization of an opaque course ID, or None if it is not one, remembering the result."""
+        try:
+            return self.org_id_for_course_id[course_id]
+        except KeyError:
+            pass
+
+        org_id = None
+        try:
+            course_key = CourseKey.from_string(course_id)
+            if '/' not in unicode(course_key):
+                org_id = course_key.org
+        except InvalidKeyError:
+            pass
+
+        if len(self.org_id_for_course_id) >= MAX_CACHED_ORG_LOOKUPS:
+            self.org_id_for_course_id.clear()
+        self.org_id_for_course_id[course_id] = org_id
+        return org_id
+
+
+def _get_slash_value(input_value, index):
+    """Return index value after splitting input on slashes."""
+    try:
+        return input_value.split('/')[index]
+    except IndexError:
+        return None
+
+
+def _finish_encrypted_output(encryption, output_file):
+    """Wait for gpg to encrypt everything written to it, and then close the output file."""
+    try:
+        encryption.finish()
+    except Exception:
+        exc_info = sys.exc_info()
+        _abort_output(output_file)
+        raise exc_info[0], exc_info[1], exc_info[2]
+    output_file.close()
+
+
+def _abort_output(output_file):
+    """Discard an output file that is being written, without publishing anything at its destination."""
+    # Files that write through a pipe or stream to S3 have to be aborted. luigi's atomic local and S3 files only publish
+    # their data when they are closed, and remove their temporary file once they are garbage collected.
+    abort = getattr(output_file, 'abort', None)
+    if abort is not None:
+        abort()
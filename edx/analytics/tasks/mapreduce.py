@@ -3,11 +3,16 @@ Support executing map reduce tasks.
 """
 from __future__ import absolute_import
 
-import gzip
+import collections
 from hashlib import md5
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
+import Queue
 import StringIO
 import logging
+import sys
+import time
 
 import luigi
 import luigi.hdfs
@@ -16,6 +21,10 @@ import luigi.task
 from luigi import configuration
 
 from edx.analytics.tasks.url import get_target_from_url, url_path_join
+from edx.analytics.tasks.util.decompress import (
+    iter_line_batches, iter_lines, iter_target_chunks, iter_local_split_chunks, get_gzip_command, is_gzip_path,
+    PYTHON_BACKEND
+)
 from edx.analytics.tasks.util.manifest import convert_tasks_to_manifest_if_necessary
 
 
@@ -24,6 +33,16 @@ log = logging.getLogger(__name__)
 
 DEFAULT_MARKER_ROOT = 'hdfs:///tmp/marker'
 
+# The emulated runner reads this many input files concurrently, and buffers at most this many files ahead of the mapper.
+DEFAULT_EMULATED_READER_THREADS = 4
+DEFAULT_EMULATED_PREFETCH_FILES = 8
+# Each file that is being read ahead buffers at most this many decompressed blocks of lines.
+DEFAULT_EMULATED_READ_AHEAD_BLOCKS = 4
+# Uncompressed local files larger than this are divided into byte ranges of this size that are read concurrently.
+DEFAULT_EMULATED_SPLIT_SIZE = 128 * 1024 * 1024
+# The byte ranges are mapped in this many worker processes. A single process maps them in order with everything else.
+DEFAULT_EMULATED_MAP_PROCESSES = 1
+
 
 class MapReduceJobTaskMixin(object):
     """Defines arguments used by downstream tasks to pass to upstream MapReduceJobTask."""
@@ -47,6 +66,8 @@ class MapReduceJobTask(MapReduceJobTaskMixin, luigi.hadoop.JobTask):
     job in process as well.
     """
 
+    hadoop_requirements = None
+
     def job_runner(self):
         # Lazily import this since this module will be loaded on hadoop worker nodes however stevedore will not be
         # available in that environment.
@@ -90,7 +111,11 @@ class MapReduceJobTask(MapReduceJobTaskMixin, luigi.hadoop.JobTask):
         }
 
     def requires_hadoop(self):
-        return convert_tasks_to_manifest_if_necessary(self.requires())
+        # Luigi asks for these many times, and staging a manifest generates and writes out every input path, so only do
+        # it once for each task.
+        if self.hadoop_requirements is None:
+            self.hadoop_requirements = convert_tasks_to_manifest_if_necessary(self.requires())
+        return self.hadoop_requirements
 
 
 class MapReduceJobRunner(luigi.hadoop.HadoopJobRunner):
@@ -127,12 +152,24 @@ class EmulatedMapReduceJobRunner(luigi.hadoop.JobRunner):
     This is a modified version of luigi.hadoop.LocalJobRunner. The key differences are:
 
     * It gracefully handles .gz input files, decompressing them and streaming them directly to the mapper. This mirrors
-      the behavior of hadoop's default file input format. Note this only works for files that support `tell()` and
-      `seek()` since those methods are used by the gzip decompression library.
+      the behavior of hadoop's default file input format. The decompression only reads forward through the file, so
+      .gz files can be read directly from S3 and HDFS.
     * It detects ".manifest" files and assumes that they are in fact just a file that contains paths to the real files
       that should be processed by the task. It makes use of this information to "do the right thing". This mirrors the
       behavior of a manifest input format in hadoop.
     * It sets the "map_input_file" environment variable when running the mapper just like the hadoop streaming library.
+    * It reads input files concurrently in a small thread pool while the mapper processes earlier files. The manifest
+      files are expanded lazily and at most "emulated_prefetch_files" files (see the "map-reduce" configuration
+      section) are read ahead of the mapper, each buffering at most "emulated_read_ahead_blocks" blocks of lines. The
+      files are still mapped one at a time, in order.
+    * The "emulated_gzip_backend" option in the "map-reduce" configuration section can be set to "pigz", "zcat" or
+      "auto" to decompress .gz files by piping them through an external command instead of in process.
+    * Uncompressed local files are divided into line aligned byte ranges of "emulated_split_size" bytes, like hadoop
+      input splits, so that several reader threads can read a large file at once. Set it to 0 to disable splitting.
+      The "map_input_file" environment variable is still set to the path of the whole file for every split. If
+      "emulated_map_processes" is greater than 1, the splits are mapped in that many worker processes, after the rest
+      of the input has been mapped. The job is shared with the workers by forking, so the mapper must not depend on
+      state that it changes while mapping.
 
     Other than that it should behave identically to LocalJobRunner.
 
@@ -154,24 +191,39 @@ class EmulatedMapReduceJobRunner(luigi.hadoop.JobRunner):
         job.init_hadoop()
         job.init_mapper()
         map_output = StringIO.StringIO()
-        input_targets = luigi.task.flatten(job.input_hadoop())
-        for input_target in input_targets:
-            with input_target.open('r') as input_file:
-
-                # S3 files not yet supported since they don't support tell() and seek()
-                if input_target.path.endswith('.gz'):
-                    input_file = gzip.GzipFile(fileobj=input_file)
-                elif input_target.path.endswith('.manifest'):
-                    for url in input_file:
-                        input_targets.append(get_target_from_url(url.strip()))
-                    continue
-
-                os.environ['map_input_file'] = input_target.path
+        input_targets = generate_input_targets(luigi.task.flatten(job.input_hadoop()))
+
+        config = configuration.get_config()
+        split_size = config.getint('map-reduce', 'emulated_split_size', DEFAULT_EMULATED_SPLIT_SIZE)
+        map_processes = config.getint('map-reduce', 'emulated_map_processes', DEFAULT_EMULATED_MAP_PROCESSES)
+        split_targets = []
+        if map_processes > 1:
+            input_targets = exclude_splittable_targets(input_targets, split_size, split_targets)
+
+        input_files = self.read_input_files(input_targets)
+        try:
+            for input_file in input_files:
+                start_time = time.time()
+                os.environ['map_input_file'] = input_file.path
                 try:
                     outputs = job._map_input((line[:-1] for line in input_file))
                     job.internal_writer(outputs, map_output)
                 finally:
                     del os.environ['map_input_file']
+                log.info(
+                    'Read %d bytes from %s in %.3f seconds (%.1f KB/s), mapped in %.3f seconds',
+                    input_file.size,
+                    input_file,
+                    input_file.read_time,
+                    input_file.size / 1024.0 / max(input_file.read_time, 0.001),
+                    time.time() - start_time
+                )
+        finally:
+            # Stop the background reads if the mapper failed.
+            input_files.close()
+
+        if split_targets:
+            self.map_splits_in_processes(job, split_targets, split_size, map_processes, map_output)
 
         map_output.seek(0)
 
@@ -189,6 +241,230 @@ class EmulatedMapReduceJobRunner(luigi.hadoop.JobRunner):
             except Exception:
                 pass
 
+    def map_splits_in_processes(self, job, split_targets, split_size, num_processes, map_output):
+        """Map the byte range splits of large uncompressed local files in a pool of worker processes."""
+        splits = [
+            (target.path, byte_range) for target, byte_range in generate_input_splits(split_targets, split_size)
+        ]
+        log.info('Mapping %d splits of %d files in %d processes', len(splits), len(split_targets), num_processes)
+        pool = multiprocessing.Pool(num_processes, initializer=_set_emulated_map_job, initargs=(job,))
+        try:
+            for (path, byte_range), (output, map_time) in zip(splits, pool.imap(_map_local_split, splits)):
+                map_output.write(output)
+                log.info('Mapped %s bytes %d-%d in %.3f seconds', path, byte_range[0], byte_range[1], map_time)
+            pool.close()
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def read_input_files(self, input_targets):
+        """
+        Yield an `InputFile` for each input file in the order the mapper should process them.
+
+        Up to "emulated_prefetch_files" files are read concurrently by "emulated_reader_threads" threads while the
+        caller is processing earlier files.
+        """
+        config = configuration.get_config()
+        num_threads = config.getint('map-reduce', 'emulated_reader_threads', DEFAULT_EMULATED_READER_THREADS)
+        prefetch_files = config.getint('map-reduce', 'emulated_prefetch_files', DEFAULT_EMULATED_PREFETCH_FILES)
+        read_ahead_blocks = config.getint(
+            'map-reduce', 'emulated_read_ahead_blocks', DEFAULT_EMULATED_READ_AHEAD_BLOCKS
+        )
+        gzip_command = get_gzip_command(config.get('map-reduce', 'emulated_gzip_backend', PYTHON_BACKEND))
+        split_size = config.getint('map-reduce', 'emulated_split_size', DEFAULT_EMULATED_SPLIT_SIZE)
+
+        splits = generate_input_splits(generate_input_targets(input_targets), split_size)
+        pool = ThreadPool(max(num_threads, 1))
+        pending = collections.deque()
+
+        def read_next_target():
+            """Start reading the next input split in the background, returning False if there are none left."""
+            split = next(splits, None)
+            if split is None:
+                return False
+            target, byte_range = split
+            input_file = InputFile(target, max(read_ahead_blocks, 1), gzip_command=gzip_command, byte_range=byte_range)
+            pending.append(input_file)
+            pool.apply_async(input_file.read)
+            return True
+
+        # The file that the caller is iterating over, which must be cancelled too if the caller stops early.
+        current_file = None
+        try:
+            while len(pending) < max(prefetch_files, 1) and read_next_target():
+                pass
+
+            while pending:
+                current_file = pending.popleft()
+                read_next_target()
+                yield current_file
+                current_file = None
+        finally:
+            if current_file is not None:
+                current_file.cancel()
+            for input_file in pending:
+                input_file.cancel()
+            pool.close()
+
+
+class InputFile(object):
+    """
+    An input file that is read by a background thread while it is being iterated over.
+
+    The files are read in the order they are submitted to the thread pool, and iterated over in that same order, so
+    that the file being iterated over has always been picked up by a thread, even if the buffers of the files after it
+    are full.
+
+    Iterating over it yields the lines of the file, including their trailing newline character. If a `byte_range` is
+    given, only the lines of a local file that start within that (start, end) range are read.
+    """
+
+    def __init__(self, input_target, max_blocks, gzip_command=None, byte_range=None):
+        self.path = input_target.path
+        self.input_target = input_target
+        self.gzip_command = gzip_command
+        self.byte_range = byte_range
+        self.size = 0
+        self.read_time = 0.0
+        self.blocks = Queue.Queue(max_blocks)
+        self.cancelled = False
+
+    def __str__(self):
+        if self.byte_range is None:
+            return self.path
+        return '{0} bytes {1}-{2}'.format(self.path, *self.byte_range)
+
+    def read(self):
+        """Read the file into the buffer, blocking when the buffer is full. Runs in a background thread."""
+        try:
+            start_time = time.time()
+            if self.byte_range is not None:
+                chunks = iter_local_split_chunks(self.path, *self.byte_range)
+            else:
+                chunks = iter_target_chunks(self.input_target, gzip_command=self.gzip_command)
+            batches = iter_line_batches(chunks)
+            try:
+                for lines in batches:
+                    self.read_time += time.time() - start_time
+                    self.size += sum(len(line) for line in lines)
+                    if not self._put(lines):
+                        return
+                    start_time = time.time()
+            finally:
+                # Make sure that any decompression process is stopped now, rather than when the generators are
+                # garbage collected.
+                batches.close()
+                chunks.close()
+        except Exception:  # pylint: disable=broad-except
+            self._put(ReadError(sys.exc_info()))
+        else:
+            self._put(None)
+
+    def _put(self, item):
+        """Add an item to the buffer, returning False if reading was cancelled while waiting for space."""
+        while not self.cancelled:
+            try:
+                self.blocks.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def cancel(self):
+        """Stop reading this file, since it will never be iterated over."""
+        self.cancelled = True
+
+    def __iter__(self):
+        while True:
+            lines = self.blocks.get()
+            if lines is None:
+                return
+            elif isinstance(lines, ReadError):
+                raise lines.exc_info[0], lines.exc_info[1], lines.exc_info[2]
+            for line in lines:
+                yield line
+
+
+# An exception raised by a background thread while reading an input file.
+ReadError = collections.namedtuple('ReadError', ['exc_info'])
+
+
+def generate_input_splits(targets, split_size):
+    """
+    Yield a (target, byte range) tuple for each split of each target, with a byte range of None for whole files.
+
+    Only uncompressed local files can be split, since reading from the middle of a file requires seeking.
+    """
+    for target in targets:
+        if is_splittable_target(target, split_size):
+            size = os.path.getsize(target.path)
+            for start in xrange(0, size, split_size):
+                yield target, (start, min(start + split_size, size))
+        else:
+            yield target, None
+
+
+def is_splittable_target(target, split_size):
+    """Returns True if the target is an uncompressed local file that is larger than the split size."""
+    return (
+        split_size > 0 and
+        isinstance(target, luigi.LocalTarget) and
+        not is_gzip_path(target.path) and
+        os.path.getsize(target.path) > split_size
+    )
+
+
+def exclude_splittable_targets(targets, split_size, split_targets):
+    """Yield the targets that can't be split, appending the ones that can to `split_targets`."""
+    for target in targets:
+        if is_splittable_target(target, split_size):
+            split_targets.append(target)
+        else:
+            yield target
+
+
+# The job being run by the emulated runner, in its worker processes.
+_emulated_map_job = None
+
+
+def _set_emulated_map_job(job):
+    """Initialize a worker process with the job whose mapper it runs."""
+    global _emulated_map_job  # pylint: disable=global-statement
+    _emulated_map_job = job
+
+
+def _map_local_split(split):
+    """Map the lines of a byte range of a local file in a worker process, returning the output and the time it took."""
+    path, byte_range = split
+    start_time = time.time()
+    output = StringIO.StringIO()
+    os.environ['map_input_file'] = path
+    try:
+        lines = iter_lines(iter_local_split_chunks(path, *byte_range))
+        outputs = _emulated_map_job._map_input((line[:-1] for line in lines))  # pylint: disable=protected-access
+        _emulated_map_job.internal_writer(outputs, output)
+    finally:
+        del os.environ['map_input_file']
+    return output.getvalue(), time.time() - start_time
+
+
+def generate_input_targets(input_targets):
+    """
+    Yield each target that contains data to be mapped, expanding ".manifest" files into the targets they list.
+
+    Each manifest is read only when the targets before it have been consumed.
+    """
+    for input_target in input_targets:
+        if input_target.path.endswith('.manifest'):
+            with input_target.open('r') as manifest_file:
+                urls = (url.strip() for url in manifest_file)
+                for target in generate_input_targets(get_target_from_url(url) for url in urls if url):
+                    yield target
+        else:
+            yield input_target
+
 
 class MultiOutputMapReduceJobTask(MapReduceJobTask):
     """
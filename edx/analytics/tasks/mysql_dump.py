@@ -4,9 +4,11 @@ Gather data using SQL queries run on MySQL databases.
 from __future__ import absolute_import
 
 from contextlib import closing
+from cStringIO import StringIO
 import csv
 import datetime
 import json
+import sys
 
 import luigi
 import mysql.connector
@@ -26,6 +28,12 @@ class MysqlSelectTask(luigi.Task):
         credentials: Path to the external access credentials file.
         destination: The directory to write the TSV file to.
         database: The name of the database to execute the query on.
+        fetch_size: The number of rows to fetch from the database at a time.  Each batch is converted and written to
+            the output file in a single write.
+        buffer_results: If True, the whole result is read into memory on the client as soon as the query is executed.
+            Otherwise rows are streamed from the server as they are fetched, so the memory used doesn't depend on the
+            size of the result, but the query's result stays open on the server until it has all been written.  Defaults
+            to False, which matches mysql-connector's own default.
 
     Example Credentials File::
 
@@ -46,11 +54,27 @@ class MysqlSelectTask(luigi.Task):
     database = luigi.Parameter(
         default_from_config={'section': 'database-import', 'name': 'database'}
     )
+    fetch_size = luigi.IntParameter(
+        default=10000,
+        default_from_config={'section': 'database-import', 'name': 'fetch_size'},
+        significant=False
+    )
+    buffer_results = luigi.BooleanParameter(
+        default=False,
+        default_from_config={'section': 'database-import', 'name': 'buffer_results'},
+        significant=False
+    )
 
     converters = [
         (datetime.date, lambda date: date.strftime('%Y-%m-%d'))
     ]
 
+    def __init__(self, *args, **kwargs):
+        super(MysqlSelectTask, self).__init__(*args, **kwargs)
+        # Maps each type of value to the function that converts values of that type, so that the converters only have
+        # to be searched once per type instead of once per value.
+        self.converter_cache = {}
+
     @property
     def query(self):
         """
@@ -99,15 +123,24 @@ class MysqlSelectTask(luigi.Task):
             """
             this change allows the context manager to work correctly
             """
+            cursor = conn.cursor(buffered=self.buffer_results)
             try:
-                cursor = conn.cursor()
-
                 cursor.execute(self.query, self.query_parameters)
 
                 with self.output().open('w') as output_file:  # pylint: disable=maybe-no-member
                     self.write_results_to_tsv(cursor, output_file)
-            finally:
-                cursor.close()
+            except Exception:
+                exc_info = sys.exc_info()
+                if self.buffer_results:
+                    cursor.close()
+                else:
+                    # An unbuffered cursor can't be closed while rows of its result are unread, and reading them just
+                    # to discard them could take as long as the dump itself.  The server drops the rest of the result
+                    # once the connection is closed.
+                    conn.close()
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            cursor.close()
 
     def connect(self):
         """
@@ -141,15 +174,19 @@ class MysqlSelectTask(luigi.Task):
             output_file (file): A file-like object that the records will be written to.
         """
 
-        writer = csv.writer(output_file, delimiter="\t", quoting=csv.QUOTE_NONE)
-
+        convert = self.convert
         while True:
-            row = cursor.fetchone()
-            if row is None:
+            rows = cursor.fetchmany(self.fetch_size)
+            if not rows:
                 break
 
+            # Format each batch in memory, so that it is written to the file with a single call.
+            batch_buffer = StringIO()
+            writer = csv.writer(batch_buffer, delimiter="\t", quoting=csv.QUOTE_NONE)
+
             # column values are native python objects, convert them to strings before writing them to the file
-            writer.writerow([self.convert(v) for v in row])
+            writer.writerows([[convert(v) for v in row] for row in rows])
+            output_file.write(batch_buffer.getvalue())
 
     def convert(self, value):
         """
@@ -162,17 +199,37 @@ class MysqlSelectTask(luigi.Task):
         Returns:
             A string representation of the object or - if `value` is None.
         """
-        converted_value = u'-'
-        if value is not None:
-            converter = lambda x: x  # Noop
-            for converter_spec in self.converters:
-                if isinstance(value, converter_spec[0]):
-                    converter = converter_spec[1]
-                    break
+        if value is None:
+            return '-'
+
+        value_type = type(value)
+        try:
+            converter = self.converter_cache[value_type]
+        except KeyError:
+            converter = self.get_converter(value_type)
+            self.converter_cache[value_type] = converter
 
-            converted_value = converter(value)
+        return converter(value)
 
-        return unicode(converted_value).encode('utf-8')
+    def get_converter(self, value_type):
+        """
+        Returns a function that converts values of the given type in to utf-8 encoded strings, using the first matching
+        converter in `converters`.
+
+        Args:
+            value_type (type): The type of the values to convert.
+
+        Returns:
+            A function that takes a value and returns a string.
+        """
+        for converter_spec in self.converters:
+            if issubclass(value_type, converter_spec[0]):
+                converter = converter_spec[1]
+                return lambda value: unicode(converter(value)).encode('utf-8')
+
+        if issubclass(value_type, unicode):
+            return lambda value: value.encode('utf-8')
+        return lambda value: unicode(value).encode('utf-8')
 
 
 def mysql_datetime(datetime_object):
@@ -0,0 +1,443 @@
+"""
+Extract tables from MySQL databases in parallel without Sqoop.
+"""
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import json
+import logging
+import math
+from multiprocessing.pool import ThreadPool
+import Queue
+import time
+
+import luigi
+
+from edx.analytics.tasks.url import ExternalURL
+from edx.analytics.tasks.url import get_existing_urls
+from edx.analytics.tasks.url import get_target_from_url
+from edx.analytics.tasks.url import url_path_join
+from edx.analytics.tasks.util.overwrite import OverwriteOutputMixin
+
+log = logging.getLogger(__name__)
+
+try:
+    import mysql.connector
+    mysql_client_available = True
+except ImportError:
+    log.warn('Unable to import mysql client libraries')
+    # On hadoop slave nodes we don't have mysql client libraries installed so it is pointless to ship this package to
+    # them, instead just fail noisily if we attempt to use these libraries.
+    mysql_client_available = False
+
+
+# Sqoop uses four mappers unless it is told otherwise.
+DEFAULT_NUM_MAPPERS = 4
+
+# The width of each range of primary key values that is extracted into a part file of its own.
+DEFAULT_CHUNK_SIZE = 100000
+
+# Tables with sparse keys are split into wider ranges, so that each part file and query isn't too small.
+MAX_NUM_RANGES = 10000
+
+# The number of rows to fetch from the database at a time.
+FETCH_SIZE = 10000
+
+INTEGER_DATA_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+
+# Columns of these types are treated as booleans by the MySQL JDBC driver, so Sqoop writes them as "true" or "false".
+BOOLEAN_COLUMN_TYPES = ('tinyint(1)', 'bit(1)')
+
+# The characters that Sqoop's --hive-delims-replacement replaces in string values.
+HIVE_DELIMITERS = ('\n', '\r', '\x01')
+
+
+class MysqlRangeExtractTask(OverwriteOutputMixin, luigi.Task):
+    """
+    Reads a table out of a MySQL database and writes it to files in the same format as SqoopImportFromMysql, without
+    needing a Hadoop cluster.
+
+    The table is split into ranges of its primary key, and the ranges are extracted concurrently over a pool of
+    connections, each into a numbered part file (part-m-00000, part-m-00001...) in the destination directory.  The
+    ranges are recorded in the destination before any of them are extracted, and part files are only written once
+    their range has been completely read, so if the extraction fails it resumes with the ranges that are missing when
+    it is run again, rather than starting over.  A partial extraction made with a different where clause or columns is
+    discarded instead.  A _SUCCESS file is written once all of the ranges are done.
+
+    Tables without a single integer primary key are extracted as a single range.
+
+    Parameters:
+        credentials: Path to the external access credentials file.
+        destination: The directory to write the output files to.
+        database: The name of the database to read the table from.
+        table_name: The name of the table to import.
+        num_mappers: The number of connections to extract ranges through concurrently.  Default is 4.
+        chunk_size: The number of primary key values in each range.  Default is 100000.  Ranges are made wider if
+            the table would otherwise be split into more than MAX_NUM_RANGES of them.
+        where: A 'where' clause restricting the rows to extract.
+        verbose: Print more information while working.
+        columns: A list of column names to be included.  Default is to include all columns.
+        null_string: String to use to represent NULL values in output data, escaped in the same way as for Sqoop.
+        fields_terminated_by: defines the file separator to use on output.
+        delimiter_replacement: defines a character to use as replacement for delimiters that appear within data
+            values, for use with Hive.  (Not specified by default.)
+        mysql_delimiters: use standard mysql delimiters (on by default).
+        direct: accepted for compatibility with SqoopImportFromMysql, and ignored.
+
+    Inherited parameters:
+        overwrite: Overwrite any existing imports, including partial ones.  Default is false.
+    """
+    destination = luigi.Parameter(
+        default_from_config={'section': 'database-import', 'name': 'destination'}
+    )
+    credentials = luigi.Parameter(
+        default_from_config={'section': 'database-import', 'name': 'credentials'}
+    )
+    database = luigi.Parameter(
+        default_from_config={'section': 'database-import', 'name': 'database'}
+    )
+    num_mappers = luigi.Parameter(default=None)
+    chunk_size = luigi.IntParameter(default=DEFAULT_CHUNK_SIZE, significant=False)
+    verbose = luigi.BooleanParameter(default=False)
+    table_name = luigi.Parameter()
+    where = luigi.Parameter(default=None)
+    columns = luigi.Parameter(is_list=True, default=[])
+    null_string = luigi.Parameter(default=None)
+    fields_terminated_by = luigi.Parameter(default=None)
+    delimiter_replacement = luigi.Parameter(default=None)
+    mysql_delimiters = luigi.BooleanParameter(default=True)
+    direct = luigi.BooleanParameter(default=True, significant=False)
+
+    # The name of the integer primary key that the table is split on, or None if it can't be split.
+    split_column = None
+
+    def requires(self):
+        return {
+            'credentials': ExternalURL(url=self.credentials),
+        }
+
+    def output(self):
+        return get_target_from_url(url_path_join(self.destination, '_SUCCESS'))
+
+    def metadata_output(self):
+        """Return target to which metadata about the task execution can be written."""
+        return get_target_from_url(url_path_join(self.destination, '.metadata'))
+
+    def ranges_output(self):
+        """Return target to which the ranges of primary key values to extract are written."""
+        return get_target_from_url(url_path_join(self.destination, '.ranges'))
+
+    def part_url(self, index):
+        """Return the URL to which the rows of the range with the given index are written."""
+        return url_path_join(self.destination, 'part-m-{0:05d}'.format(index))
+
+    def part_output(self, index):
+        """Return target to which the rows of the range with the given index are written."""
+        return get_target_from_url(self.part_url(index))
+
+    def remove_output_on_overwrite(self):
+        """Remove the whole destination directory, so that a partial import isn't resumed."""
+        if self.overwrite:
+            self.attempted_removal = True
+            self.remove_destination()
+
+    def remove_destination(self):
+        """Remove the whole destination directory, if it exists."""
+        destination = get_target_from_url(self.destination + '/')
+        if destination.exists():
+            log.info("Removing existing output for task %s", str(self))
+            destination.remove()
+
+    def run(self):
+        self.remove_output_on_overwrite()
+
+        metadata = {
+            'start_time': datetime.datetime.utcnow().isoformat()
+        }
+        num_mappers = int(self.num_mappers) if self.num_mappers is not None else DEFAULT_NUM_MAPPERS
+        connections = Queue.Queue()
+        try:
+            for _index in xrange(num_mappers):
+                connections.put(self.connect())
+
+            connection = connections.get()
+            try:
+                column_types = self.get_column_types(connection)
+                ranges = self.get_ranges(connection)
+            finally:
+                connections.put(connection)
+
+            formatter = SqoopRecordFormatter(
+                [column_type in BOOLEAN_COLUMN_TYPES for _name, column_type in column_types],
+                null_string=self.null_string,
+                fields_terminated_by=self.fields_terminated_by,
+                delimiter_replacement=self.delimiter_replacement,
+                mysql_delimiters=self.mysql_delimiters,
+            )
+            column_names = [name for name, _column_type in column_types]
+
+            # Find the parts that are already done with a single listing of the destination.
+            existing_urls = get_existing_urls(self.part_url(index) for index in xrange(len(ranges)))
+            pending = [index for index in xrange(len(ranges)) if self.part_url(index) not in existing_urls]
+            if len(pending) < len(ranges):
+                log.info('Resuming extraction of %s, %d of %d ranges are already done', self.table_name,
+                         len(ranges) - len(pending), len(ranges))
+
+            def extract(index):
+                """Extract a range using a connection from the pool."""
+                connection = connections.get()
+                try:
+                    return self.extract_range(connection, index, ranges[index], column_names, formatter)
+                finally:
+                    connections.put(connection)
+
+            pool = ThreadPool(num_mappers)
+            try:
+                num_rows = sum(pool.imap_unordered(extract, pending))
+            finally:
+                pool.close()
+                pool.join()
+
+            with self.output().open('w'):
+                pass
+            metadata.update({
+                'succeeded': True,
+                'incremental': None,
+                'num_rows': num_rows,
+            })
+        finally:
+            while not connections.empty():
+                connections.get().close()
+            metadata['end_time'] = datetime.datetime.utcnow().isoformat()
+            try:
+                with self.metadata_output().open('w') as metadata_file:
+                    json.dump(metadata, metadata_file)
+            except Exception:
+                log.exception("Unable to dump metadata information.")
+
+    def connect(self):
+        """Connect to the database using the credentials read from the credentials file."""
+        if not mysql_client_available:
+            raise ImportError('mysql client library not available')
+
+        with self.input()['credentials'].open('r') as credentials_file:
+            cred = json.load(credentials_file)
+
+        return mysql.connector.connect(
+            host=cred['host'],
+            port=int(cred['port']),
+            user=cred['username'],
+            password=cred['password'],
+            database=self.database,
+        )
+
+    def get_column_types(self, connection):
+        """
+        Returns a list of (name, column type) tuples for the columns to extract, in the order they are output.
+
+        Also sets `split_column` to the name of the table's primary key, if it can be split into ranges.
+        """
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT column_name, column_type, data_type, column_key FROM information_schema.columns"
+            " WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position",
+            (self.database, self.table_name)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        if not rows:
+            raise ValueError('Table {0} was not found in database {1}'.format(self.table_name, self.database))
+
+        primary_keys = [row for row in rows if row[3] == 'PRI']
+        self.split_column = None
+        if len(primary_keys) == 1 and primary_keys[0][2].lower() in INTEGER_DATA_TYPES:
+            self.split_column = primary_keys[0][0]
+
+        column_types = dict((row[0].lower(), row[1].lower()) for row in rows)
+        if self.columns:
+            unknown_columns = [name for name in self.columns if name.lower() not in column_types]
+            if unknown_columns:
+                raise ValueError('Columns {0} were not found in table {1}'.format(
+                    ', '.join(unknown_columns), self.table_name
+                ))
+            return [(name, column_types[name.lower()]) for name in self.columns]
+        else:
+            return [(row[0], row[1].lower()) for row in rows]
+
+    def get_ranges(self, connection):
+        """
+        Returns a list of [lower, upper) bounds of primary key values, one for each part file.
+
+        The ranges of an earlier, incomplete extraction are reused, so that its part files are still valid.  They are
+        recorded along with the where clause and columns, and if either has changed since, the earlier extraction is
+        removed, since its part files hold the wrong rows or columns.
+        """
+        options = {
+            'where': self.where,
+            'columns': list(self.columns),
+        }
+        ranges_target = self.ranges_output()
+        if ranges_target.exists():
+            with ranges_target.open('r') as ranges_file:
+                recorded = json.load(ranges_file)
+            if isinstance(recorded, dict) and all(recorded.get(name) == value for name, value in options.iteritems()):
+                return recorded['ranges']
+            log.warning('Discarding the incomplete extraction of %s, which was made with a different where clause or '
+                        'columns', self.table_name)
+            self.remove_destination()
+
+        ranges = [[None, None]]
+        if self.split_column is not None:
+            cursor = connection.cursor()
+            query = "SELECT MIN({key}), MAX({key}) FROM {table}".format(key=self.split_column, table=self.table_name)
+            if self.where is not None:
+                query += " WHERE {where}".format(where=self.where)
+            cursor.execute(query)
+            min_value, max_value = cursor.fetchone()
+            cursor.close()
+            if min_value is not None:
+                ranges = split_key_range(min_value, max_value, self.chunk_size)
+
+        log.info('Extracting %s in %d ranges', self.table_name, len(ranges))
+        with ranges_target.open('w') as ranges_file:
+            json.dump(dict(options, ranges=ranges), ranges_file)
+        return ranges
+
+    def extract_range(self, connection, index, key_range, column_names, formatter):
+        """Write the rows in a range of primary key values to its part file, and return the number of rows."""
+        conditions = []
+        parameters = []
+        lower, upper = key_range
+        if lower is not None:
+            conditions.append('{key} >= %s AND {key} < %s'.format(key=self.split_column))
+            parameters.extend([lower, upper])
+        if self.where is not None:
+            conditions.append('({where})'.format(where=self.where))
+
+        query = "SELECT {columns} FROM {table}".format(columns=','.join(column_names), table=self.table_name)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        start_time = time.time()
+        num_rows = 0
+        # Stream the rows from the server as they are fetched, instead of reading the whole range into memory.
+        cursor = connection.cursor(buffered=False)
+        try:
+            cursor.execute(query, tuple(parameters))
+            with self.part_output(index).open('w') as part_file:
+                while True:
+                    rows = cursor.fetchmany(FETCH_SIZE)
+                    if not rows:
+                        break
+                    part_file.write(''.join([formatter.format_record(row) for row in rows]))
+                    num_rows += len(rows)
+        finally:
+            cursor.close()
+
+        log.debug('Extracted %d rows of %s into part %d in %.1f seconds', num_rows, self.table_name, index,
+                  time.time() - start_time)
+        return num_rows
+
+
+def split_key_range(min_value, max_value, chunk_size, max_num_ranges=MAX_NUM_RANGES):
+    """
+    Returns a list of [lower, upper) bounds that split the values from min_value to max_value into chunks.
+
+    The chunks are made wider than chunk_size if needed, so that there are no more than max_num_ranges of them.
+    """
+    chunk_size = max(chunk_size, int(math.ceil(float(max_value - min_value + 1) / max_num_ranges)))
+    return [
+        [lower, min(lower + chunk_size, max_value + 1)] for lower in xrange(min_value, max_value + 1, chunk_size)
+    ]
+
+
+def unescape_sqoop_string(value):
+    """Interpret the escape sequences in a delimiter or null string, in the same way that Sqoop does."""
+    if value is None or '\\' not in value:
+        return value
+    return value.decode('string_escape')
+
+
+class SqoopRecordFormatter(object):
+    """
+    Formats rows of values read from MySQL in the same way as Sqoop writes them to text files.
+
+    Parameters:
+        boolean_columns: a list with True for each column whose values are booleans.
+        null_string, fields_terminated_by, delimiter_replacement, mysql_delimiters: the Sqoop options.
+    """
+
+    def __init__(self, boolean_columns, null_string=None, fields_terminated_by=None, delimiter_replacement=None,
+                 mysql_delimiters=True):
+        self.boolean_columns = boolean_columns
+        self.null_string = unescape_sqoop_string(null_string) if null_string is not None else 'null'
+        self.field_delimiter = unescape_sqoop_string(fields_terminated_by) or ','
+        self.record_delimiter = '\n'
+        self.delimiter_replacement = delimiter_replacement
+        if mysql_delimiters:
+            self.escaped_by = '\\'
+            self.enclosed_by = "'"
+        else:
+            self.escaped_by = None
+            self.enclosed_by = None
+
+    def format_record(self, row):
+        """Returns a row of values as a line of text."""
+        fields = []
+        for value, is_boolean in zip(row, self.boolean_columns):
+            if value is None:
+                fields.append(self.null_string)
+            elif is_boolean:
+                fields.append('true' if value else 'false')
+            else:
+                fields.append(self.format_value(value))
+        return self.field_delimiter.join(fields) + self.record_delimiter
+
+    def format_value(self, value):
+        """Returns the string that Java would produce for a value, escaped and enclosed as necessary."""
+        if isinstance(value, datetime.datetime):
+            return format_java_timestamp(value)
+        elif isinstance(value, datetime.date):
+            return value.isoformat()
+        elif isinstance(value, datetime.timedelta):
+            return format_java_time(value)
+        elif isinstance(value, bool):
+            return 'true' if value else 'false'
+        elif isinstance(value, (int, long, decimal.Decimal)):
+            return str(value)
+        elif isinstance(value, float):
+            return repr(value)
+
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+        if self.delimiter_replacement is not None:
+            for delimiter in HIVE_DELIMITERS:
+                value = value.replace(delimiter, self.delimiter_replacement)
+        return self.escape_and_enclose(value)
+
+    def escape_and_enclose(self, value):
+        """Escape the special characters in a string, enclosing it if it contains delimiters, as Sqoop does."""
+        if self.escaped_by is None:
+            return value
+
+        value = value.replace(self.escaped_by, self.escaped_by + self.escaped_by)
+        value = value.replace(self.enclosed_by, self.escaped_by + self.enclosed_by)
+        if self.field_delimiter in value or self.record_delimiter in value:
+            value = self.enclosed_by + value + self.enclosed_by
+        return value
+
+
+def format_java_timestamp(value):
+    """Format a datetime like java.sql.Timestamp.toString(), which always includes fractional seconds."""
+    fraction = '{0:06d}'.format(value.microsecond).rstrip('0') or '0'
+    # Unlike strftime(), isoformat() handles years before 1900.
+    return value.replace(microsecond=0).isoformat(' ') + '.' + fraction
+
+
+def format_java_time(value):
+    """Format a timedelta read from a TIME column like java.sql.Time.toString()."""
+    seconds = value.days * 86400 + value.seconds
+    return '{0:02d}:{1:02d}:{2:02d}'.format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
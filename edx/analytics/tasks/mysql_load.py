@@ -1,9 +1,16 @@
 """
 Support for loading data into a Mysql database.
 """
+from functools import partial
 import json
 import logging
 from itertools import chain
+import Queue
+import re
+import sys
+import tempfile
+import threading
+import time
 
 import luigi
 import luigi.configuration
@@ -18,6 +25,7 @@ try:
     import mysql.connector
     from mysql.connector.errors import ProgrammingError
     from mysql.connector import errorcode
+    from mysql.connector.constants import ClientFlag
     mysql_client_available = True
 except ImportError:
     log.warn('Unable to import mysql client libraries')
@@ -26,10 +34,52 @@ except ImportError:
     mysql_client_available = False
 
 
+# Strategies for getting the rows into the table: multi-row INSERT statements, or a bulk LOAD DATA LOCAL INFILE of a
+# tab-separated file.
+INSERT_LOAD_STRATEGY = 'insert'
+LOAD_DATA_LOAD_STRATEGY = 'load_data'
+LOAD_STRATEGIES = (INSERT_LOAD_STRATEGY, LOAD_DATA_LOAD_STRATEGY)
+
+# Rows are staged for LOAD DATA LOCAL INFILE in a temporary file that is written in large blocks.
+LOAD_DATA_BUFFER_SIZE = 1024 * 1024
+
+# INSERT statements are kept to half of the server's max_allowed_packet, or this size if it isn't known.
+DEFAULT_MAX_STATEMENT_SIZE = 1024 * 1024
+
+# The number of batches of rows that may be parsed ahead of the INSERT statements being executed.
+INSERT_QUEUE_SIZE = 4
+
+
 class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
     """
     A task for inserting a data set into RDBMS.
 
+    Parameters:
+        insert_chunk_size: the most rows to insert with each INSERT statement.  Statements are also limited to half of
+            the server's max_allowed_packet, so larger chunks can be used for tables of narrow rows without wide ones
+            exceeding it.  Defaults to the "insert_chunk_size" option of the "database-export" section, or 100.
+        load_strategy: either "insert" to use multi-row INSERT statements, or "load_data"
+            to write the rows to a temporary tab-separated file and bulk load it with LOAD DATA LOCAL INFILE, which is
+            much faster for large tables.  Defaults to the "load_strategy" option of the "database-export" section.
+        use_staging_table: if True, the rows are loaded into an empty staging table, its indexes are built once all of
+            the rows are loaded, and it then atomically replaces the table with RENAME TABLE.  The table stays readable
+            throughout and the load doesn't pay for deleting the old rows, but the whole table is replaced, so init_copy()
+            is not called.  It is only used by tasks that rewrite the entire table, which are those that overwrite it
+            without overriding init_copy(); other tasks load the table directly.  If create_table() is overridden, the
+            staging table is created LIKE the table, and so has its indexes from the start.  Defaults to the
+            "use_staging_table" option of the "database-export" section.
+        bulk_load: if True, unique and foreign key checks are disabled for the session during the load, and a table
+            that doesn't exist yet is created without its secondary indexes, which are then built in a single ALTER
+            TABLE after the rows are loaded.  Since that ALTER TABLE commits the rows before the marker is written,
+            tables are only created this way by loads that replace the whole table, which delete the rows again if
+            they are retried.  This is only done for tables defined by columns and indexes, whose indexes are never
+            unique, so it doesn't let bad data in; it has no effect if create_table() is overridden.  Defaults to the
+            "bulk_load" option of the "database-export" section.
+        load_connections: the number of connections to load the staging table through concurrently, each loading a
+            share of the rows.  The staging table is only swapped in once all of them have committed, so readers still
+            see either all of the rows or none of them.  Only used with use_staging_table, since otherwise the rows are
+            loaded in the same transaction as the marker.  Defaults to the "load_connections" option of the
+            "database-export" section, or 1.
     """
     database = luigi.Parameter(
         default_from_config={'section': 'database-export', 'name': 'database'}
@@ -37,10 +87,35 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
     credentials = luigi.Parameter(
         default_from_config={'section': 'database-export', 'name': 'credentials'}
     )
-    insert_chunk_size = luigi.IntParameter(default=100, significant=False)
+    insert_chunk_size = luigi.IntParameter(
+        default=100,
+        default_from_config={'section': 'database-export', 'name': 'insert_chunk_size'},
+        significant=False
+    )
+    load_strategy = luigi.Parameter(
+        default=INSERT_LOAD_STRATEGY,
+        default_from_config={'section': 'database-export', 'name': 'load_strategy'},
+        significant=False
+    )
+    use_staging_table = luigi.BooleanParameter(
+        default=False,
+        default_from_config={'section': 'database-export', 'name': 'use_staging_table'},
+        significant=False
+    )
+    bulk_load = luigi.BooleanParameter(
+        default=False,
+        default_from_config={'section': 'database-export', 'name': 'bulk_load'},
+        significant=False
+    )
+    load_connections = luigi.IntParameter(
+        default=1,
+        default_from_config={'section': 'database-export', 'name': 'load_connections'},
+        significant=False
+    )
 
     required_tasks = None
     output_target = None
+    max_statement_size = DEFAULT_MAX_STATEMENT_SIZE
 
     def requires(self):
         if self.required_tasks is None:
@@ -87,6 +162,16 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
         """List of tuples defining the names of the columns to include in each index."""
         return []
 
+    @property
+    def staging_table(self):
+        """Name of the table that is loaded and then swapped with the table when use_staging_table is set."""
+        return '{table}__staging'.format(table=self.table)
+
+    @property
+    def old_table(self):
+        """Name that the replaced table has briefly, between the swap and being dropped."""
+        return '{table}__old'.format(table=self.table)
+
     def create_table(self, connection):
         """
         Override to provide code for creating the target table, if not existing.
@@ -98,6 +183,25 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
         using the same transaction.
         """
 
+        query = self._get_create_table_query(self.table)
+        log.debug(query)
+        connection.cursor().execute(query)
+
+    def uses_default_create_table(self):
+        """Returns True if create_table() isn't overridden, so the table is defined by columns and indexes."""
+        return self.create_table.__func__ is MysqlInsertTask.create_table.__func__
+
+    def replaces_whole_table(self):
+        """Returns True if the load replaces every row of the table: it overwrites, and init_copy() isn't overridden."""
+        return self.overwrite and self.init_copy.__func__ is MysqlInsertTask.init_copy.__func__
+
+    def relaxes_session_checks(self):
+        """Returns True if unique and foreign key checks are disabled during the load."""
+        # A custom table definition may have unique secondary indexes, which would no longer be enforced.
+        return self.bulk_load and self.uses_default_create_table()
+
+    def _get_create_table_query(self, table, include_indexes=True):
+        """Returns the query that creates the table from the column definitions, optionally leaving out the indexes."""
         if len(self.columns[0]) != 2:
             # only names of columns specified, no types
             raise NotImplementedError(
@@ -113,15 +217,52 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
         columns.extend(self.default_columns)
         if self.auto_primary_key is not None:
             columns.append(("PRIMARY KEY", "({name})".format(name=self.auto_primary_key[0])))
-        for indexed_cols in self.indexes:
-            columns.append(("INDEX", "({cols})".format(cols=','.join(indexed_cols))))
+        if include_indexes:
+            for indexed_cols in self.indexes:
+                columns.append(("INDEX", "({cols})".format(cols=','.join(indexed_cols))))
 
         coldefs = ','.join(
             '{name} {definition}'.format(name=name, definition=definition) for name, definition in columns
         )
-        query = "CREATE TABLE IF NOT EXISTS {table} ({coldefs})".format(
-            table=self.table, coldefs=coldefs
+        return "CREATE TABLE IF NOT EXISTS {table} ({coldefs})".format(
+            table=table, coldefs=coldefs
+        )
+
+    def _get_create_indexes_query(self, table):
+        """Returns a query that adds all of the indexes to the table at once, or None if there are no indexes."""
+        if not self.indexes:
+            return None
+        index_definitions = ','.join(
+            'ADD INDEX ({cols})'.format(cols=','.join(indexed_cols)) for indexed_cols in self.indexes
         )
+        return "ALTER TABLE {table} {index_definitions}".format(table=table, index_definitions=index_definitions)
+
+    def create_table_without_indexes(self, connection):
+        """
+        Create the table without its secondary indexes, if it doesn't exist yet and its columns are defined.
+
+        Returns True if the table was created, in which case the indexes still have to be added.  Nothing is created if
+        create_table() is overridden, since the table is then not defined by its columns and indexes.
+        """
+        if not self.uses_default_create_table() or not self.indexes or len(self.columns[0]) != 2:
+            return False
+
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+            (self.table,)
+        )
+        if cursor.fetchone() is not None:
+            return False
+
+        query = self._get_create_table_query(self.table, include_indexes=False)
+        log.debug(query)
+        cursor.execute(query)
+        return True
+
+    def set_session_checks(self, connection, enabled):
+        """Enable or disable the unique and foreign key checks of the connection's session."""
+        query = "SET SESSION unique_checks={value}, foreign_key_checks={value}".format(value=1 if enabled else 0)
         log.debug(query)
         connection.cursor().execute(query)
 
@@ -194,25 +335,29 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
         self.attempted_removal = True
         if self.overwrite:
             # first clear the appropriate rows from the luigi mysql marker table
-            marker_table = self.output().marker_table  # side-effect: sets self.output_target if it's None
-            try:
-                query = "DELETE FROM {marker_table} where `target_table`='{target_table}'".format(
-                    marker_table=marker_table,
-                    target_table=self.table,
-                )
-                connection.cursor().execute(query)
-            except mysql.connector.Error as excp:  # handle the case where the marker_table has yet to be created
-                if excp.errno == errorcode.ER_NO_SUCH_TABLE:
-                    pass
-                else:
-                    raise
+            self.delete_markers(connection)
 
             # Use "DELETE" instead of TRUNCATE since TRUNCATE forces an implicit commit before it executes which would
             # commit the currently open transaction before continuing with the copy.
             query = "DELETE FROM {table}".format(table=self.table)
             connection.cursor().execute(query)
 
-    def _execute_insert_query(self, cursor, value_list, column_names):
+    def delete_markers(self, connection):
+        """Remove the rows for the table from the luigi mysql marker table."""
+        marker_table = self.output().marker_table  # side-effect: sets self.output_target if it's None
+        try:
+            query = "DELETE FROM {marker_table} where `target_table`='{target_table}'".format(
+                marker_table=marker_table,
+                target_table=self.table,
+            )
+            connection.cursor().execute(query)
+        except mysql.connector.Error as excp:  # handle the case where the marker_table has yet to be created
+            if excp.errno == errorcode.ER_NO_SUCH_TABLE:
+                pass
+            else:
+                raise
+
+    def _execute_insert_query(self, cursor, value_list, column_names, table=None):
         """
         Constructs and executes the insert query.
 
@@ -222,6 +367,7 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
                 corresponds to the number of rows, and each tuple should have
                 an element for each column.
             column_names - a single string holding names of columns, joined by commas.
+            table - the table to insert into, defaults to the task's table.
 
         Example:
 
@@ -250,33 +396,125 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
         # traditional python "%" operator.
         parameters = "(" + ",".join(["%s"] * num_cols) + ")"
         all_parameters = ",".join([parameters] * num_rows)
+        table = table or self.table
         query = "INSERT INTO {table} ({column_names}) VALUES {values}".format(
-            table=self.table, column_names=column_names, values=all_parameters
+            table=table, column_names=column_names, values=all_parameters
         )
         cursor.execute(query, list(chain.from_iterable(value_list)))
-        log.debug("Wrote %d rows to table %s", num_rows, self.table)
+        log.debug("Wrote %d rows to table %s", num_rows, table)
 
-    def insert_rows(self, cursor):
-        """Inserts row values from source into database table."""
+    def _get_column_names(self):
+        """Returns the names of the columns, joined by commas."""
         if isinstance(self.columns[0], basestring):
-            column_names = ','.join([name for name in self.columns])
+            return ','.join([name for name in self.columns])
         elif len(self.columns[0]) == 2:
-            column_names = ','.join([name for name, _type in self.columns])
+            return ','.join([name for name, _type in self.columns])
         else:
             raise Exception('columns must consist of column strings or '
                             '(column string, type string) tuples (was %r ...)'
                             % (self.columns[0],))
 
-        value_list = []
-        for row_count, row in enumerate(self.rows()):
-            entry = tuple([coerce_for_mysql_connect(elem) for elem in row])
-            value_list.append(entry)
-            if (row_count + 1) % self.insert_chunk_size == 0:
-                self._execute_insert_query(cursor, value_list, column_names)
-                value_list = []
+    def insert_rows(self, cursor, table=None):
+        """
+        Inserts row values from source into database table, or another table with the same columns.
+
+        A background thread reads and coerces the rows and groups them into batches while this thread executes an
+        INSERT statement for each batch, so that parsing overlaps with the round trips to the database.
+        """
+        self._insert_rows_with_cursors([cursor], table)
+
+    def _insert_rows_with_cursors(self, cursors, table=None):
+        """
+        Inserts row values from source using each of the cursors concurrently.
+
+        Each cursor executes INSERT statements for the next batch that is ready until there are none left, so the rows
+        are shared out between them.  If any of the statements fails, the other cursors stop too.
+        """
+        column_names = self._get_column_names()
+
+        producer = InsertBatchProducer(self.rows(), self.insert_chunk_size, self.max_statement_size)
+        batch_sizes = []
+        queue_depths = []
+
+        def insert_batches(cursor):
+            """Execute an INSERT statement for each batch taken from the producer."""
+            try:
+                for value_list in producer:
+                    queue_depths.append(producer.batches.qsize())
+                    self._execute_insert_query(cursor, value_list, column_names, table)
+                    batch_sizes.append(len(value_list))
+            except Exception:
+                producer.cancelled = True
+                raise
+
+        producer.start()
+        start_time = time.time()
+        try:
+            run_concurrently([partial(insert_batches, cursor) for cursor in cursors])
+        finally:
+            producer.cancel()
+
+        elapsed_time = time.time() - start_time
+        num_rows = sum(batch_sizes)
+        log.info(
+            'Inserted %d rows into table %s with %d statements on %d connections in %.1f seconds (%.1f rows/sec), '
+            'average queue depth %.1f batches',
+            num_rows, table or self.table, len(batch_sizes), len(cursors), elapsed_time,
+            num_rows / max(elapsed_time, 0.001), float(sum(queue_depths)) / max(len(queue_depths), 1)
+        )
+
+    def load_rows(self, cursor, table=None):
+        """
+        Bulk loads row values from source into database table (or another table) using LOAD DATA LOCAL INFILE.
+
+        The rows are first written to a temporary tab-separated file, escaped so that MySQL reads back exactly the
+        values that insert_rows() would have inserted.
+        """
+        self._load_rows_with_cursors([cursor], table)
+
+    def _load_rows_with_cursors(self, cursors, table=None):
+        """
+        Bulk loads row values from source using each of the cursors concurrently.
+
+        The rows are dealt out between a temporary file for each cursor, which then loads its file.
+        """
+        column_names = self._get_column_names()
+        num_cols = len(self.columns)
+        table = table or self.table
+
+        data_files = []
+        try:
+            for _cursor in cursors:
+                data_files.append(
+                    tempfile.NamedTemporaryFile(prefix='mysql_load', suffix='.tsv', bufsize=LOAD_DATA_BUFFER_SIZE)
+                )
 
-        if len(value_list) > 0:
-            self._execute_insert_query(cursor, value_list, column_names)
+            num_rows = 0
+            for row in self.rows():
+                # Check data squareness.  There should be no rows with missing or extra columns.
+                if len(row) != num_cols:
+                    raise Exception("Misaligned data in mysql_load: "
+                                    "row '{row}' does not match columns '{columns}'".format(
+                                        row=row, columns=column_names
+                                    ))
+                data_file = data_files[num_rows % len(data_files)]
+                data_file.write('\t'.join([format_for_load_data(elem) for elem in row]))
+                data_file.write('\n')
+                num_rows += 1
+            for data_file in data_files:
+                data_file.flush()
+
+            query = (
+                r"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8 "
+                r"FIELDS TERMINATED BY '\t' ESCAPED BY '\\' LINES TERMINATED BY '\n' ({column_names})"
+            ).format(table=table, column_names=column_names)
+            run_concurrently([
+                partial(cursor.execute, query, (data_file.name,)) for cursor, data_file in zip(cursors, data_files)
+            ])
+            log.debug("Loaded %d rows into table %s", num_rows, table)
+        finally:
+            for data_file in data_files:
+                data_file.close()
 
     def run(self):
         """
@@ -286,20 +524,65 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
         """
         if not (self.table and self.columns):
             raise Exception("table and columns need to be specified")
+        if self.load_strategy not in LOAD_STRATEGIES:
+            raise ValueError('Unknown load strategy {0}, expected one of: {1}'.format(
+                self.load_strategy, ', '.join(LOAD_STRATEGIES)
+            ))
+        if self.load_connections < 1:
+            raise ValueError('load_connections must be at least 1, not {0}'.format(self.load_connections))
 
         self.check_mysql_availability()
 
         # create databases using a separate connection which is not database specific
         self.create_database()
 
-        connection = self.output().connect()
+        use_staging_table = self.use_staging_table
+        if use_staging_table and not self.replaces_whole_table():
+            log.warning(
+                'Loading table %s directly instead of through a staging table, since the load does not replace all of '
+                'its rows.', self.table
+            )
+            use_staging_table = False
+
+        use_load_data = (self.load_strategy == LOAD_DATA_LOAD_STRATEGY)
+        connection = self.output().connect(local_infile=use_load_data)
         try:
+            # The staging table always has its indexes built after it is loaded.  Adding the indexes to the table
+            # commits the rows before the marker is written, so that is only done if a retry would delete them again.
+            indexes_deferred = False
+            if self.bulk_load and not use_staging_table and self.replaces_whole_table():
+                indexes_deferred = self.create_table_without_indexes(connection)
+
             # create table only if necessary:
             self.create_table(connection)
 
-            self.init_copy(connection)
-            cursor = connection.cursor()
-            self.insert_rows(cursor)
+            if not use_load_data:
+                self.max_statement_size = self.get_max_statement_size(connection)
+
+            relax_session_checks = self.relaxes_session_checks()
+            if relax_session_checks:
+                self.set_session_checks(connection, False)
+
+            if use_staging_table:
+                self.load_and_swap_staging_table(connection, use_load_data)
+                self.attempted_removal = True
+                self.delete_markers(connection)
+            else:
+                self.init_copy(connection)
+                cursor = connection.cursor()
+                if use_load_data:
+                    self.load_rows(cursor)
+                else:
+                    self.insert_rows(cursor)
+
+                if indexes_deferred:
+                    # Note that this implicitly commits the rows, which were loaded into a table that didn't exist.
+                    query = self._get_create_indexes_query(self.table)
+                    log.debug(query)
+                    cursor.execute(query)
+
+            if relax_session_checks:
+                self.set_session_checks(connection, True)
 
             # mark as complete in same transaction
             self.output().touch(connection)
@@ -312,6 +595,84 @@ class MysqlInsertTask(OverwriteOutputMixin, luigi.Task):
         finally:
             connection.close()
 
+    def load_and_swap_staging_table(self, connection, use_load_data=False):
+        """
+        Load the rows into a new staging table, index it, and atomically swap it into place of the table.
+
+        Note that MySQL commits implicitly before each of the statements that create, alter, rename or drop a table, so
+        the rows are committed to the staging table before it is swapped in.  If the load fails, the table is untouched.
+
+        If load_connections is more than 1, the additional connections load their share of the rows concurrently with
+        this one, and are all committed before the staging table is swapped in.
+
+        The table must already exist, since a staging table for an overridden create_table() is created LIKE it.
+        """
+        if self.uses_default_create_table():
+            # Secondary indexes are much cheaper to build once all of the rows are loaded.
+            create_staging_table_query = self._get_create_table_query(self.staging_table, include_indexes=False)
+            create_indexes_query = self._get_create_indexes_query(self.staging_table)
+        else:
+            create_staging_table_query = "CREATE TABLE {staging_table} LIKE {table}".format(
+                staging_table=self.staging_table, table=self.table
+            )
+            create_indexes_query = None
+
+        cursor = connection.cursor()
+        for query in [
+                "DROP TABLE IF EXISTS {table}".format(table=self.staging_table),
+                "DROP TABLE IF EXISTS {table}".format(table=self.old_table),
+                create_staging_table_query,
+        ]:
+            log.debug(query)
+            cursor.execute(query)
+
+        worker_connections = []
+        try:
+            for _index in xrange(self.load_connections - 1):
+                worker_connection = self.output().connect(local_infile=use_load_data)
+                worker_connections.append(worker_connection)
+                if self.relaxes_session_checks():
+                    self.set_session_checks(worker_connection, False)
+
+            cursors = [cursor] + [worker_connection.cursor() for worker_connection in worker_connections]
+            if use_load_data:
+                self._load_rows_with_cursors(cursors, table=self.staging_table)
+            else:
+                self._insert_rows_with_cursors(cursors, table=self.staging_table)
+
+            for worker_connection in worker_connections:
+                worker_connection.commit()
+        except:
+            for worker_connection in worker_connections:
+                worker_connection.rollback()
+            raise
+        finally:
+            for worker_connection in worker_connections:
+                worker_connection.close()
+        connection.commit()
+
+        queries = [
+            create_indexes_query,
+            "RENAME TABLE {table} TO {old_table}, {staging_table} TO {table}".format(
+                table=self.table, old_table=self.old_table, staging_table=self.staging_table
+            ),
+            "DROP TABLE {table}".format(table=self.old_table),
+        ]
+        for query in queries:
+            if query is not None:
+                log.debug(query)
+                cursor.execute(query)
+
+    def get_max_statement_size(self, connection):
+        """Returns the largest INSERT statement to send to the server, based on its max_allowed_packet."""
+        cursor = connection.cursor()
+        cursor.execute("SELECT @@max_allowed_packet")
+        row = cursor.fetchone()
+        if row is None or not isinstance(row[0], (int, long)):
+            return DEFAULT_MAX_STATEMENT_SIZE
+        # Leave plenty of room for escaping and the parts of the statement that aren't counted.
+        return row[0] / 2
+
     def check_mysql_availability(self):
         if not mysql_client_available:
             raise ImportError('mysql client library not available')
@@ -335,6 +696,162 @@ def coerce_for_mysql_connect(input):
     return input
 
 
+class InsertBatchProducer(object):
+    """
+    Coerces rows and groups them into batches for INSERT statements in a background thread.
+
+    Iterating over it yields the batches, which are lists of tuples. A batch is finished when it has `max_rows` rows or
+    when adding another row would make the estimated size of its values exceed `max_size` bytes.
+    """
+
+    def __init__(self, rows, max_rows, max_size):
+        self.rows = rows
+        self.max_rows = max_rows
+        self.max_size = max_size
+        self.batches = Queue.Queue(INSERT_QUEUE_SIZE)
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.produce)
+        self.thread.daemon = True
+
+    def start(self):
+        """Start producing batches."""
+        self.thread.start()
+
+    def produce(self):
+        """Read the rows and queue the batches, followed by None or the exception that stopped the thread."""
+        try:
+            value_list = []
+            batch_size = 0
+            for row in self.rows:
+                entry = tuple([coerce_for_mysql_connect(elem) for elem in row])
+                row_size = estimate_row_size(entry)
+                if value_list and (len(value_list) >= self.max_rows or batch_size + row_size > self.max_size):
+                    if not self._put(value_list):
+                        return
+                    value_list = []
+                    batch_size = 0
+                value_list.append(entry)
+                batch_size += row_size
+
+            if value_list and not self._put(value_list):
+                return
+            self._put(None)
+        except Exception:  # pylint: disable=broad-except
+            self._put(sys.exc_info())
+
+    def _put(self, item):
+        """Queue an item, returning False if producing was cancelled while waiting for space."""
+        while not self.cancelled:
+            try:
+                self.batches.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def cancel(self):
+        """Stop producing batches and wait for the thread to exit."""
+        self.cancelled = True
+        self.thread.join()
+
+    def __iter__(self):
+        """
+        Yield batches until there are none left.
+
+        Several threads may iterate at once, each getting different batches.  The end of the batches, or the exception
+        that stopped the producer, is put back for the other threads to find, and they all stop once it is cancelled.
+        """
+        while not self.cancelled:
+            try:
+                item = self.batches.get(timeout=1)
+            except Queue.Empty:
+                continue
+            if item is None:
+                self.batches.put(item)
+                return
+            elif isinstance(item, tuple):
+                self.batches.put(item)
+                raise item[0], item[1], item[2]
+            yield item
+
+
+def run_concurrently(functions):
+    """
+    Call each of the functions in a thread of its own, and wait for all of them to return.
+
+    The first function is called on the calling thread.  If any of them raise an exception, the first one is re-raised
+    once all of the functions have returned.
+    """
+    errors = []
+
+    def call(function):
+        """Call the function, recording any exception that it raises."""
+        try:
+            function()
+        except Exception:  # pylint: disable=broad-except
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=call, args=(function,)) for function in functions[1:]]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    call(functions[0])
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        exc_info = errors[0]
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+
+def estimate_row_size(values):
+    """Estimate the number of bytes that a row of coerced values adds to an INSERT statement."""
+    size = 2
+    for value in values:
+        if isinstance(value, unicode):
+            # Each character takes up to 3 bytes in utf-8.
+            size += 3 * len(value) + 3
+        elif isinstance(value, str):
+            size += len(value) + 3
+        else:
+            size += 24
+    return size
+
+
+# Characters that have to be escaped in the data read by LOAD DATA INFILE, using its default escape character.
+LOAD_DATA_ESCAPES = {
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\0': '\\0',
+}
+LOAD_DATA_ESCAPE_PATTERN = re.compile(r'[\\\t\n\0]')
+
+
+def format_for_load_data(value):
+    """
+    Format a value as a field of a tab-separated file to be read by LOAD DATA INFILE.
+
+    Values are interpreted the same way as coerce_for_mysql_connect() interprets inserted values: None and the strings
+    'None' and '\\N' are loaded as NULL, and text is encoded as utf-8.
+    """
+    if isinstance(value, basestring):
+        if value == 'None' or value == '\\N':
+            return '\\N'
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+    elif value is None:
+        return '\\N'
+    elif isinstance(value, bool):
+        return '1' if value else '0'
+    elif isinstance(value, float):
+        return repr(value)
+    else:
+        value = str(value)
+
+    return LOAD_DATA_ESCAPE_PATTERN.sub(lambda match: LOAD_DATA_ESCAPES[match.group(0)], value)
+
+
 class CredentialFileMysqlTarget(MySqlTarget):
     """
     Represents a table in MySQL, is complete when the update_id is the same as a previous successful execution.
@@ -362,6 +879,26 @@ class CredentialFileMysqlTarget(MySqlTarget):
                 update_id=update_id
             )
 
+    def connect(self, autocommit=False, local_infile=False):
+        """
+        Connect to the database.
+
+        If `local_infile` is True, the connection is allowed to send local files to the server for LOAD DATA LOCAL
+        INFILE statements.
+        """
+        if not local_infile:
+            return super(CredentialFileMysqlTarget, self).connect(autocommit=autocommit)
+
+        return mysql.connector.connect(
+            user=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port,
+            database=self.database,
+            autocommit=autocommit,
+            client_flags=[ClientFlag.LOCAL_FILES]
+        )
+
     def exists(self, connection=None):
         # The parent class fails if the database does not exist. This override tolerates that error.
         try:
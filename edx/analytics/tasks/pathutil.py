@@ -6,27 +6,45 @@ Supports outputs to HDFS, S3, and local FS.
 
 """
 
-import boto
 import datetime
 import fnmatch
+import hashlib
 import logging
 import os
 import re
+import sre_constants
+import sre_parse
 
 import luigi
+import luigi.configuration
 import luigi.hdfs
 import luigi.format
 import luigi.task
 
 from luigi.date_interval import DateInterval
 
-from edx.analytics.tasks.s3_util import generate_s3_sources, get_s3_bucket_key_names
+from edx.analytics.tasks.s3_util import (
+    generate_s3_sources,
+    get_s3_bucket_key_names,
+    get_s3_connection,
+    list_s3_prefix_shards,
+    list_s3_prefixes_in_parallel,
+    DEFAULT_LISTING_THREADS,
+)
 from edx.analytics.tasks.url import ExternalURL, UncheckedExternalURL, url_path_join, get_target_from_url
 from edx.analytics.tasks.util import eventlog
 
 
 log = logging.getLogger(__name__)
 
+# Kinds of path segments that can appear in a pattern whose date group has a known location.
+LITERAL_SEGMENT = 'literal'
+FOLDER_SEGMENT = 'folder'
+DATE_SEGMENT = 'date'
+
+# Python 2.7 can't compile a regex with more than 100 groups, counting the implicit group for the whole match.
+MAX_REGEX_GROUPS = 99
+
 
 class PathSetTask(luigi.Task):
     """
@@ -55,10 +73,10 @@ class PathSetTask(luigi.Task):
             if src.startswith('s3'):
                 # connect lazily as needed:
                 if self.s3_conn is None:
-                    self.s3_conn = boto.connect_s3()
+                    self.s3_conn = get_s3_connection()
                 for _bucket, _root, path in generate_s3_sources(self.s3_conn, src, self.include):
                     source = url_path_join(src, path)
-                    yield ExternalURL(source)
+                    yield self._listed_url(source)
             else:
                 # Apply the include patterns to the relative path below the src directory.
                 for dirpath, _dirnames, files in os.walk(src):
@@ -66,7 +84,15 @@ class PathSetTask(luigi.Task):
                         filepath = os.path.join(dirpath, filename)
                         relpath = os.path.relpath(filepath, src)
                         if any(fnmatch.fnmatch(relpath, include_val) for include_val in self.include):
-                            yield ExternalURL(filepath)
+                            yield self._listed_url(filepath)
+
+    def _listed_url(self, url):
+        """
+        Return an UncheckedExternalURL for a path that was just found by listing its source.
+
+        There is no need for luigi to check the existence of each of these paths individually.
+        """
+        return UncheckedExternalURL(url)
 
     def manifest_file_list(self):
         """Write each individual path to a manifest file and yield the path to that file."""
@@ -137,6 +163,7 @@ class EventLogSelectionTask(EventLogSelectionDownstreamMixin, luigi.WrapperTask)
             self.interval.date_b + self.expand_interval
         )
         self.requirements = None
+        self.url_regexes = None
 
     def requires(self):
         # This method gets called several times. Avoid making multiple round trips to S3 by caching the first result.
@@ -169,45 +196,251 @@ class EventLogSelectionTask(EventLogSelectionDownstreamMixin, luigi.WrapperTask)
         return [UncheckedExternalURL(url) for url_gen in url_gens for url in url_gen if self.should_include_url(url)]
 
     def _get_s3_urls(self, source):
-        """Recursively list all files inside the source URL directory."""
-        s3_conn = boto.connect_s3()
+        """
+        Recursively list the files inside the source URL directory that could be selected.
+
+        If the patterns determine where the files for each date are stored, only the prefixes for dates in the interval
+        are listed. Otherwise the whole directory is listed.
+        """
+        s3_conn = get_s3_connection()
+        date_prefixes = self._get_date_prefixes(source, lambda url: self._list_s3_folders(s3_conn, url))
+        if date_prefixes is None:
+            return self._get_all_s3_urls(s3_conn, source)
+        else:
+            log.debug('Listing %d date prefixes of %s', len(date_prefixes), source)
+            return self._get_s3_urls_for_prefixes(source, date_prefixes)
+
+    def _get_all_s3_urls(self, s3_conn, source):
+        """
+        Recursively list all files inside the source URL directory.
+
+        Each "folder" immediately below the source is listed in a separate thread. If the "listing_cache" option of the
+        "event-logs" configuration section points to a directory, the listing is saved there, and later runs only
+        re-list the part of each folder that can contain files for dates in the interval.
+        """
+        cache_target = self._get_listing_cache_target(source)
+
         bucket_name, root = get_s3_bucket_key_names(source)
-        bucket = s3_conn.get_bucket(bucket_name)
-        for key_metadata in bucket.list(root):
-            if key_metadata.size > 0:
-                key_path = key_metadata.key[len(root):].lstrip('/')
-                yield url_path_join(source, key_path)
+        prefixes, keys = list_s3_prefix_shards(s3_conn, source)
+
+        cached_keys_for_prefix = self._read_listing_cache(cache_target)
+        markers = {}
+        for prefix in prefixes:
+            marker = self._get_listing_marker(source, root, prefix, cached_keys_for_prefix.get(prefix, []))
+            if marker is not None:
+                markers[prefix] = marker
+        log.debug('Listing %d prefixes of %s, %d of them incrementally', len(prefixes), source, len(markers))
+
+        keys_for_prefix = list_s3_prefixes_in_parallel(
+            bucket_name, prefixes, markers=markers, num_threads=self._get_listing_threads()
+        )
+        for prefix, marker in markers.iteritems():
+            unchanged_keys = [key for key in cached_keys_for_prefix[prefix] if key <= marker]
+            keys_for_prefix[prefix] = unchanged_keys + keys_for_prefix[prefix]
+
+        if cache_target is not None:
+            self._write_listing_cache(cache_target, keys_for_prefix)
+
+        for prefix in prefixes:
+            keys.extend(keys_for_prefix[prefix])
+        for key in keys:
+            yield self._get_s3_url_for_key(source, root, key)
+
+    def _get_s3_urls_for_prefixes(self, source, url_prefixes):
+        """List all files inside the source URL directory whose URLs start with one of the given prefixes."""
+        bucket_name, root = get_s3_bucket_key_names(source)
+        key_prefixes = [get_s3_bucket_key_names(url_prefix)[1] for url_prefix in url_prefixes]
+        keys_for_prefix = list_s3_prefixes_in_parallel(
+            bucket_name, key_prefixes, num_threads=self._get_listing_threads()
+        )
+        for key_prefix in key_prefixes:
+            for key in keys_for_prefix[key_prefix]:
+                yield self._get_s3_url_for_key(source, root, key)
+
+    def _list_s3_folders(self, s3_conn, url):
+        """Return the URLs of the "folders" immediately below the given S3 URL."""
+        _bucket_name, root = get_s3_bucket_key_names(url)
+        prefixes, _keys = list_s3_prefix_shards(s3_conn, url)
+        return [url_path_join(url, prefix[len(root):].lstrip('/')) for prefix in prefixes]
+
+    def _get_listing_threads(self):
+        """Return the maximum number of S3 prefixes to list concurrently."""
+        return luigi.configuration.get_config().getint('event-logs', 'listing_threads', DEFAULT_LISTING_THREADS)
+
+    def _get_s3_url_for_key(self, source, root, key):
+        """Convert a key name into a URL relative to the source URL."""
+        key_path = key[len(root):].lstrip('/')
+        return url_path_join(source, key_path)
+
+    def _get_listing_cache_target(self, source):
+        """Return the target holding the cached listing of the source, or None if caching is disabled."""
+        cache_root = luigi.configuration.get_config().get('event-logs', 'listing_cache', None)
+        if not cache_root:
+            return None
+        return get_target_from_url(url_path_join(cache_root, hashlib.md5(source).hexdigest() + '.listing'))
+
+    def _read_listing_cache(self, cache_target):
+        """Return a dict mapping each prefix to the sorted list of keys found in it by the previous listing."""
+        keys_for_prefix = {}
+        if cache_target is None or not cache_target.exists():
+            return keys_for_prefix
+
+        with cache_target.open('r') as cache_file:
+            for line in cache_file:
+                prefix, key = line.rstrip('\n').split('\t')
+                keys_for_prefix.setdefault(prefix, []).append(key)
+
+        for keys in keys_for_prefix.itervalues():
+            keys.sort()
+        return keys_for_prefix
+
+    def _write_listing_cache(self, cache_target, keys_for_prefix):
+        """Persist the listing of every prefix so that it can be reused."""
+        try:
+            with cache_target.open('w') as cache_file:
+                for prefix, keys in keys_for_prefix.iteritems():
+                    for key in keys:
+                        cache_file.write('{0}\t{1}\n'.format(prefix, key))
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Unable to save listing cache to %s', cache_target.path)
+
+    def _get_listing_marker(self, source, root, prefix, cached_keys):
+        """
+        Find the last cached key in a prefix that sorts before every key that could be selected for the interval.
+
+        Keys that sort after the marker must be listed again, keys up to and including it can be read from the cache.
+        This is only safe if the patterns fix the layout of the keys in the prefix, so that every key they can select
+        for a date in the interval starts with some literal text followed by the date, and so sorts after that text
+        followed by the first date of the interval.  Returns None if the cache can't be used for this prefix.
+        """
+        prefix_url = self._get_s3_url_for_key(source, root, prefix)
+        date_string = self.interval.date_a.strftime('%Y%m%d')
+        first_selectable_key = None
+        for pattern in self.pattern:
+            segments = get_date_pattern_segments(pattern)
+            if segments is None:
+                return None
+            can_match, date_url_prefix = _get_fixed_date_url_prefix(segments, prefix_url)
+            if not can_match:
+                continue
+            if date_url_prefix is None:
+                return None
+            key = get_s3_bucket_key_names(date_url_prefix + date_string)[1]
+            if first_selectable_key is None or key < first_selectable_key:
+                first_selectable_key = key
+
+        if first_selectable_key is None:
+            return None
+        marker = None
+        for key in cached_keys:
+            if key < first_selectable_key:
+                marker = key
+        return marker
 
     def _get_local_urls(self, source):
+        """Recursively list the files inside the source directory on the local filesystem that could be selected."""
+        date_prefixes = self._get_date_prefixes(source, self._list_local_folders)
+        if date_prefixes is None:
+            return self._get_all_local_urls(source)
+        else:
+            log.debug('Listing %d date prefixes of %s', len(date_prefixes), source)
+            return self._get_local_urls_for_prefixes(date_prefixes)
+
+    def _get_all_local_urls(self, source):
         """Recursively list all files inside the source directory on the local filesystem."""
         for directory_path, _subdir_paths, filenames in os.walk(source):
             for filename in filenames:
                 yield os.path.join(directory_path, filename)
 
+    def _get_local_urls_for_prefixes(self, path_prefixes):
+        """Recursively list all files on the local filesystem whose paths start with one of the given prefixes."""
+        # Each directory is only listed once, however many of the prefixes are inside it.
+        name_prefixes_for_directory = {}
+        for path_prefix in path_prefixes:
+            directory_path, name_prefix = os.path.split(path_prefix)
+            name_prefixes_for_directory.setdefault(directory_path, []).append(name_prefix)
+
+        for directory_path in sorted(name_prefixes_for_directory):
+            if not os.path.isdir(directory_path):
+                continue
+            name_prefixes = tuple(name_prefixes_for_directory[directory_path])
+            for name in sorted(os.listdir(directory_path)):
+                if not name.startswith(name_prefixes):
+                    continue
+                path = os.path.join(directory_path, name)
+                if os.path.isdir(path):
+                    for url in self._get_all_local_urls(path):
+                        yield url
+                else:
+                    yield path
+
+    def _list_local_folders(self, path):
+        """Return the paths of the directories immediately below the given directory."""
+        if not os.path.isdir(path):
+            return []
+        return [
+            os.path.join(path, name, '') for name in sorted(os.listdir(path)) if os.path.isdir(os.path.join(path, name))
+        ]
+
+    def _get_date_prefixes(self, source, list_folders):
+        """
+        Derive the URL prefixes that can contain files for the dates in the interval from the patterns.
+
+        This is only possible if every pattern is anchored at the beginning of the source URL, and each path segment
+        between the source and the date group is either literal text or a folder name wildcard like "[^/]+". For
+        example: "s3://bucket/logs/[^/]+/tracking\\.log-(?P<date>\\d{8}).*". Note that the text preceding the date
+        group must be literal, so dots must be escaped.
+
+        Args:
+            source: the URL of the directory containing the files.
+            list_folders: a function that returns the URLs of the folders immediately below a URL.
+
+        Returns:
+            A sorted list of URL prefixes, or None if the whole source has to be listed.
+        """
+        source_with_slash = url_path_join(source, '')
+        date_strings = [date.strftime('%Y%m%d') for date in self.interval.dates()]
+
+        date_prefixes = set()
+        for pattern in self.pattern:
+            segments = get_date_pattern_segments(pattern)
+            if segments is None:
+                return None
+
+            leading_text = ''
+            while segments[0][0] == LITERAL_SEGMENT:
+                leading_text += segments.pop(0)[1] + '/'
+            if not leading_text.startswith(source_with_slash):
+                return None
+
+            urls = [leading_text]
+            for kind, text in segments:
+                if kind == LITERAL_SEGMENT:
+                    urls = [url + text + '/' for url in urls]
+                elif kind == FOLDER_SEGMENT:
+                    urls = [folder_url for url in urls for folder_url in list_folders(url)]
+                else:
+                    urls = [url + text + date_string for url in urls for date_string in date_strings]
+            date_prefixes.update(urls)
+
+        return sorted(date_prefixes)
+
     def should_include_url(self, url):
         """
         Determine whether the file pointed to by the URL should be included in the set of files used for analysis.
 
         Presently filters first on pattern match and then on the datestamp extracted from the file name.
         """
-        # Find the first pattern (if any) that matches the URL.
-        match = None
-        for pattern in self.pattern:
-            match = re.match(pattern, url)
-            if match:
-                break
-
-        if not match:
+        matched, date_string = self._match_url(url)
+        if not matched:
             log.debug('Excluding due to pattern mismatch: %s', url)
             return False
 
         # If the pattern contains a date group, use that to check if within the requested interval.
         # If it doesn't contain such a group, then assume that it should be included.
         should_include = True
-        if 'date' in match.groupdict():
-            parsed_datetime = datetime.datetime.strptime(match.group('date'), '%Y%m%d')
-            parsed_date = datetime.date(parsed_datetime.year, parsed_datetime.month, parsed_datetime.day)
-            should_include = parsed_date in self.interval
+        if date_string is not None:
+            should_include = self._parse_date(date_string) in self.interval
 
         if should_include:
             log.debug('Including: %s', url)
@@ -215,10 +448,214 @@ class EventLogSelectionTask(EventLogSelectionDownstreamMixin, luigi.WrapperTask)
             log.debug('Excluding due to date interval: %s', url)
         return should_include
 
+    def _compile_patterns(self):
+        """
+        Combine the patterns into as few compiled regexes as possible.
+
+        Each pattern becomes an alternative wrapped in a uniquely named group, so the name of the last group that was
+        closed identifies the first pattern that matched. The date groups are renamed so that they are unique as well.
+        A pattern whose other group names are already used by the patterns being combined, or that would take the
+        combined regex over the limit on the number of groups, starts a new combined regex.
+
+        Returns a list of (regex, date_group_for_pattern_group) tuples that must be tried in order, where the dict maps
+        the name of each pattern group to the name of its date group, or None if it has no date group.
+        """
+        url_regexes = []
+        alternatives = []
+        group_names = set()
+        num_groups = 0
+        for index, pattern in enumerate(self.pattern):
+            compiled_pattern = re.compile(pattern)
+            has_date_group = 'date' in compiled_pattern.groupindex
+            other_group_names = set(compiled_pattern.groupindex) - set(['date'])
+
+            # Backreferences and inline flags would change meaning if the pattern were embedded in a larger regex.
+            if re.search(r'\\[1-9]|\(\?P=|\(\?[iLmsux]', pattern):
+                url_regexes.extend(self._compile_alternatives(alternatives))
+                alternatives = []
+                url_regexes.append((compiled_pattern, {None: 'date' if has_date_group else None}))
+                continue
+
+            if other_group_names & group_names or num_groups + compiled_pattern.groups + 1 > MAX_REGEX_GROUPS:
+                url_regexes.extend(self._compile_alternatives(alternatives))
+                alternatives = []
+            if not alternatives:
+                group_names = set()
+                num_groups = 0
+            group_names.update(other_group_names)
+            num_groups += compiled_pattern.groups + 1
+
+            pattern_group = 'pattern_{0}'.format(index)
+            date_group = None
+            if has_date_group:
+                date_group = 'date_{0}'.format(index)
+                pattern = pattern.replace('(?P<date>', '(?P<{0}>'.format(date_group))
+            alternatives.append((pattern_group, date_group, '(?P<{0}>{1})'.format(pattern_group, pattern)))
+
+        url_regexes.extend(self._compile_alternatives(alternatives))
+        return url_regexes
+
+    def _compile_alternatives(self, alternatives):
+        """
+        Compile a list of (pattern_group, date_group, wrapped_pattern) alternatives into a single regex if possible.
+
+        Falls back to compiling each alternative on its own if the combined regex can't be compiled.
+        """
+        if not alternatives:
+            return []
+
+        try:
+            return [(
+                re.compile('|'.join(wrapped_pattern for _pattern_group, _date_group, wrapped_pattern in alternatives)),
+                dict((pattern_group, date_group) for pattern_group, date_group, _wrapped_pattern in alternatives)
+            )]
+        except (re.error, AssertionError):
+            # Python 2.7 raises an AssertionError if there are too many groups.
+            log.debug('Unable to combine %d patterns, compiling them separately', len(alternatives))
+            return [
+                (re.compile(wrapped_pattern), {pattern_group: date_group})
+                for pattern_group, date_group, wrapped_pattern in alternatives
+            ]
+
+    def _match_url(self, url):
+        """
+        Find the first pattern (if any) that matches the URL.
+
+        Returns a tuple (matched, date_string) where date_string is the text captured by the date group of the matching
+        pattern, or None if that pattern has no date group.
+        """
+        if self.url_regexes is None:
+            self.url_regexes = self._compile_patterns()
+
+        for url_regex, date_group_for_pattern_group in self.url_regexes:
+            match = url_regex.match(url)
+            if match:
+                if None in date_group_for_pattern_group:
+                    # The pattern was compiled on its own, without a wrapping group.
+                    date_group = date_group_for_pattern_group[None]
+                else:
+                    date_group = date_group_for_pattern_group[match.lastgroup]
+
+                if date_group is None:
+                    return True, None
+                else:
+                    return True, match.group(date_group)
+
+        return False, None
+
+    def _get_date_from_url(self, url):
+        """Return the date captured by the first pattern that matches the URL, or None."""
+        _matched, date_string = self._match_url(url)
+        if date_string is None:
+            return None
+        return self._parse_date(date_string)
+
+    def _parse_date(self, date_string):
+        """
+        Parse a date string formatted as %Y%m%d.
+
+        This is called for every listed file, and slicing is much faster than strptime().
+        """
+        return datetime.date(int(date_string[0:4]), int(date_string[4:6]), int(date_string[6:8]))
+
     def output(self):
         return [task.output() for task in self.requires()]
 
 
+def get_date_pattern_segments(pattern):
+    """
+    Split a pattern into the path segments that precede its date group, if their structure is simple enough.
+
+    Returns a list of (kind, text) tuples. Leading segments are either LITERAL_SEGMENT with the literal text of the
+    segment, or FOLDER_SEGMENT which matches any single folder name. The last segment is a DATE_SEGMENT whose text is
+    the literal text preceding the date group. None is returned if the date group can be preceded by arbitrary text.
+    """
+    parsed_pattern = sre_parse.parse(pattern)
+    date_group_index = parsed_pattern.pattern.groupdict.get('date')
+    if date_group_index is None or parsed_pattern.pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return None
+
+    segments = []
+    segment_text = ''
+    is_folder_segment = False
+    for opcode, argument in parsed_pattern:
+        if opcode == sre_constants.LITERAL:
+            character = chr(argument)
+            if character == '/':
+                if is_folder_segment:
+                    segments.append((FOLDER_SEGMENT, None))
+                else:
+                    segments.append((LITERAL_SEGMENT, segment_text))
+                segment_text = ''
+                is_folder_segment = False
+            elif is_folder_segment:
+                return None
+            else:
+                segment_text += character
+        elif opcode in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if is_folder_segment or segment_text or not _matches_folder_names(argument):
+                return None
+            is_folder_segment = True
+        elif opcode == sre_constants.SUBPATTERN and argument[0] == date_group_index:
+            # Dates are formatted as %Y%m%d, so the date group must always match exactly 8 characters.
+            if is_folder_segment or argument[1].getwidth() != (8, 8):
+                return None
+            segments.append((DATE_SEGMENT, segment_text))
+            return segments
+        else:
+            return None
+
+    return None
+
+
+def _get_fixed_date_url_prefix(segments, prefix_url):
+    """
+    Find the text that precedes the date in every URL below a prefix that is matched by a pattern.
+
+    Args:
+        segments: the segments of the pattern, as returned by get_date_pattern_segments().
+        prefix_url: the URL of a "folder", ending with a slash.
+
+    Returns:
+        A (can_match, url) tuple.  can_match is False if the pattern can't match any URL below the prefix.  url is None
+        if the text isn't fixed, because the pattern allows any folder name below the prefix or the date is part of the
+        prefix itself.
+    """
+    url = ''
+    for kind, text in segments:
+        if kind == FOLDER_SEGMENT:
+            folder_names = prefix_url[len(url):].split('/')
+            if len(folder_names) < 2:
+                return True, None
+            url += folder_names[0] + '/'
+        elif kind == LITERAL_SEGMENT:
+            url += text + '/'
+        else:
+            url += text
+
+        common_length = min(len(url), len(prefix_url))
+        if url[:common_length] != prefix_url[:common_length]:
+            return False, None
+
+    if len(url) < len(prefix_url):
+        return True, None
+    return True, url
+
+
+def _matches_folder_names(repeat_argument):
+    """Return True if a repeated pattern element matches one or more characters that are not slashes."""
+    min_count, _max_count, repeated = repeat_argument
+    if min_count < 1 or len(repeated) != 1:
+        return False
+
+    opcode, argument = repeated[0]
+    if opcode == sre_constants.NOT_LITERAL:
+        return argument == ord('/')
+    if opcode == sre_constants.IN:
+        return argument[0] == (sre_constants.NEGATE, None) and (sre_constants.LITERAL, ord('/')) in argument[1:]
+    return False
+
+
 class EventLogSelectionMixin(EventLogSelectionDownstreamMixin):
     """
     Extract events corresponding to a specified time interval and outputs them from a mapper.
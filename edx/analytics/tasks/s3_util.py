@@ -1,16 +1,27 @@
 """
 Utility methods for interacting with S3 via boto.
 """
+import collections
 import os
 import math
 import logging
+import threading
+import time
+from contextlib import closing
+import StringIO
 
 from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
 from urlparse import urlparse
 
+import boto
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
+from boto.s3.prefix import Prefix
+from boto.utils import compute_md5
 from filechunkio import FileChunkIO
-from luigi.s3 import S3Client, AtomicS3File
+from luigi import configuration
+from luigi.s3 import S3Client
 from luigi.hdfs import HdfsTarget, Plain
 
 
@@ -34,6 +45,37 @@ MINIMUM_BYTES_PER_CHUNK = 5242880
 # putting the object.  Define here what that policy will be.
 DEFAULT_KEY_ACCESS_POLICY = 'bucket-owner-full-control'
 
+# Parts of a multipart upload are uploaded concurrently by this many threads, each with its own connection. Override it
+# with the "multipart_upload_threads" option in the "s3" configuration section.
+DEFAULT_MULTIPART_UPLOAD_THREADS = 4
+
+# Uploading a part is retried this many times in total, waiting twice as long before each retry.
+MAX_PART_UPLOAD_ATTEMPTS = 4
+PART_UPLOAD_RETRY_DELAY_SECONDS = 1
+
+# Data written to S3 through a streaming writer is buffered in memory and uploaded in parts of this size. Every part
+# except the last one must be at least MINIMUM_BYTES_PER_CHUNK bytes.
+STREAMING_UPLOAD_PART_SIZE = 16 * 1024 * 1024
+
+# Objects at least as large as the "ranged_read_threshold" option in the "s3" configuration section are read by
+# fetching byte ranges of this size concurrently. Ranged reads are disabled unless a threshold is set. Override the
+# number of threads with the "ranged_read_threads" option. At most twice as many ranges as there are threads are held
+# in memory at once.
+DEFAULT_READ_RANGE_SIZE = 8 * 1024 * 1024
+DEFAULT_RANGED_READ_THREADS = 4
+
+# Fetching a range is retried this many times in total, waiting twice as long before each retry.
+MAX_RANGE_READ_ATTEMPTS = 4
+RANGE_READ_RETRY_DELAY_SECONDS = 1
+
+# Listing a bucket is a sequence of round trips that each return at most 1000 keys, so large listings are latency
+# bound. Listing independent prefixes concurrently hides most of that latency.
+DEFAULT_LISTING_THREADS = 8
+
+# When checking whether keys exist, list a "folder" instead of sending a HEAD request for each key once this many of its
+# keys need to be checked.
+EXISTENCE_LISTING_THRESHOLD = 10
+
 
 def get_s3_bucket_key_names(url):
     """Extract the bucket and key names from a S3 URL"""
@@ -95,6 +137,230 @@ def generate_s3_sources(s3_conn, source, patterns):
     return ((bucket.name, root, path) for path in paths)
 
 
+def list_s3_prefix_shards(s3_conn, source):
+    """
+    Split the keys below a S3 URL into shards that can be listed independently.
+
+    Args:
+
+      s3_conn: a boto connection to S3.
+      source:  a url to S3.
+
+    Returns:
+
+      (prefixes, keys) where `prefixes` is a list of the "folders" immediately below the source and `keys` is a list of
+      the names of the non-empty keys stored directly in the source "folder".
+    """
+    bucket_name, root = get_s3_bucket_key_names(source)
+    bucket = s3_conn.get_bucket(bucket_name)
+    root_with_slash = root if len(root) == 0 or root.endswith('/') else root + '/'
+
+    prefixes = []
+    keys = []
+    for item in bucket.list(root_with_slash, delimiter='/'):
+        if isinstance(item, Prefix):
+            prefixes.append(item.name)
+        elif item.size > 0:
+            keys.append(item.key)
+    return prefixes, keys
+
+
+def list_s3_prefixes_in_parallel(bucket_name, prefixes, markers=None, num_threads=DEFAULT_LISTING_THREADS):
+    """
+    Recursively list the non-empty keys below each of the given prefixes using a pool of threads.
+
+    Args:
+
+      bucket_name: the name of the bucket containing the prefixes.
+      prefixes: a list of key name prefixes to list.
+      markers: an optional dict mapping a prefix to a key name. Only keys that sort after the marker are listed.
+      num_threads: the maximum number of prefixes to list concurrently.
+
+    Returns:
+
+      A dict mapping each prefix to a list of the key names found below it.
+    """
+    markers = markers or {}
+
+    def list_prefix(bucket, prefix):
+        """List all non-empty keys below a single prefix."""
+        listing = bucket.list(prefix, marker=markers.get(prefix, ''))
+        return prefix, [key_metadata.key for key_metadata in listing if key_metadata.size > 0]
+
+    return dict(_map_with_bucket_per_thread(bucket_name, list_prefix, prefixes, num_threads))
+
+
+def get_existing_s3_keys(bucket_name, key_names, num_threads=DEFAULT_LISTING_THREADS):
+    """
+    Determine which of the given key names exist in a bucket, either as keys or as "folders".
+
+    Keys are grouped by their parent "folder". Folders that contain many of the keys are listed, which takes one request
+    per thousand entries, while the remaining keys are checked with individual HEAD requests. Both are done
+    concurrently. Note that a "folder" is only detected when its parent is listed.
+
+    Returns:
+
+      A set containing the key names that exist.
+    """
+    key_names = set(key_names)
+    key_names_for_folder = {}
+    for key_name in key_names:
+        folder = key_name.rsplit('/', 1)[0] + '/' if '/' in key_name else ''
+        key_names_for_folder.setdefault(folder, []).append(key_name)
+
+    folders_to_list = []
+    keys_to_check = []
+    for folder, folder_key_names in key_names_for_folder.iteritems():
+        if len(folder_key_names) >= EXISTENCE_LISTING_THRESHOLD:
+            folders_to_list.append(folder)
+        else:
+            keys_to_check.extend(folder_key_names)
+
+    def check_existence(bucket, folder_and_key_name):
+        """Return the names of the existing keys found by listing a folder or by checking a single key."""
+        folder, key_name = folder_and_key_name
+        if key_name is not None:
+            return [key_name] if bucket.get_key(key_name) is not None else []
+        found = []
+        for item in bucket.list(folder, delimiter='/'):
+            found.append(item.name.rstrip('/') if isinstance(item, Prefix) else item.key)
+        return found
+
+    work = [(folder, None) for folder in folders_to_list] + [(None, key_name) for key_name in keys_to_check]
+    existing_keys = set()
+    for found in _map_with_bucket_per_thread(bucket_name, check_existence, work, num_threads):
+        existing_keys.update(found)
+    return existing_keys & key_names
+
+
+def _map_with_bucket_per_thread(bucket_name, func, items, num_threads, credentials=None, validate=True):
+    """
+    Call func(bucket, item) for each item using a pool of threads, returning the results in order.
+
+    boto connections are not thread-safe, so each worker thread checks out its own connection from the connection pool,
+    and returns it when all of the items have been processed.
+    """
+    if len(items) == 0:
+        return []
+
+    thread_buckets = ThreadBuckets(bucket_name, credentials=credentials, validate=validate)
+    pool = ThreadPool(min(num_threads, len(items)))
+    try:
+        return pool.map(lambda item: func(thread_buckets.get(), item), items)
+    finally:
+        pool.close()
+        pool.join()
+        thread_buckets.release()
+
+
+class S3ConnectionPool(object):
+    """
+    A process-wide, thread-safe pool of boto S3 connections.
+
+    Opening a connection and setting up its authentication is repeated for every target and listing unless connections
+    are shared. boto connections are not thread-safe, so each connection is only used by one thread at a time: it is
+    checked out with acquire() and returned with release(), or reserved for the life of a thread by
+    get_thread_connection(). Connections are pooled separately for each set of credentials.
+
+    Luigi forks its workers, and a forked process must not share the sockets of its parent's connections, so the pool is
+    emptied whenever it is used by a different process than the one that filled it.
+
+    The `connections_created` and `connections_reused` counters show how effective the pool is.
+    """
+
+    def __init__(self):
+        self.connections_created = 0
+        self.connections_reused = 0
+        self._reset()
+
+    def _reset(self):
+        """Forget all of the pooled and reserved connections."""
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.idle_connections = {}
+        self.thread_state = threading.local()
+
+    def _check_process(self):
+        """Empty the pool if this process was forked from the one that filled it."""
+        if self.pid != os.getpid():
+            log.debug('Discarding S3 connections inherited from process %d.', self.pid)
+            self._reset()
+
+    def acquire(self, credentials=None):
+        """Check out an idle connection that uses the given (access key id, secret key) credentials, or open one."""
+        credentials = credentials or (None, None)
+        self._check_process()
+        with self.lock:
+            idle_connections = self.idle_connections.get(credentials)
+            if idle_connections:
+                self.connections_reused += 1
+                return idle_connections.pop()
+            self.connections_created += 1
+            connections_created = self.connections_created
+
+        log.debug('Opening S3 connection number %d.', connections_created)
+        aws_access_key_id, aws_secret_access_key = credentials
+        return boto.connect_s3(aws_access_key_id, aws_secret_access_key)
+
+    def release(self, connection, credentials=None):
+        """Return a connection that was checked out with the given credentials to the pool."""
+        self._check_process()
+        with self.lock:
+            self.idle_connections.setdefault(credentials or (None, None), []).append(connection)
+
+    def get_thread_connection(self, credentials=None):
+        """Return a connection that is reserved for the calling thread, checking one out the first time it is called."""
+        credentials = credentials or (None, None)
+        self._check_process()
+        if not hasattr(self.thread_state, 'connections'):
+            self.thread_state.connections = {}
+        if credentials not in self.thread_state.connections:
+            self.thread_state.connections[credentials] = self.acquire(credentials)
+        return self.thread_state.connections[credentials]
+
+
+CONNECTION_POOL = S3ConnectionPool()
+
+
+def get_s3_connection():
+    """Return a connection to S3 that the calling thread can use, with the default boto credentials."""
+    return CONNECTION_POOL.get_thread_connection()
+
+
+class ThreadBuckets(object):
+    """
+    Gives each thread that asks for it a bucket on a connection of its own.
+
+    The connections are checked out of the connection pool the first time each thread asks for the bucket, and are all
+    returned by release(), which must only be called once none of the threads are using them any more.
+    """
+
+    def __init__(self, bucket_name, credentials=None, validate=True):
+        self.bucket_name = bucket_name
+        self.credentials = credentials
+        self.validate = validate
+        self.thread_state = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def get(self):
+        """Return the calling thread's bucket."""
+        if not hasattr(self.thread_state, 'bucket'):
+            connection = CONNECTION_POOL.acquire(self.credentials)
+            with self.lock:
+                self.connections.append(connection)
+            self.thread_state.bucket = connection.get_bucket(self.bucket_name, validate=self.validate)
+        return self.thread_state.bucket
+
+    def release(self):
+        """Return all of the connections to the pool. Threads that ask for the bucket again get a new connection."""
+        with self.lock:
+            connections, self.connections = self.connections, []
+            self.thread_state = threading.local()
+        for connection in connections:
+            CONNECTION_POOL.release(connection, self.credentials)
+
+
 def _filter_matches(patterns, names):
     """Return only key names that match any of the include patterns."""
     func = lambda n: any(fnmatch(n, p) for p in patterns)
@@ -108,9 +374,22 @@ class ScalableS3Client(S3Client):
     Uses S3 multipart upload API for large files, and regular S3 puts for smaller files.
 
     This client should only require PutObject and PutObjectAcl permissions in order to write to the target bucket.
+
+    Connections are taken from the process-wide connection pool when they are used, so creating a client is cheap.
     """
     # TODO: Make this behavior configurable and submit this change upstream.
 
+    def __init__(self, aws_access_key_id=None, aws_secret_access_key=None):  # pylint: disable=super-init-not-called
+        self.credentials = (
+            aws_access_key_id or self._get_s3_config('aws_access_key_id'),
+            aws_secret_access_key or self._get_s3_config('aws_secret_access_key'),
+        )
+
+    @property
+    def s3(self):
+        """The connection used by the calling thread, which the methods inherited from S3Client rely on."""
+        return CONNECTION_POOL.get_thread_connection(self.credentials)
+
     def put(self, local_path, destination_s3_path):
         """Put an object stored locally to an S3 path."""
 
@@ -148,25 +427,104 @@ class ScalableS3Client(S3Client):
         s3_key.set_contents_from_filename(local_path, policy=DEFAULT_KEY_ACCESS_POLICY)
 
     def _upload_multipart(self, local_path, destination_s3_path, s3_bucket, key, source_size_bytes):
-        """Upload a large local file to an S3 path, using S3's multipart upload API."""
+        """
+        Upload a large local file to an S3 path, using S3's multipart upload API.
+
+        The parts are uploaded concurrently, and each part is retried if it fails. S3 verifies the MD5 digest of each
+        part as it is received, and the upload is only completed if the parts S3 has match the local file.
+        """
 
         # Explicitly set the ACL policy when putting the object, so
         # that it has an ACL when AWS writes to keys from another account.
         multipart = s3_bucket.initiate_multipart_upload(key, policy=DEFAULT_KEY_ACCESS_POLICY)
 
         number_of_chunks, bytes_per_chunk = self._get_chunk_specs(source_size_bytes)
-        log.info("Uploading file '%s' with size %d in %d parts, with chunksize of %d.",
-                 destination_s3_path, source_size_bytes, number_of_chunks, bytes_per_chunk)
+        num_threads = self._get_multipart_upload_threads()
+        log.info("Uploading file '%s' with size %d in %d parts, with chunksize of %d, using %d threads.",
+                 destination_s3_path, source_size_bytes, number_of_chunks, bytes_per_chunk, num_threads)
+
+        def upload_part(bucket, chunk_spec):
+            """Upload a single part using this thread's connection, and return its part number and MD5 digest."""
+            part_num, chunk_byte_offset, num_bytes = chunk_spec
+            open_chunk = lambda: FileChunkIO(local_path, 'r', offset=chunk_byte_offset, bytes=num_bytes)
+            return part_num, self._upload_part(bucket, multipart, part_num, open_chunk, num_bytes)
+
+        chunk_specs = list(self._generate_chunks(source_size_bytes, number_of_chunks, bytes_per_chunk))
+        try:
+            part_digests = dict(_map_with_bucket_per_thread(
+                s3_bucket.name, upload_part, chunk_specs, num_threads, credentials=self.credentials, validate=False
+            ))
+        except Exception:
+            multipart.cancel_upload()
+            raise
 
-        chunk_generator = self._generate_chunks(source_size_bytes, number_of_chunks, bytes_per_chunk)
-        for part_num, chunk_byte_offset, num_bytes in chunk_generator:
-            with FileChunkIO(local_path, 'r', offset=chunk_byte_offset, bytes=num_bytes) as chunk:
-                multipart.upload_part_from_file(fp=chunk, part_num=part_num)
+        self._verify_and_complete(multipart, part_digests)
+
+    def open_ranged_reader(self, s3_path, min_size=0):
+        """
+        Open an S3 object for reading, fetching byte ranges of it concurrently.
 
-        if len(multipart.get_all_parts()) == number_of_chunks:
+        Returns None if the object is smaller than `min_size` bytes, since it is quicker to read it in one request.
+        """
+        (bucket_name, key_name) = self._path_to_bucket_and_key(s3_path)
+        key = self.s3.get_bucket(bucket_name, validate=False).get_key(key_name)
+        if key is None:
+            raise IOError("Could not find file at '{0}'".format(s3_path))
+        if key.size < min_size:
+            return None
+
+        num_threads = configuration.get_config().getint('s3', 'ranged_read_threads', DEFAULT_RANGED_READ_THREADS)
+        thread_buckets = ThreadBuckets(bucket_name, credentials=self.credentials, validate=False)
+        return S3RangedReader(key_name, key.size, thread_buckets, num_threads=max(num_threads, 1))
+
+    def _get_multipart_upload_threads(self):
+        """Return the number of parts of a multipart upload to upload concurrently."""
+        num_threads = configuration.get_config().getint(
+            's3', 'multipart_upload_threads', DEFAULT_MULTIPART_UPLOAD_THREADS
+        )
+        return max(num_threads, 1)
+
+    def _upload_part(self, bucket, multipart, part_num, open_chunk, num_bytes):
+        """
+        Upload one part of a multipart upload, retrying with exponential backoff, and return its hex MD5 digest.
+
+        Parameters:
+            bucket: a connection to the bucket that is owned by the calling thread.
+            multipart: the multipart upload that the part belongs to.
+            part_num: the one-based index of the part.
+            open_chunk: a function that returns a new file-like object containing the data of the part.
+            num_bytes: the size of the part.
+        """
+        part_upload = MultiPartUpload(bucket)
+        part_upload.key_name = multipart.key_name
+        part_upload.id = multipart.id
+
+        with open_chunk() as chunk:
+            md5_digests = compute_md5(chunk)[:2]
+
+        for attempt in range(1, MAX_PART_UPLOAD_ATTEMPTS + 1):
+            try:
+                with open_chunk() as chunk:
+                    # Passing the digest makes S3 reject the part if it is corrupted in transit.
+                    part_upload.upload_part_from_file(fp=chunk, part_num=part_num, md5=md5_digests, size=num_bytes)
+                return md5_digests[0]
+            except Exception:  # pylint: disable=broad-except
+                if attempt == MAX_PART_UPLOAD_ATTEMPTS:
+                    raise
+                delay = PART_UPLOAD_RETRY_DELAY_SECONDS * (2 ** (attempt - 1))
+                log.warning('Failed to upload part %d of %s, retrying in %d seconds.', part_num, multipart.key_name,
+                            delay, exc_info=True)
+                time.sleep(delay)
+
+    @staticmethod
+    def _verify_and_complete(multipart, part_digests):
+        """Complete the upload if the parts S3 has match the given digests, otherwise cancel it and raise an error."""
+        uploaded_digests = dict((part.part_number, part.etag.strip('"')) for part in multipart)
+        if uploaded_digests == part_digests:
             multipart.complete_upload()
         else:
             multipart.cancel_upload()
+            raise IOError("Parts uploaded to '{0}' do not match the data that was written.".format(multipart.key_name))
 
     def _get_chunk_specs(self, source_size_bytes):
         """Returns number of chunks and bytes-per-chunk given a filesize."""
@@ -206,7 +564,303 @@ class S3HdfsTarget(HdfsTarget):
             raise ValueError("Unsupported open mode '{mode}'".format(mode=mode))
 
         if mode == 'r':
+            ranged_read_threshold = configuration.get_config().getint('s3', 'ranged_read_threshold', 0)
+            if self.format is Plain and ranged_read_threshold > 0:
+                reader = self.s3_client.open_ranged_reader(
+                    self.path.replace('s3n://', 's3://'), min_size=ranged_read_threshold
+                )
+                if reader is not None:
+                    return reader
             return super(S3HdfsTarget, self).open(mode=mode)
         else:
             safe_path = self.path.replace('s3n://', 's3://')
-            return AtomicS3File(safe_path, self.s3_client)
+            return S3StreamingWriter(safe_path, self.s3_client)
+
+
+class S3StreamingWriter(object):
+    """
+    A file-like object that uploads the data written to it to S3 while it is still being written.
+
+    Data is buffered in memory and uploaded as a part of a multipart upload each time `part_size` bytes have been
+    written, so no local scratch space is needed. Parts are uploaded by a pool of threads, and writing blocks when as
+    many parts as there are threads are waiting to be uploaded. Data that never fills a part is uploaded with a single
+    put when the writer is closed.
+
+    Like luigi's AtomicS3File, nothing is written to the destination if the file is not closed or an exception
+    is raised inside a `with` block that uses it.  A multipart upload that has been started is cancelled in either case,
+    by abort() or, if the writer is never closed, once it is garbage collected.
+    """
+
+    def __init__(self, path, s3_client, part_size=STREAMING_UPLOAD_PART_SIZE):
+        self.path = path
+        self.s3_client = s3_client
+        self.part_size = max(part_size, MINIMUM_BYTES_PER_CHUNK)
+        bucket_name, self.key_name = s3_client._path_to_bucket_and_key(path)  # pylint: disable=protected-access
+
+        self.buffer = []
+        self.buffer_size = 0
+        self.closed = False
+        self.multipart = None
+        self.pool = None
+        self.pending_parts = []
+        self.part_slots = None
+        # The writer may be closed by a different thread than the one that wrote to it, so every request is made with a
+        # connection that belongs to the thread making it.
+        self.thread_buckets = ThreadBuckets(bucket_name, credentials=s3_client.credentials, validate=False)
+
+    def write(self, data):
+        """Add data to the file, uploading a part if enough data has been buffered."""
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.part_size:
+            self._upload_buffer()
+
+    def flush(self):
+        """Data is only uploaded when a part is full, so there is nothing to do."""
+        pass
+
+    def close(self):
+        """Upload any buffered data and complete the upload."""
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.multipart is None:
+            try:
+                key = self.thread_buckets.get().new_key(self.key_name)
+                # Explicitly set the ACL policy when putting the object, so
+                # that it has an ACL when AWS writes to keys from another account.
+                key.set_contents_from_string(''.join(self.buffer), policy=DEFAULT_KEY_ACCESS_POLICY)
+            finally:
+                self.buffer = []
+                self.thread_buckets.release()
+            return
+
+        try:
+            if self.buffer_size > 0:
+                self._upload_buffer()
+            part_digests = dict(pending_part.get() for pending_part in self.pending_parts)
+        except Exception:
+            self._cancel_upload()
+            raise
+
+        try:
+            self._stop_uploading()
+            self.s3_client._verify_and_complete(  # pylint: disable=protected-access
+                self._get_thread_multipart(), part_digests
+            )
+        finally:
+            self.thread_buckets.release()
+
+    def abort(self):
+        """Discard everything that has been written.  Does nothing if the writer has already been closed."""
+        if self.closed:
+            return
+        self.closed = True
+        self.buffer = []
+        self._cancel_upload()
+
+    def _cancel_upload(self):
+        """Stop the thread pool and cancel the multipart upload, if one was started."""
+        if self.multipart is not None:
+            try:
+                self._stop_uploading()
+                self._get_thread_multipart().cancel_upload()
+            finally:
+                self.thread_buckets.release()
+
+    def _stop_uploading(self):
+        """Wait for the parts that are being uploaded."""
+        self.pool.close()
+        self.pool.join()
+
+    def _get_thread_multipart(self):
+        """Return the multipart upload, making its requests with the calling thread's connection."""
+        self.multipart.bucket = self.thread_buckets.get()
+        return self.multipart
+
+    def _upload_buffer(self):
+        """Start uploading the buffered data as the next part, waiting if too many parts are already in flight."""
+        if self.multipart is None:
+            # Explicitly set the ACL policy when putting the object, so
+            # that it has an ACL when AWS writes to keys from another account.
+            self.multipart = self.thread_buckets.get().initiate_multipart_upload(
+                self.key_name, policy=DEFAULT_KEY_ACCESS_POLICY
+            )
+            num_threads = self.s3_client._get_multipart_upload_threads()  # pylint: disable=protected-access
+            self.pool = ThreadPool(num_threads)
+            self.part_slots = threading.BoundedSemaphore(num_threads)
+            log.info("Streaming '%s' to S3 in parts of %d bytes, using %d threads.", self.path, self.part_size,
+                     num_threads)
+
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.buffer_size = 0
+
+        self.part_slots.acquire()
+        part_num = len(self.pending_parts) + 1
+        self.pending_parts.append(self.pool.apply_async(self._upload_part, (part_num, data)))
+
+    def _upload_part(self, part_num, data):
+        """Upload a single part using this thread's connection. Runs in a thread of the pool."""
+        try:
+            open_chunk = lambda: closing(StringIO.StringIO(data))
+            digest = self.s3_client._upload_part(  # pylint: disable=protected-access
+                self.thread_buckets.get(), self.multipart, part_num, open_chunk, len(data)
+            )
+            return part_num, digest
+        finally:
+            self.part_slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.abort()
+
+
+class S3RangedReader(object):
+    """
+    A read-only file-like object that fetches consecutive byte ranges of an S3 object concurrently.
+
+    Reading a large object over a single connection is limited by the latency of that connection. This reader keeps
+    several range requests in flight, each on its own connection, and returns their data in order.
+
+    Parameters:
+        key_name: the name of the object.
+        size: the size of the object in bytes.
+        thread_buckets: the ThreadBuckets for the bucket that holds the object.
+        range_size: the number of bytes to fetch in each request.
+        num_threads: the maximum number of requests to make concurrently.
+    """
+
+    def __init__(self, key_name, size, thread_buckets, range_size=DEFAULT_READ_RANGE_SIZE,
+                 num_threads=DEFAULT_RANGED_READ_THREADS):
+        self.key_name = key_name
+        self.size = size
+        self.thread_buckets = thread_buckets
+        self.range_size = range_size
+        self.max_pending_ranges = 2 * num_threads
+
+        self.pool = ThreadPool(num_threads)
+        self.pending_ranges = collections.deque()
+        self.next_range_start = 0
+        self.buffer = ''
+        self.buffer_position = 0
+        self.closed = False
+
+        while len(self.pending_ranges) < self.max_pending_ranges and self._request_next_range():
+            pass
+
+    def _request_next_range(self):
+        """Start fetching the next range of the object in the background, returning False if there are none left."""
+        if self.next_range_start >= self.size:
+            return False
+        end = min(self.next_range_start + self.range_size, self.size)
+        self.pending_ranges.append(self.pool.apply_async(self._fetch_range, (self.next_range_start, end)))
+        self.next_range_start = end
+        return True
+
+    def _fetch_range(self, start, end):
+        """
+        Fetch the bytes in [start, end) using this thread's connection, retrying with exponential backoff.
+
+        Runs in a thread of the pool.
+        """
+        for attempt in range(1, MAX_RANGE_READ_ATTEMPTS + 1):
+            try:
+                key = self.thread_buckets.get().new_key(self.key_name)
+                data = key.get_contents_as_string(headers={'Range': 'bytes={0}-{1}'.format(start, end - 1)})
+                if len(data) != end - start:
+                    raise IOError('Expected {0} bytes from range {1}-{2} of {3}, received {4}'.format(
+                        end - start, start, end - 1, self.key_name, len(data)
+                    ))
+                return data
+            except Exception:  # pylint: disable=broad-except
+                if attempt == MAX_RANGE_READ_ATTEMPTS or self.closed:
+                    raise
+                delay = RANGE_READ_RETRY_DELAY_SECONDS * (2 ** (attempt - 1))
+                log.warning('Failed to read bytes %d-%d of %s, retrying in %d seconds.', start, end - 1,
+                            self.key_name, delay, exc_info=True)
+                time.sleep(delay)
+
+    def _fill_buffer(self):
+        """Replace the buffer with the next range once it has been consumed, returning False at the end of the object."""
+        if self.buffer_position < len(self.buffer):
+            return True
+        if not self.pending_ranges:
+            return False
+        self.buffer = self.pending_ranges.popleft().get()
+        self.buffer_position = 0
+        self._request_next_range()
+        return True
+
+    def read(self, size=-1):
+        """Read at most `size` bytes, or the rest of the object if `size` is negative."""
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        pieces = []
+        remaining = size
+        while remaining != 0 and self._fill_buffer():
+            end = len(self.buffer) if remaining < 0 else min(len(self.buffer), self.buffer_position + remaining)
+            pieces.append(self.buffer[self.buffer_position:end])
+            if remaining > 0:
+                remaining -= end - self.buffer_position
+            self.buffer_position = end
+        return ''.join(pieces)
+
+    def readline(self):
+        """Read the next line, including its trailing newline character."""
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        pieces = []
+        while self._fill_buffer():
+            end = self.buffer.find('\n', self.buffer_position)
+            if end >= 0:
+                pieces.append(self.buffer[self.buffer_position:end + 1])
+                self.buffer_position = end + 1
+                break
+            pieces.append(self.buffer[self.buffer_position:])
+            self.buffer_position = len(self.buffer)
+        return ''.join(pieces)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close(self):
+        """Stop fetching ranges, waiting for the requests in flight, and return their connections to the pool."""
+        if not self.closed:
+            self.closed = True
+            self.pending_ranges.clear()
+            self.buffer = ''
+            self.pool.close()
+            self.pool.join()
+            self.thread_buckets.release()
+
+    def __del__(self):
+        # Make sure the threads of the pool are stopped even if the reader is never closed.
+        if not getattr(self, 'closed', True):
+            self.closed = True
+            self.pool.terminate()
+            self.thread_buckets.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -17,6 +17,24 @@ from edx.analytics.tasks.util.overwrite import OverwriteOutputMixin
 
 log = logging.getLogger(__name__)
 
+try:
+    import mysql.connector
+    mysql_client_available = True
+except ImportError:
+    log.warn('Unable to import mysql client libraries')
+    # On hadoop slave nodes we don't have mysql client libraries installed so it is pointless to ship this package to
+    # them, instead just fail noisily if we attempt to use these libraries.
+    mysql_client_available = False
+
+
+# Sqoop's incremental import modes: "append" imports rows whose check column is greater than the last value, for tables
+# that only ever have rows added, and "lastmodified" imports rows whose check column timestamp is at least the last
+# value, for tables whose rows are updated.  So the upper bound of an import is inclusive for "append" and exclusive for
+# "lastmodified", so that consecutive imports don't overlap.
+INCREMENTAL_APPEND = 'append'
+INCREMENTAL_LASTMODIFIED = 'lastmodified'
+INCREMENTAL_MODES = (INCREMENTAL_APPEND, INCREMENTAL_LASTMODIFIED)
+
 
 def load_sqoop_cmd():
     """Get path to sqoop command from Luigi configuration."""
@@ -48,6 +66,13 @@ class SqoopImportTask(OverwriteOutputMixin, luigi.hadoop.BaseHadoopJobTask):
         fields_terminated_by:  defines the file separator to use on output.
         delimiter_replacement:  defines a character to use as replacement for delimiters
             that appear within data values, for use with Hive.  (Not specified by default.)
+        incremental:  either "append" or "lastmodified" to only import the rows that were added or changed since
+            `last_value`, instead of the whole table.  (Not specified by default.)
+        check_column:  the column that is compared with `last_value` in an incremental import, such as "id" for
+            "append" or "modified" for "lastmodified".
+        last_value:  the largest value of `check_column` imported by the previous incremental import.  If not
+            specified, all rows are imported.  The new largest value is written to the metadata output as
+            "last_value", to be passed to the next import.
 
     Inherited parameters:
         overwrite:  Overwrite any existing imports.  Default is false.
@@ -78,6 +103,12 @@ class SqoopImportTask(OverwriteOutputMixin, luigi.hadoop.BaseHadoopJobTask):
     null_string = luigi.Parameter(default=None)
     fields_terminated_by = luigi.Parameter(default=None)
     delimiter_replacement = luigi.Parameter(default=None)
+    incremental = luigi.Parameter(default=None)
+    check_column = luigi.Parameter(default=None)
+    last_value = luigi.Parameter(default=None)
+
+    # The largest value of check_column to import, set by prepare_incremental_import().
+    incremental_upper_bound = None
 
     def requires(self):
         return {
@@ -120,6 +151,32 @@ class SqoopImportTask(OverwriteOutputMixin, luigi.hadoop.BaseHadoopJobTask):
 
         return generic_args
 
+    def prepare_incremental_import(self):
+        """
+        Find the largest value of the check column that an incremental import should include.
+
+        Sqoop finds its own upper bound when it starts the import, but it has no way to report it, so the bound is
+        found first and passed to Sqoop as part of the where clause.  That way the next import starts exactly where
+        this one stopped.
+        """
+        if self.incremental not in INCREMENTAL_MODES:
+            raise ValueError('Unknown incremental mode {0}, expected one of: {1}'.format(
+                self.incremental, ', '.join(INCREMENTAL_MODES)
+            ))
+        if self.check_column is None:
+            raise ValueError('A check column must be specified for an incremental import')
+
+        self.incremental_upper_bound = self.get_incremental_upper_bound()
+        if self.incremental_upper_bound is None:
+            # The table is empty, so there is nothing new to import.
+            self.incremental_upper_bound = self.last_value
+        log.info('Importing %s rows with %s from %s to %s', self.table_name, self.check_column, self.last_value,
+                 self.incremental_upper_bound)
+
+    def get_incremental_upper_bound(self):
+        """Returns the largest value of the check column to import, as a string, or None if there are no rows."""
+        raise NotImplementedError  # pragma: no cover
+
     def import_args(self):
         """Returns list of arguments specific to Sqoop import."""
         arglist = [
@@ -130,8 +187,21 @@ class SqoopImportTask(OverwriteOutputMixin, luigi.hadoop.BaseHadoopJobTask):
             arglist.extend(['--columns', ','.join(self.columns)])
         if self.num_mappers is not None:
             arglist.extend(['--num-mappers', str(self.num_mappers)])
-        if self.where is not None:
-            arglist.extend(['--where', str(self.where)])
+
+        where = self.where
+        if self.incremental is not None:
+            arglist.extend(['--incremental', self.incremental, '--check-column', self.check_column])
+            if self.last_value is not None:
+                arglist.extend(['--last-value', str(self.last_value)])
+            if self.incremental_upper_bound is not None:
+                bound = "{column}{operator}'{value}'".format(
+                    column=self.check_column,
+                    operator='<=' if self.incremental == INCREMENTAL_APPEND else '<',
+                    value=self.incremental_upper_bound,
+                )
+                where = bound if where is None else '({where})AND({bound})'.format(where=where, bound=bound)
+        if where is not None:
+            arglist.extend(['--where', str(where)])
         if self.null_string is not None:
             arglist.extend(['--null-string', self.null_string, '--null-non-string', self.null_string])
         if self.fields_terminated_by is not None:
@@ -183,6 +253,44 @@ class SqoopImportFromMysql(SqoopImportTask):
         """Construct connection URL from provided credentials."""
         return 'jdbc:mysql://{host}/{database}'.format(host=cred['host'], database=self.database)
 
+    def get_incremental_upper_bound(self):
+        """
+        Returns the largest value of the check column to import, as a string, or None if there are no rows.
+
+        That is the largest value in the table for "append" imports, and the current time on the database server for
+        "lastmodified" imports, since rows may be modified again while they are being imported.
+        """
+        if not mysql_client_available:
+            raise ImportError('mysql client library not available')
+
+        cred = self._get_credentials()
+        connection = mysql.connector.connect(
+            host=cred['host'],
+            port=int(cred['port']),
+            user=cred['username'],
+            password=cred['password'],
+            database=self.database,
+        )
+        try:
+            cursor = connection.cursor()
+            if self.incremental == INCREMENTAL_APPEND:
+                query = "SELECT MAX({column}) FROM {table}".format(column=self.check_column, table=self.table_name)
+                if self.where is not None:
+                    query += " WHERE {where}".format(where=self.where)
+            else:
+                query = "SELECT NOW()"
+            cursor.execute(query)
+            value = cursor.fetchone()[0]
+        finally:
+            connection.close()
+
+        if value is None:
+            return None
+        elif isinstance(value, datetime.datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            return str(value)
+
     def import_args(self):
         """Returns list of arguments specific to Sqoop import from a Mysql database."""
         arglist = super(SqoopImportFromMysql, self).import_args()
@@ -193,6 +301,23 @@ class SqoopImportFromMysql(SqoopImportTask):
         return arglist
 
 
+def read_checkpoint(metadata_target, check_column):
+    """
+    Reads the outcome of an import from its existing metadata output.
+
+    Returns:
+        A (succeeded, last_value) tuple.  last_value is the value checkpointed by a successful incremental import on the
+        same column, or None if the import failed, imported the whole table, or was keyed on another column.
+    """
+    with metadata_target.open('r') as metadata_file:
+        metadata = json.load(metadata_file)
+    if not metadata.get('succeeded'):
+        return False, None
+    if metadata.get('incremental') is None or metadata.get('check_column') != check_column:
+        return True, None
+    return True, metadata.get('last_value')
+
+
 class SqoopPasswordTarget(luigi.hdfs.HdfsTarget):
     """Defines a temp file in HDFS to hold password."""
     def __init__(self):
@@ -215,8 +340,23 @@ class SqoopImportRunner(luigi.hadoop.JobRunner):
             # It should be deleted when it goes out of scope
             # (using __del__()), but safer to just make sure.
             password_target = SqoopPasswordTarget()
+            if job.incremental is not None:
+                job.prepare_incremental_import()
             arglist = job.get_arglist(password_target)
             luigi.hadoop.run_and_track_hadoop_job(arglist)
+
+            # Mark every import that succeeds, whether or not it is incremental, so that the next import can tell
+            # whether the most recent one replaced the whole table.
+            metadata.update({
+                'succeeded': True,
+                'incremental': job.incremental,
+            })
+            if job.incremental is not None:
+                # Only checkpoint the imports that succeed, so that a failed import is repeated by the next one.
+                metadata.update({
+                    'check_column': job.check_column,
+                    'last_value': job.incremental_upper_bound,
+                })
         finally:
             password_target.remove()
             metadata['end_time'] = datetime.datetime.utcnow().isoformat()
@@ -0,0 +1,203 @@
+"""
+Emulates the subset of the boto S3 API used by the pipeline, storing all data in memory.
+"""
+
+import hashlib
+import itertools
+import StringIO
+import threading
+import urlparse
+
+from boto.exception import S3ResponseError
+from boto.s3.prefix import Prefix
+from mock import patch
+
+from edx.analytics.tasks.s3_util import S3ConnectionPool
+
+
+def patch_s3_connection(test_case, connection):
+    """
+    Make every S3 connection opened during the test be `connection`.
+
+    A new connection pool is used for the duration of the test, so that connections from other tests are not reused.
+    Returns the connection pool.
+    """
+    connection_pool = S3ConnectionPool()
+    for patcher in [
+            patch('edx.analytics.tasks.s3_util.boto.connect_s3', return_value=connection),
+            patch('edx.analytics.tasks.s3_util.CONNECTION_POOL', connection_pool),
+    ]:
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+    return connection_pool
+
+
+class FakeS3Connection(object):
+    """
+    Fake boto S3 connection that holds a set of in-memory buckets.
+
+    Use it in place of boto.connect_s3() so that code that lists keys can be exercised against a realistic bucket.
+    """
+
+    aws_access_key_id = None
+    aws_secret_access_key = None
+
+    def __init__(self):
+        self.buckets = {}
+
+    def create_bucket(self, bucket_name):
+        """Create an empty bucket with the given name and return it."""
+        bucket = FakeS3Bucket(bucket_name)
+        self.buckets[bucket_name] = bucket
+        return bucket
+
+    def get_bucket(self, bucket_name, validate=True):  # pylint: disable=unused-argument
+        """Return the named bucket, creating it if necessary."""
+        if bucket_name not in self.buckets:
+            self.create_bucket(bucket_name)
+        return self.buckets[bucket_name]
+
+
+class FakeS3Bucket(object):
+    """
+    Fake boto S3 bucket.
+
+    Records every call to list() in `list_calls` so that tests can make assertions about the requests that were made.
+    Multipart uploads are supported, and setting `part_upload_failures` to N makes the next N part uploads fail.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = {}
+        self.list_calls = []
+        self.multipart_uploads = {}
+        self.part_upload_failures = 0
+        self.upload_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def set_contents(self, key_name, contents):
+        """Store a key with the given contents."""
+        self.keys[key_name] = FakeS3Key(self, key_name, contents)
+
+    def get_key(self, key_name):
+        """Return the key with the given name, or None if it doesn't exist."""
+        return self.keys.get(key_name)
+
+    def new_key(self, key_name):
+        """Return a key that will be stored when its contents are set."""
+        return FakeS3Key(self, key_name, None)
+
+    def initiate_multipart_upload(self, key_name, policy=None):  # pylint: disable=unused-argument
+        """Start a multipart upload to the given key."""
+        upload = FakeMultiPartUpload(self, key_name, str(next(self.upload_ids)))
+        self.multipart_uploads[upload.id] = upload
+        return upload
+
+    def cancel_multipart_upload(self, key_name, upload_id):  # pylint: disable=unused-argument
+        """Discard a multipart upload and all of its parts."""
+        self.multipart_uploads.pop(upload_id).cancelled = True
+
+    def list(self, prefix='', delimiter='', marker='', headers=None, encoding_type=None):  # pylint: disable=unused-argument
+        """List keys in lexicographic order, emulating the behavior of the prefix, delimiter and marker arguments."""
+        self.list_calls.append((prefix, delimiter, marker))
+        seen_prefixes = set()
+        for key_name in sorted(self.keys):
+            if not key_name.startswith(prefix) or key_name <= marker:
+                continue
+            if delimiter:
+                delimiter_index = key_name.find(delimiter, len(prefix))
+                if delimiter_index >= 0:
+                    common_prefix = key_name[:delimiter_index + len(delimiter)]
+                    if common_prefix not in seen_prefixes:
+                        seen_prefixes.add(common_prefix)
+                        yield Prefix(bucket=self, name=common_prefix)
+                    continue
+            yield self.keys[key_name]
+
+
+class FakeS3Key(object):
+    """Fake boto S3 key."""
+
+    def __init__(self, bucket, name, contents):
+        self.bucket = bucket
+        self.key = name
+        self.name = name
+        self.contents = contents
+
+    @property
+    def size(self):
+        """The length of the contents in bytes."""
+        return len(self.contents)
+
+    @property
+    def etag(self):
+        """The quoted hex MD5 digest of the contents, like S3 returns for objects that are not uploaded in parts."""
+        return '"{0}"'.format(hashlib.md5(self.contents).hexdigest())
+
+    def set_contents_from_file(self, fp, md5=None, query_args=None, size=None, **_kwargs):
+        """
+        Read the contents of the key from a file, storing them as a part if `query_args` identify a multipart upload.
+
+        Like S3, the contents are rejected if they don't match the given MD5 digest.
+        """
+        contents = fp.read(size) if size is not None else fp.read()
+        with self.bucket.lock:
+            if self.bucket.part_upload_failures > 0:
+                self.bucket.part_upload_failures -= 1
+                raise S3ResponseError(500, 'Internal Error')
+        if md5 is not None and hashlib.md5(contents).hexdigest() != md5[0]:
+            raise S3ResponseError(400, 'Bad Digest')
+
+        self.contents = contents
+        query = urlparse.parse_qs(query_args or '')
+        if 'uploadId' in query:
+            upload = self.bucket.multipart_uploads[query['uploadId'][0]]
+            upload.parts[int(query['partNumber'][0])] = self
+        else:
+            self.bucket.keys[self.name] = self
+
+    def get_contents_as_string(self, headers=None):
+        """Return the contents of the key, or the byte range given by a "Range: bytes=start-end" header."""
+        contents = self.bucket.keys[self.name].contents
+        byte_range = (headers or {}).get('Range')
+        if byte_range is None:
+            return contents
+        start, end = byte_range[len('bytes='):].split('-')
+        return contents[int(start):int(end) + 1]
+
+    def set_contents_from_string(self, contents, **kwargs):
+        """Store the given contents in the key."""
+        self.set_contents_from_file(StringIO.StringIO(contents), **kwargs)
+
+
+class FakeMultiPartUpload(object):
+    """Fake boto multipart upload. Iterating over it yields the parts that have been uploaded, in order."""
+
+    def __init__(self, bucket, key_name, upload_id):
+        self.bucket = bucket
+        self.key_name = key_name
+        self.id = upload_id  # pylint: disable=invalid-name
+        self.parts = {}
+        self.cancelled = False
+
+    def __iter__(self):
+        for part_number in sorted(self.parts):
+            yield FakeS3Part(part_number, self.parts[part_number].etag)
+
+    def complete_upload(self):
+        """Combine the parts into the destination key."""
+        contents = ''.join(self.parts[part_number].contents for part_number in sorted(self.parts))
+        self.bucket.set_contents(self.key_name, contents)
+        del self.bucket.multipart_uploads[self.id]
+
+    def cancel_upload(self):
+        """Discard the upload and all of its parts."""
+        self.bucket.cancel_multipart_upload(self.key_name, self.id)
+
+
+class FakeS3Part(object):
+    """Fake boto multipart upload part."""
+
+    def __init__(self, part_number, etag):
+        self.part_number = part_number
+        self.etag = etag
@@ -3,11 +3,23 @@ Ensure we can write from MySQL to Hive data sources.
 """
 
 import datetime
+import json
+import os
+import shutil
+import tempfile
 import textwrap
+import threading
+import time
 
+import luigi.task
 from mock import patch, Mock
 
-from edx.analytics.tasks.database_imports import ImportStudentCourseEnrollmentTask, ImportIntoHiveTableTask
+from edx.analytics.tasks.database_imports import (
+    ImportStudentCourseEnrollmentTask, ImportIntoHiveTableTask, ImportAllDatabaseTablesTask, ConnectionBudgetScheduler,
+    allocate_mappers
+)
+from edx.analytics.tasks.mysql_extract import MysqlRangeExtractTask
+from edx.analytics.tasks.sqoop import SqoopImportFromMysql
 from edx.analytics.tasks.tests import unittest
 from edx.analytics.tasks.tests.config import with_luigi_config
 
@@ -60,3 +72,256 @@ class ImportStudentCourseEnrollmentTestCase(unittest.TestCase):
             output.exists = Mock(return_value=True)
             self.assertTrue(task.complete())
             self.assertTrue(output.exists.called)
+
+    def test_import_engine(self):
+        task = ImportStudentCourseEnrollmentTask(import_engine='python')
+        required = task.requires()
+        self.assertIsInstance(required, MysqlRangeExtractTask)
+        self.assertEquals(required.table_name, 'student_courseenrollment')
+        self.assertEquals(required.fields_terminated_by, '\x01')
+
+    def test_default_import_engine(self):
+        task = ImportStudentCourseEnrollmentTask()
+        self.assertIsInstance(task.requires(), SqoopImportFromMysql)
+
+    def test_unknown_import_engine(self):
+        task = ImportStudentCourseEnrollmentTask(import_engine='foo')
+        with self.assertRaises(ValueError):
+            task.requires()
+
+
+class ImportIncrementalEnrollmentTask(ImportStudentCourseEnrollmentTask):
+    """An enrollment import that can be incremental."""
+    check_column = 'id'
+
+
+class IncrementalImportTestCase(unittest.TestCase):
+    """Tests to validate incremental imports into Hive."""
+
+    def setUp(self):
+        self.destination = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.destination)
+
+    def write_metadata(self, partition_date, metadata):
+        """Write the Sqoop metadata of a previous import."""
+        partition_path = os.path.join(self.destination, 'student_courseenrollment', 'dt=' + partition_date)
+        os.makedirs(partition_path)
+        with open(os.path.join(partition_path, '.metadata'), 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+
+    def checkpoint(self, last_value):
+        """Returns the metadata of a successful incremental import."""
+        return {'succeeded': True, 'incremental': 'append', 'check_column': 'id', 'last_value': last_value}
+
+    def create_task(self, **kwargs):
+        """Create an incremental import of the enrollment table."""
+        task_kwargs = {
+            'destination': self.destination,
+            'import_date': datetime.date(2014, 7, 3),
+            'incremental': True,
+        }
+        task_kwargs.update(kwargs)
+        return ImportIncrementalEnrollmentTask(**task_kwargs)
+
+    def test_continue_from_previous_import(self):
+        self.write_metadata('2014-06-30', self.checkpoint('55'))
+        self.write_metadata('2014-07-01', self.checkpoint('78'))
+        # This import failed, so it didn't record a checkpoint.
+        self.write_metadata('2014-07-02', {'start_time': '2014-07-02T00:00:00'})
+
+        required = self.create_task().requires()
+        self.assertEquals(required.incremental, 'append')
+        self.assertEquals(required.check_column, 'id')
+        self.assertEquals(required.last_value, '78')
+
+    def test_full_import_since_previous_checkpoint(self):
+        self.write_metadata('2014-06-30', self.checkpoint('55'))
+        # This full import succeeded, and replaced the table with one that has all of the rows.
+        self.write_metadata('2014-07-01', {'succeeded': True, 'incremental': None})
+        self.write_metadata('2014-07-02', {'start_time': '2014-07-02T00:00:00'})
+
+        task = self.create_task()
+        required = task.requires()
+        self.assertEquals(required.incremental, 'append')
+        self.assertIsNone(required.last_value)
+        self.assertIn('DROP TABLE IF EXISTS student_courseenrollment;', task.query())
+
+    def test_first_import(self):
+        required = self.create_task().requires()
+        self.assertEquals(required.incremental, 'append')
+        self.assertIsNone(required.last_value)
+
+    def test_not_incremental(self):
+        self.write_metadata('2014-07-01', self.checkpoint('78'))
+        required = self.create_task(incremental=False).requires()
+        self.assertIsNone(required.incremental)
+        self.assertIsNone(required.last_value)
+
+    def test_incremental_with_python_engine(self):
+        with self.assertRaises(ValueError):
+            self.create_task(import_engine='python').requires()
+
+    def test_query_keeps_partitions(self):
+        self.write_metadata('2014-07-01', self.checkpoint('78'))
+        query = self.create_task().query()
+        self.assertNotIn('DROP TABLE', query)
+        self.assertIn('CREATE EXTERNAL TABLE IF NOT EXISTS student_courseenrollment', query)
+        self.assertIn("ALTER TABLE student_courseenrollment ADD IF NOT EXISTS PARTITION (dt = '2014-07-03');", query)
+
+    def test_first_import_query_replaces_table(self):
+        query = self.create_task().query()
+        self.assertIn('DROP TABLE IF EXISTS student_courseenrollment;', query)
+        self.assertIn("ALTER TABLE student_courseenrollment ADD PARTITION (dt = '2014-07-03');", query)
+
+
+class ImportAllDatabaseTablesTestCase(unittest.TestCase):
+    """Tests to validate scheduling the import of all of the tables."""
+
+    def setUp(self):
+        luigi.task.Register.clear_instance_cache()
+        self.imports = []
+        self.hive_queries = []
+
+        for target, kwargs in (
+            (ImportAllDatabaseTablesTask, {'attribute': 'get_table_sizes', 'return_value': {
+                'student_courseenrollment': (6000, 600),
+                'auth_user': (1000, 300),
+                'auth_userprofile': (1000, 100),
+            }}),
+            (ImportAllDatabaseTablesTask, {'attribute': 'get_imported_row_count', 'return_value': None}),
+            (ImportIntoHiveTableTask, {'attribute': 'complete', 'return_value': False}),
+            (ImportIntoHiveTableTask, {'attribute': 'run', 'autospec': True, 'side_effect': self.record_hive_query}),
+            (SqoopImportFromMysql, {'attribute': 'complete', 'return_value': False}),
+            (SqoopImportFromMysql, {'attribute': 'run', 'autospec': True, 'side_effect': self.record_import}),
+        ):
+            patcher = patch.object(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def record_import(self, import_task):
+        """Remember the number of mappers used to import a table."""
+        self.imports.append((import_task.table_name, import_task.num_mappers))
+
+    def record_hive_query(self, hive_task):
+        """Remember the tables added to Hive.  The jobs run in threads, so this doesn't rely on a mock's call count."""
+        self.hive_queries.append(hive_task.table_name)
+
+    def create_task(self, **kwargs):
+        """Create a task that imports all of the tables."""
+        task_kwargs = {
+            'destination': 's3://foo/bar',
+            'credentials': 's3://foo/credentials.json',
+            'import_date': datetime.date(2014, 7, 1),
+        }
+        task_kwargs.update(kwargs)
+        return ImportAllDatabaseTablesTask(**task_kwargs)
+
+    def test_requires_tables_without_budget(self):
+        task = self.create_task()
+        self.assertEquals(
+            sorted(required.table_name for required in task.requires()),
+            ['auth_user', 'auth_userprofile', 'student_courseenrollment']
+        )
+        task.run()
+        self.assertEquals(self.imports, [])
+
+    def test_mappers_in_proportion_to_size(self):
+        self.create_task(connection_budget=10).run()
+        self.assertEquals(
+            sorted(self.imports), [('auth_user', 3), ('auth_userprofile', 1), ('student_courseenrollment', 6)]
+        )
+        self.assertEquals(sorted(self.hive_queries), ['auth_user', 'auth_userprofile', 'student_courseenrollment'])
+
+    def test_throughput_logged(self):
+        ImportAllDatabaseTablesTask.get_imported_row_count.side_effect = (  # pylint: disable=no-member
+            lambda import_task: 5000 if import_task.table_name == 'auth_user' else None
+        )
+        with patch('edx.analytics.tasks.database_imports.log') as mock_log:
+            self.create_task(connection_budget=10).run()
+
+        messages = dict(
+            (args[1], args[0] % args[1:]) for args, _kwargs in mock_log.info.call_args_list
+            if args[0].startswith('Imported')
+        )
+        self.assertIn(': 5000 rows (actual, ', messages['auth_user'])
+        self.assertIn(': 6000 rows (estimated, ', messages['student_courseenrollment'])
+
+    def test_throughput_not_logged_for_completed_import(self):
+        SqoopImportFromMysql.complete.return_value = True  # pylint: disable=no-member
+        with patch('edx.analytics.tasks.database_imports.log') as mock_log:
+            self.create_task(connection_budget=10).run()
+
+        self.assertEquals(self.imports, [])
+        self.assertFalse(any(args[0].startswith('Imported') for args, _kwargs in mock_log.info.call_args_list))
+        self.assertEquals(sorted(self.hive_queries), ['auth_user', 'auth_userprofile', 'student_courseenrollment'])
+
+    def test_explicit_num_mappers(self):
+        self.create_task(connection_budget=10, num_mappers=2).run()
+        self.assertEquals([num_mappers for _table_name, num_mappers in self.imports], [2, 2, 2])
+
+    def test_allocate_mappers(self):
+        self.assertEquals(allocate_mappers([600, 300, 100], 10), [6, 3, 1])
+        self.assertEquals(allocate_mappers([1000, 1], 4), [4, 1])
+        self.assertEquals(allocate_mappers([0, 0], 4), [1, 1])
+
+
+class ConnectionBudgetSchedulerTestCase(unittest.TestCase):
+    """Tests to validate running jobs within a connection budget."""
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.connections_in_use = 0
+        self.max_connections_in_use = 0
+        self.finished = []
+
+    def make_job(self, name, connections):
+        """Returns a job that records the number of connections in use while it runs."""
+        def job():
+            """Hold the connections for a little while."""
+            with self.lock:
+                self.connections_in_use += connections
+                self.max_connections_in_use = max(self.max_connections_in_use, self.connections_in_use)
+            time.sleep(0.01)
+            with self.lock:
+                self.connections_in_use -= connections
+                self.finished.append(name)
+
+        return (name, connections, job)
+
+    def test_within_budget(self):
+        jobs = [self.make_job(name, connections) for name, connections in (('a', 3), ('b', 2), ('c', 1), ('d', 4))]
+        ConnectionBudgetScheduler(4).run(jobs)
+        self.assertEquals(sorted(self.finished), ['a', 'b', 'c', 'd'])
+        self.assertEquals(self.max_connections_in_use, 4)
+
+    def test_failure(self):
+        def fail():
+            """Lose the connection."""
+            raise IOError('Lost connection')
+
+        scheduler = ConnectionBudgetScheduler(1)
+        with self.assertRaisesRegexp(IOError, 'Lost connection'):
+            scheduler.run([('a', 1, fail), self.make_job('b', 1)])
+        self.assertEquals(self.finished, [])
+        self.assertEquals(scheduler.available_connections, 1)
+
+    def test_follow_up_after_release(self):
+        scheduler = ConnectionBudgetScheduler(3)
+        available_during_follow_up = []
+
+        def follow_up():
+            """Check the connections of the job have been released."""
+            available_during_follow_up.append(scheduler.available_connections)
+
+        scheduler.run([('a', 3, lambda: follow_up)])
+        self.assertEquals(available_during_follow_up, [3])
+
+    def test_follow_up_failure(self):
+        def fail():
+            """Fail after the connections are released."""
+            raise IOError('Hive query failed')
+
+        scheduler = ConnectionBudgetScheduler(1)
+        with self.assertRaisesRegexp(IOError, 'Hive query failed'):
+            scheduler.run([('a', 1, lambda: fail)])
+        self.assertEquals(scheduler.available_connections, 1)
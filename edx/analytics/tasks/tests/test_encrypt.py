@@ -1,9 +1,12 @@
 """Tests of utilities to encrypt files."""
 
-import gnupg
+import os
 import tempfile
 
-from edx.analytics.tasks.encrypt import make_encrypted_file, _import_key_files
+import gnupg
+from mock import patch
+
+from edx.analytics.tasks.encrypt import make_encrypted_file, _import_key_files, KeyringCache
 from edx.analytics.tasks.tests import unittest
 from edx.analytics.tasks.url import get_target_from_url
 from edx.analytics.tasks.url import url_path_join
@@ -55,3 +58,44 @@ class MakeEncryptedFileTest(unittest.TestCase):
 
             output_file.seek(0)
             self.check_encrypted_data(output_file, values)
+
+
+class KeyringCacheTest(unittest.TestCase):
+    """Test reusing keyrings for the same key files."""
+
+    def setUp(self):
+        self.keyring_cache = KeyringCache()
+        self.addCleanup(self.keyring_cache.cleanup)
+        self.key_file_targets = [
+            get_target_from_url(url_path_join('gpg-keys', recipient))
+            for recipient in ['daemon@edx.org', 'daemon+master@edx.org']
+        ]
+
+    def test_same_key_files(self):
+        keyring = self.keyring_cache.get_keyring(self.key_file_targets)
+        self.assertIs(self.keyring_cache.get_keyring(list(reversed(self.key_file_targets))), keyring)
+        self.assertEquals(len(keyring.list_keys()), 2)
+        self.assertEquals(self.keyring_cache.imports_avoided, 2)
+
+    def test_different_key_files(self):
+        keyring = self.keyring_cache.get_keyring(self.key_file_targets)
+        other_keyring = self.keyring_cache.get_keyring(self.key_file_targets[:1])
+        self.assertIsNot(other_keyring, keyring)
+        self.assertEquals(len(other_keyring.list_keys()), 1)
+        self.assertEquals(self.keyring_cache.imports_avoided, 0)
+
+    def test_recipients_listed_once(self):
+        keyring = self.keyring_cache.get_keyring(self.key_file_targets)
+        with patch.object(keyring, 'list_keys', wraps=keyring.list_keys) as list_keys_mock:
+            recipients = self.keyring_cache.get_recipients(keyring)
+            self.assertIs(self.keyring_cache.get_recipients(keyring), recipients)
+
+        self.assertEquals(len(recipients), 2)
+        self.assertEquals(list_keys_mock.call_count, 1)
+
+    def test_cleanup(self):
+        keyring = self.keyring_cache.get_keyring(self.key_file_targets)
+        self.assertTrue(os.path.exists(keyring.gnupghome))
+        self.keyring_cache.cleanup()
+        self.assertFalse(os.path.exists(keyring.gnupghome))
+        self.assertEquals(self.keyring_cache.keyrings, {})
@@ -3,13 +3,21 @@ Tests for event export tasks
 """
 
 import datetime
+import gzip
+import os
+import shutil
+import StringIO
+import tempfile
 
+import gnupg
 from luigi.date_interval import Year
 from mock import MagicMock, patch
+from opaque_keys.edx.keys import CourseKey
 import yaml
 
 from edx.analytics.tasks.event_exports import EventExportTask
 from edx.analytics.tasks.tests import unittest
+from edx.analytics.tasks.tests.config import with_luigi_config
 from edx.analytics.tasks.tests.target import FakeTarget
 from edx.analytics.tasks.tests.opaque_key_mixins import InitializeOpaqueKeysMixin
 
@@ -292,6 +300,44 @@ class EventExportTestCase(InitializeOpaqueKeysMixin, unittest.TestCase):
         }
         self.assertIsNone(self.task.get_org_id(event))
 
+    def clear_org_lookup_caches(self):
+        """Forget the organizations looked up by other tests, since luigi reuses the task instance."""
+        self.task.org_id_for_url.clear()
+        self.task.org_id_for_course_id.clear()
+
+    def test_org_lookups_cached(self):
+        self.clear_org_lookup_caches()
+        event = {
+            'event_source': 'browser',
+            'page': 'http://courses.example.com/courses/{}/content'.format(self.course_id)
+        }
+        with patch('edx.analytics.tasks.event_exports.CourseKey.from_string', wraps=CourseKey.from_string) as parse:
+            self.assertEquals(self.task.get_org_id(event), self.org_id)
+            self.assertEquals(self.task.get_org_id(event), self.org_id)
+
+            # A different page of the same course is only matched against the URL pattern.
+            event['page'] = 'http://courses.example.com/courses/{}/info'.format(self.course_id)
+            self.assertEquals(self.task.get_org_id(event), self.org_id)
+
+        self.assertEquals(parse.call_count, 1)
+
+    def test_org_lookup_cache_bounded(self):
+        self.clear_org_lookup_caches()
+        with patch('edx.analytics.tasks.event_exports.MAX_CACHED_ORG_LOOKUPS', 2):
+            for page in ['content', 'info', 'progress']:
+                event = {
+                    'event_source': 'browser',
+                    'page': 'http://courses.example.com/courses/FooX/LearningMath/2014T2/{}'.format(page)
+                }
+                self.assertEquals(self.task.get_org_id(event), 'FooX')
+                self.assertLessEqual(len(self.task.org_id_for_url), 2)
+
+    def test_recipients(self):
+        self.task.init_local()
+        for _ in xrange(2):
+            self.assertEquals(self.task._get_recipients('FooX'), ('automation@foox.com', 'skeleton.key@example.com'))
+            self.assertEquals(self.task._get_recipients('BazX'), ('automation@barx.com', 'skeleton.key@example.com'))
+
     def test_output_path_for_key(self):
         path = self.task.output_path_for_key((datetime.date(2015, 1, 1), 'OrgX'))
         self.assertEquals('test://output/orgx/edx/events/2015/orgx-edx-events-2015-01-01.log.gz.gpg', path)
@@ -336,3 +382,133 @@ class EventExportTestCase(InitializeOpaqueKeysMixin, unittest.TestCase):
     def test_missing_environment_variable(self):
         self.task.init_local()
         self.assertItemsEqual([output for output in self.task.mapper(self.EXAMPLE_EVENT) if output is not None], [])
+
+
+class EventExportReducerTestCase(unittest.TestCase):
+    """Tests for encrypting the output of EventExportTask."""
+
+    CONFIGURATION = yaml.dump({
+        'organizations': {
+            'FooX': {
+                'recipient': 'daemon@edx.org'
+            },
+            'BarX': {
+                'recipients': ['daemon@edx.org'],
+            },
+        }
+    })
+
+    def setUp(self):
+        self.output_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_root)
+
+        self.task = EventExportTask(
+            mapreduce_engine='local',
+            output_root=self.output_root,
+            config='test://config/default.yaml',
+            source=['test://input/'],
+            environment='prod',
+            interval=Year.parse('2014'),
+            gpg_key_dir='gpg-keys',
+            gpg_master_key='daemon+master@edx.org',
+        )
+        self.task.input_local = MagicMock(return_value=FakeTarget(self.CONFIGURATION))
+        self.task.init_local()
+
+    def run_reducer(self, keys_and_values):
+        """Run the reducer for each of the keys and return the paths of the output files."""
+        self.task.init_reducer()
+        for key, values in keys_and_values:
+            self.assertEquals(list(self.task.reducer(key, values)), [])
+        self.assertEquals(list(self.task.final_reducer()), [])
+        return [self.task.output_path_for_key(key) for key, _values in keys_and_values]
+
+    def decrypt(self, path, private_key_path):
+        """Decrypt and decompress an output file."""
+        temp_dir = tempfile.mkdtemp(prefix='decrypt')
+        # gpg-agent removes its sockets from the directory as it exits, possibly while the directory is being deleted.
+        self.addCleanup(shutil.rmtree, temp_dir, True)
+        gpg = gnupg.GPG(gnupghome=temp_dir)
+        with open(private_key_path, 'r') as key_file:
+            gpg.import_keys(key_file.read())
+        with open(path, 'r') as encrypted_file:
+            decrypted = gpg.decrypt_file(encrypted_file, always_trust=True)
+        return gzip.GzipFile(fileobj=StringIO.StringIO(decrypted.data)).read()
+
+    @with_luigi_config('event-export', 'concurrent_encryptions', '2')
+    def test_encrypted_outputs(self):
+        keys_and_values = [
+            (('2014-05-20', 'FooX'), ['event {0}\n'.format(i) for i in xrange(1000)]),
+            (('2014-05-20', 'BarX'), ['bar event\n']),
+            (('2014-05-21', 'FooX'), ['another event\n']),
+        ]
+        paths = self.run_reducer(keys_and_values)
+
+        for path, (_key, values) in zip(paths, keys_and_values):
+            for private_key_path in ['gpg-keys/insecure_secret.key', 'gpg-keys/insecure_master_secret.key']:
+                self.assertEquals(self.decrypt(path, private_key_path), ''.join(values))
+
+    def test_keyrings_reused(self):
+        keys_and_values = [
+            (('2014-05-2{0}'.format(i), org_id), ['event\n']) for i in xrange(3) for org_id in ['FooX', 'BarX']
+        ]
+        with patch.object(self.task, 'incr_counter') as incr_counter:
+            self.task.init_reducer()
+            for key, values in keys_and_values:
+                list(self.task.reducer(key, values))
+            keyrings = self.task.keyring_cache.keyrings.values()
+
+            # The recipient and master keys are only imported once, no matter how many files are encrypted for them.
+            self.assertEquals(len(keyrings), 1)
+            self.assertEquals(self.task.keyring_cache.imports_avoided, 10)
+            self.assertEquals(
+                sum(call[0][2] for call in incr_counter.call_args_list if call[0][1] == 'GPG Key Imports Avoided'), 10
+            )
+
+            list(self.task.final_reducer())
+
+        self.assertFalse(os.path.exists(keyrings[0].gnupghome))
+
+    def test_reducer_failure(self):
+        def generate_values():
+            """Fail while the values are being written."""
+            yield 'event\n'
+            raise RuntimeError('Failed reading values')
+
+        key = ('2014-05-20', 'FooX')
+        self.task.init_reducer()
+        with self.assertRaises(RuntimeError):
+            list(self.task.reducer(key, generate_values()))
+        self.assertEquals(list(self.task.final_reducer()), [])
+        self.assertFalse(os.path.exists(self.task.output_path_for_key(key)))
+
+    @with_luigi_config('event-export', 'concurrent_encryptions', '2')
+    def test_reducer_failure_finishes_earlier_outputs(self):
+        def generate_values():
+            """Fail while the values are being written."""
+            yield 'event\n'
+            raise RuntimeError('Failed reading values')
+
+        finished_key = ('2014-05-20', 'BarX')
+        failed_key = ('2014-05-20', 'FooX')
+        self.task.init_reducer()
+        list(self.task.reducer(finished_key, ['bar event\n']))
+        keyrings = self.task.keyring_cache.keyrings.values()
+        with self.assertRaisesRegexp(RuntimeError, 'Failed reading values'):
+            list(self.task.reducer(failed_key, generate_values()))
+
+        # The file that was already being finished is complete, and nothing is left running.
+        self.assertEquals(
+            self.decrypt(self.task.output_path_for_key(finished_key), 'gpg-keys/insecure_secret.key'), 'bar event\n'
+        )
+        self.assertFalse(os.path.exists(self.task.output_path_for_key(failed_key)))
+        self.assertEquals(len(self.task.pending_outputs), 0)
+        self.assertFalse(os.path.exists(keyrings[0].gnupghome))
+
+    def test_key_without_output_path(self):
+        with patch.object(self.task, 'output_path_for_key', return_value=None):
+            self.task.init_reducer()
+            self.assertEquals(list(self.task.reducer(('2014-05-20', 'FooX'), ['event\n'])), [])
+            self.assertEquals(list(self.task.final_reducer()), [])
+
+        self.assertEquals(os.listdir(self.output_root), [])
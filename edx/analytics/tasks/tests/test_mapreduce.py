@@ -3,6 +3,7 @@
 from __future__ import absolute_import
 
 from mock import patch, call
+import gzip
 import os
 import tempfile
 import shutil
@@ -10,13 +11,21 @@ import shutil
 import luigi
 import luigi.hdfs
 
-from edx.analytics.tasks.mapreduce import MultiOutputMapReduceJobTask, MapReduceJobTask
+from edx.analytics.tasks.mapreduce import (
+    MultiOutputMapReduceJobTask, MapReduceJobTask, EmulatedMapReduceJobRunner, exclude_splittable_targets,
+    generate_input_targets
+)
 from edx.analytics.tasks.tests import unittest
+from edx.analytics.tasks.tests.config import with_luigi_config
 
 
 class MapReduceJobTaskTest(unittest.TestCase):
     """Tests for MapReduceJobTask"""
 
+    def setUp(self):
+        # Each test sets different requirements on what would otherwise be the same cached task instance.
+        luigi.task.Register.clear_instance_cache()
+
     def test_job_with_special_input_targets(self):
         lib_jar_path = ['hdfs:///tmp/something.jar']
         input_format = 'com.example.SpecialInputFormat'
@@ -63,6 +72,15 @@ class MapReduceJobTaskTest(unittest.TestCase):
         self.assertItemsEqual(runner.libjars_in_hdfs, ['foo', 'baz'])
         self.assertEquals(runner.input_format, 'com.example.Foo')
 
+    @patch('edx.analytics.tasks.mapreduce.convert_tasks_to_manifest_if_necessary')
+    def test_hadoop_requirements_converted_once(self, convert_mock):
+        job = DynamicRequirementsJob()
+        job.requirements = [TaskWithSpecialOutputs()]
+
+        self.assertEquals(job.requires_hadoop(), convert_mock.return_value)
+        self.assertEquals(job.requires_hadoop(), convert_mock.return_value)
+        convert_mock.assert_called_once_with(job.requirements)
+
 
 class TaskWithSpecialOutputs(luigi.ExternalTask):
     """A task with a single output that requires the use of a configurable library jar and input format."""
@@ -168,6 +186,135 @@ class MultiOutputMapReduceJobTaskOutputRootTest(unittest.TestCase):
         self.assertFalse(os.path.exists(self.output_root))
 
 
+class EmulatedMapReduceJobRunnerTest(unittest.TestCase):
+    """Tests for reading input files in the emulated map reduce engine."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+        self.plain_path = self.create_file('plain.log', 'a\nb\n')
+        self.gzip_path = os.path.join(self.temp_dir, 'compressed.log.gz')
+        with gzip.open(self.gzip_path, 'wb') as gzip_file:
+            gzip_file.write('c\n')
+        self.other_path = self.create_file('other.log', 'd\n')
+        self.manifest_path = self.create_file('input.manifest', '\n'.join([self.gzip_path, self.other_path]) + '\n')
+
+    def create_file(self, name, contents):
+        """Write a file to the temporary directory and return its path."""
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'w') as output_file:
+            output_file.write(contents)
+        return path
+
+    def get_input_targets(self):
+        """Return a plain input file followed by a manifest that lists a compressed file and another plain file."""
+        return [luigi.LocalTarget(self.plain_path), luigi.LocalTarget(self.manifest_path)]
+
+    def test_read_input_files(self):
+        input_files = EmulatedMapReduceJobRunner().read_input_files(self.get_input_targets())
+
+        self.assertEquals(
+            [(input_file.path, list(input_file), input_file.size) for input_file in input_files],
+            [
+                (self.plain_path, ['a\n', 'b\n'], 4),
+                (self.gzip_path, ['c\n'], 2),
+                (self.other_path, ['d\n'], 2),
+            ]
+        )
+
+    @with_luigi_config('map-reduce', 'emulated_split_size', '3')
+    def test_split_uncompressed_files(self):
+        input_files = list(EmulatedMapReduceJobRunner().read_input_files(self.get_input_targets()))
+
+        self.assertEquals(
+            [(input_file.path, input_file.byte_range, list(input_file)) for input_file in input_files],
+            [
+                (self.plain_path, (0, 3), ['a\n', 'b\n']),
+                (self.plain_path, (3, 4), []),
+                (self.gzip_path, None, ['c\n']),
+                (self.other_path, None, ['d\n']),
+            ]
+        )
+
+    def test_read_error(self):
+        input_files = EmulatedMapReduceJobRunner().read_input_files([luigi.LocalTarget(self.gzip_path + '.missing.gz')])
+
+        with self.assertRaises(IOError):
+            list(next(input_files))
+
+    def test_stop_reading(self):
+        input_files = EmulatedMapReduceJobRunner().read_input_files(self.get_input_targets())
+        first_file = next(input_files)
+        second_file = next(input_files)
+
+        input_files.close()
+
+        self.assertFalse(first_file.cancelled)
+        self.assertTrue(second_file.cancelled)
+
+    @with_luigi_config(
+        ('map-reduce', 'emulated_reader_threads', '1'),
+        ('map-reduce', 'emulated_prefetch_files', '1'),
+        ('map-reduce', 'emulated_read_ahead_blocks', '1'),
+        ('map-reduce', 'emulated_split_size', '1'),
+    )
+    def test_run_job(self):
+        output_path = os.path.join(self.temp_dir, 'output')
+        job = InputFileCountJob(output_path=output_path)
+        job.input_targets = self.get_input_targets()
+
+        EmulatedMapReduceJobRunner().run_job(job)
+
+        with open(output_path, 'r') as output_file:
+            self.assertItemsEqual(
+                output_file.read().splitlines(),
+                ['compressed.log.gz\t1', 'other.log\t1', 'plain.log\t2']
+            )
+
+    @with_luigi_config(
+        ('map-reduce', 'emulated_split_size', '1'),
+        ('map-reduce', 'emulated_map_processes', '2'),
+    )
+    def test_map_splits_in_processes(self):
+        output_path = os.path.join(self.temp_dir, 'output')
+        job = InputFileCountJob(output_path=output_path)
+        job.input_targets = self.get_input_targets()
+
+        EmulatedMapReduceJobRunner().run_job(job)
+
+        with open(output_path, 'r') as output_file:
+            self.assertItemsEqual(
+                output_file.read().splitlines(),
+                ['compressed.log.gz\t1', 'other.log\t1', 'plain.log\t2']
+            )
+
+    def test_exclude_splittable_targets(self):
+        split_targets = []
+        targets = list(exclude_splittable_targets(generate_input_targets(self.get_input_targets()), 3, split_targets))
+
+        self.assertEquals([target.path for target in targets], [self.gzip_path, self.other_path])
+        self.assertEquals([target.path for target in split_targets], [self.plain_path])
+
+
+class InputFileCountJob(MapReduceJobTask):
+    """Counts the lines in each input file."""
+
+    output_path = luigi.Parameter()
+
+    def input_hadoop(self):
+        return self.input_targets
+
+    def output(self):
+        return luigi.LocalTarget(self.output_path)
+
+    def mapper(self, _line):
+        yield os.path.basename(os.environ['map_input_file']), 1
+
+    def reducer(self, key, values):
+        yield key, sum(values)
+
+
 class TestJobTask(MultiOutputMapReduceJobTask):
     """Dummy task to use for testing."""
 
@@ -7,6 +7,7 @@ import datetime
 import textwrap
 
 import luigi
+import luigi.task
 
 from mock import MagicMock
 from mock import patch
@@ -27,6 +28,8 @@ class ConversionTestCase(unittest.TestCase):
     """
 
     def setUp(self):
+        # Make sure to flush the instance cache so that each test gets a task with an empty converter cache.
+        luigi.task.Register.clear_instance_cache()
         self.task = MysqlSelectTask(
             credentials=sentinel.ignored,
             destination=sentinel.ignored
@@ -59,6 +62,19 @@ class ConversionTestCase(unittest.TestCase):
             None, '-'
         )
 
+    def test_convert_datetime_subclass(self):
+        self.assert_converted_string_equals(
+            datetime.datetime(2014, 1, 2, 13, 10, 11), '2014-01-02'
+        )
+
+    def test_convert_uses_cached_converter(self):
+        self.task.convert(datetime.datetime(2014, 1, 1))
+        # The converters are only searched the first time a type is seen.
+        self.task.converters = []
+        self.assert_converted_string_equals(
+            datetime.datetime(2014, 1, 2, 13, 10, 11), '2014-01-02'
+        )
+
     def test_convert_unicode(self):
         self.assert_converted_string_equals(
             u'\u0669(\u0361\u0e4f\u032f\u0361\u0e4f)\u06f6',
@@ -81,9 +97,9 @@ class MysqlSelectTaskTestCase(unittest.TestCase):
         self.mock_cursor = mock_conn.cursor.return_value
 
         # By default, emulate 0 results returned
-        self.mock_cursor.fetchone.return_value = None
+        self.mock_cursor.fetchmany.return_value = []
 
-    def run_task(self, credentials=None, query=None):
+    def run_task(self, credentials=None, query=None, fetch_size=10000, buffer_results=False):
         """
         Emulate execution of a generic MysqlSelectTask.
         """
@@ -115,7 +131,9 @@ class MysqlSelectTaskTestCase(unittest.TestCase):
 
         task = TestTask(
             credentials=sentinel.ignored,
-            destination=sentinel.ignored
+            destination=sentinel.ignored,
+            fetch_size=fetch_size,
+            buffer_results=buffer_results
         )
 
         fake_input = {
@@ -151,25 +169,66 @@ class MysqlSelectTaskTestCase(unittest.TestCase):
         self.run_task()
 
     def test_execute_query(self):
-        self.mock_cursor.fetchone.side_effect = [
-            (2L,),
-            (3L,),
-            (10L,),
-            None
+        self.mock_cursor.fetchmany.side_effect = [
+            [(2L,), (3L,)],
+            [(10L,)],
+            []
         ]
 
-        output = self.run_task(query=sentinel.query)
+        output = self.run_task(query=sentinel.query, fetch_size=2)
 
         self.mock_cursor.execute.assert_called_once_with(sentinel.query, tuple())
+        self.mock_cursor.fetchmany.assert_called_with(2)
         self.assertEquals(output[0][0], 2)
         self.assertEquals(output[0][1], 3)
         self.assertEquals(output[0][2], 10)
 
+    def test_unbuffered_cursor(self):
+        self.run_task()
+
+        self.mock_mysql_connector.connect.return_value.cursor.assert_called_once_with(buffered=False)
+
+    def test_buffered_cursor(self):
+        self.run_task(buffer_results=True)
+
+        self.mock_mysql_connector.connect.return_value.cursor.assert_called_once_with(buffered=True)
+
+    def test_connection_closed_after_failure(self):
+        self.mock_cursor.fetchmany.side_effect = [[(1L,)], [(2L,)], []]
+
+        with patch.object(MysqlSelectTask, 'write_results_to_tsv', side_effect=IOError('Failed to write')):
+            with self.assertRaisesRegexp(IOError, 'Failed to write'):
+                self.run_task()
+
+        # The unread rows are dropped by the server rather than fetched.
+        self.assertFalse(self.mock_cursor.fetchmany.called)
+        self.assertFalse(self.mock_cursor.close.called)
+        self.assertTrue(self.mock_mysql_connector.connect.return_value.close.called)
+
+    def test_buffered_cursor_closed_after_failure(self):
+        with patch.object(MysqlSelectTask, 'write_results_to_tsv', side_effect=IOError('Failed to write')):
+            with self.assertRaisesRegexp(IOError, 'Failed to write'):
+                self.run_task(buffer_results=True)
+
+        self.assertTrue(self.mock_cursor.close.called)
+
+    def test_multiple_columns(self):
+        self.mock_cursor.fetchmany.side_effect = [
+            [(datetime.date(2014, 1, 2), 3L, None), (datetime.date(2014, 1, 3), 4L, u'a')],
+            []
+        ]
+
+        output = self.run_task(query=sentinel.query)
+
+        self.assertEquals(list(output[0]), ['2014-01-02', '2014-01-03'])
+        self.assertEquals(list(output[1]), [3, 4])
+        self.assertEquals(output[2][1], 'a')
+
     def test_unicode_results(self):
         unicode_string = u'\u0669(\u0361\u0e4f\u032f\u0361\u0e4f)\u06f6'
-        self.mock_cursor.fetchone.side_effect = [
-            (unicode_string,),
-            None
+        self.mock_cursor.fetchmany.side_effect = [
+            [(unicode_string,)],
+            []
         ]
 
         output = self.run_task(query=sentinel.query)
@@ -0,0 +1,251 @@
+"""Tests for extracting MySQL tables without Sqoop."""
+
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import textwrap
+
+import luigi.task
+from mock import MagicMock, patch, sentinel
+
+from edx.analytics.tasks.mysql_extract import (
+    MysqlRangeExtractTask, SqoopRecordFormatter, split_key_range, format_java_timestamp
+)
+from edx.analytics.tasks.tests import unittest
+from edx.analytics.tasks.tests.target import FakeTarget
+from edx.analytics.tasks.url import get_existing_urls
+
+
+COLUMNS = [
+    ('id', 'int(11)', 'int', 'PRI'),
+    ('username', 'varchar(30)', 'varchar', 'UNI'),
+    ('is_active', 'tinyint(1)', 'tinyint', ''),
+    ('date_joined', 'datetime', 'datetime', ''),
+]
+
+
+class FakeCursor(object):
+    """A cursor that answers the queries made by MysqlRangeExtractTask from a list of rows."""
+
+    def __init__(self, rows, executed_ranges):
+        self.rows = rows
+        self.executed_ranges = executed_ranges
+        self.results = []
+
+    def execute(self, query, parameters=()):
+        """Find the results of the query."""
+        if 'information_schema' in query:
+            self.results = list(COLUMNS)
+        elif query.startswith('SELECT MIN(id)'):
+            ids = [row[0] for row in self.rows]
+            self.results = [(min(ids), max(ids))]
+        elif parameters:
+            lower, upper = parameters
+            self.executed_ranges.append([lower, upper])
+            self.results = [row for row in self.rows if lower <= row[0] < upper]
+        else:
+            self.executed_ranges.append([None, None])
+            self.results = list(self.rows)
+
+    def fetchone(self):
+        """Return the next row of the results."""
+        return self.results.pop(0)
+
+    def fetchall(self):
+        """Return the remaining rows of the results."""
+        results, self.results = self.results, []
+        return results
+
+    def fetchmany(self, size):
+        """Return the next few rows of the results."""
+        results, self.results = self.results[:size], self.results[size:]
+        return results
+
+    def close(self):
+        """Nothing to close."""
+        pass
+
+
+class MysqlRangeExtractTaskTestCase(unittest.TestCase):
+    """Ensure tables are extracted in ranges, in the same format as Sqoop."""
+
+    def setUp(self):
+        self.destination = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.destination)
+
+        self.rows = [
+            (1, u'alice', 1, datetime.datetime(2014, 1, 2, 13, 10, 11)),
+            (2, u'b\xf6b', 0, datetime.datetime(2014, 1, 3)),
+            (4, u'carol\nsmith', None, None),
+            (5, u'dave', 1, datetime.datetime(2014, 1, 5, 1, 2, 3, 500000)),
+        ]
+        self.executed_ranges = []
+
+        patcher = patch('edx.analytics.tasks.mysql_extract.mysql.connector')
+        self.mock_mysql_connector = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_mysql_connector.connect.side_effect = self.connect
+
+    def connect(self, **_kwargs):
+        """Return a connection whose cursors answer queries from the rows."""
+        connection = MagicMock()
+        connection.cursor.side_effect = lambda **_kwargs: FakeCursor(self.rows, self.executed_ranges)
+        return connection
+
+    def create_task(self, **kwargs):
+        """Create a task that extracts the table to the destination directory."""
+        luigi.task.Register.clear_instance_cache()
+        task_kwargs = {
+            'credentials': sentinel.ignored,
+            'database': 'exampledata',
+            'destination': self.destination,
+            'table_name': 'auth_user',
+            'chunk_size': 2,
+            'num_mappers': 2,
+        }
+        task_kwargs.update(kwargs)
+        task = MysqlRangeExtractTask(**task_kwargs)
+        task.input = MagicMock(return_value={
+            'credentials': FakeTarget(textwrap.dedent('''\
+                {
+                    "host": "db.example.com",
+                    "port": "3306",
+                    "username": "exampleuser",
+                    "password": "example password"
+                }'''))
+        })
+        return task
+
+    def read_output(self):
+        """Returns the contents of the part files, in order."""
+        part_names = sorted(name for name in os.listdir(self.destination) if name.startswith('part-m-'))
+        output = []
+        for name in part_names:
+            with open(os.path.join(self.destination, name), 'r') as part_file:
+                output.append(part_file.read())
+        return output
+
+    def test_extract_in_ranges(self):
+        task = self.create_task()
+        task.run()
+
+        self.assertEquals(self.read_output(), [
+            "1,alice,true,2014-01-02 13:10:11.0\n2,b\xc3\xb6b,false,2014-01-03 00:00:00.0\n",
+            "4,'carol\nsmith',null,null\n",
+            "5,dave,true,2014-01-05 01:02:03.5\n",
+        ])
+        self.assertEquals(sorted(self.executed_ranges), [[1, 3], [3, 5], [5, 6]])
+        self.assertTrue(task.complete())
+        with open(os.path.join(self.destination, '.metadata'), 'r') as metadata_file:
+            metadata = json.load(metadata_file)
+        self.assertEquals(metadata['num_rows'], 4)
+        self.assertTrue(metadata['succeeded'])
+
+    def test_extract_for_hive(self):
+        task = self.create_task(
+            columns=['id', 'username', 'is_active'],
+            null_string='\\\\N',
+            mysql_delimiters=False,
+            fields_terminated_by='\x01',
+            delimiter_replacement=' ',
+        )
+        task.run()
+
+        self.assertEquals(''.join(self.read_output()), (
+            "1\x01alice\x01true\n"
+            "2\x01b\xc3\xb6b\x01false\n"
+            "4\x01carol smith\x01\\N\n"
+            "5\x01dave\x01true\n"
+        ))
+
+    def test_resume_extraction(self):
+        task = self.create_task()
+        with open(os.path.join(self.destination, '.ranges'), 'w') as ranges_file:
+            json.dump({'where': None, 'columns': [], 'ranges': [[1, 3], [3, 5], [5, 6]]}, ranges_file)
+        with open(os.path.join(self.destination, 'part-m-00000'), 'w') as part_file:
+            part_file.write('already extracted\n')
+
+        with patch('edx.analytics.tasks.mysql_extract.get_existing_urls', wraps=get_existing_urls) as mock_listing:
+            task.run()
+
+        self.assertEquals(mock_listing.call_count, 1)
+        self.assertEquals(sorted(self.executed_ranges), [[3, 5], [5, 6]])
+        self.assertEquals(self.read_output()[0], 'already extracted\n')
+
+    def test_resume_with_different_where(self):
+        task = self.create_task(where='id > 1')
+        with open(os.path.join(self.destination, '.ranges'), 'w') as ranges_file:
+            json.dump({'where': None, 'columns': [], 'ranges': [[1, 3], [3, 5], [5, 6]]}, ranges_file)
+        with open(os.path.join(self.destination, 'part-m-00000'), 'w') as part_file:
+            part_file.write('already extracted\n')
+
+        task.run()
+
+        self.assertEquals(sorted(self.executed_ranges), [[1, 3], [3, 5], [5, 6]])
+        self.assertNotIn('already extracted\n', self.read_output())
+        with open(os.path.join(self.destination, '.ranges'), 'r') as ranges_file:
+            self.assertEquals(json.load(ranges_file)['where'], 'id > 1')
+
+    def test_unknown_column(self):
+        task = self.create_task(columns=['id', 'nickname'])
+        with self.assertRaisesRegexp(ValueError, 'nickname'):
+            task.run()
+
+    def test_overwrite(self):
+        with open(os.path.join(self.destination, 'part-m-00000'), 'w') as part_file:
+            part_file.write('old data\n')
+
+        task = self.create_task(overwrite=True, chunk_size=10)
+        self.assertFalse(task.complete())
+        task.run()
+
+        self.assertEquals(len(self.read_output()), 1)
+        self.assertNotIn('old data', self.read_output()[0])
+
+    def test_table_without_integer_key(self):
+        COLUMNS[0] = ('id', 'varchar(10)', 'varchar', 'PRI')
+        self.addCleanup(COLUMNS.__setitem__, 0, ('id', 'int(11)', 'int', 'PRI'))
+        task = self.create_task()
+        task.run()
+
+        self.assertEquals(self.executed_ranges, [[None, None]])
+        self.assertEquals(len(self.read_output()), 1)
+
+    def test_extract_failure(self):
+        task = self.create_task()
+        task.extract_range = MagicMock(side_effect=Exception('Lost connection'))
+        with self.assertRaisesRegexp(Exception, 'Lost connection'):
+            task.run()
+
+        self.assertFalse(task.complete())
+        self.assertTrue(os.path.exists(os.path.join(self.destination, '.ranges')))
+
+
+class SqoopRecordFormatterTestCase(unittest.TestCase):
+    """Ensure values are formatted in the same way as Sqoop."""
+
+    def test_split_key_range(self):
+        self.assertEquals(split_key_range(1, 10, 4), [[1, 5], [5, 9], [9, 11]])
+        self.assertEquals(split_key_range(7, 7, 4), [[7, 8]])
+
+    def test_split_sparse_key_range(self):
+        self.assertEquals(split_key_range(1, 10, 1, max_num_ranges=3), [[1, 5], [5, 9], [9, 11]])
+        self.assertEquals(len(split_key_range(0, 10 ** 12, 1000)), 10000)
+
+    def test_mysql_delimiters(self):
+        formatter = SqoopRecordFormatter([False, False, False])
+        self.assertEquals(formatter.format_record((u"it's", 'a,b', 'c\\d')), "it\\'s,'a,b',c\\\\d\n")
+
+    def test_values(self):
+        formatter = SqoopRecordFormatter([False] * 5, mysql_delimiters=False)
+        self.assertEquals(
+            formatter.format_record(
+                (datetime.date(2014, 1, 2), datetime.timedelta(hours=25, seconds=3), 10L, 0.5, True)
+            ),
+            "2014-01-02,25:00:03,10,0.5,true\n"
+        )
+
+    def test_java_timestamp(self):
+        self.assertEquals(format_java_timestamp(datetime.datetime(1850, 1, 2, 3, 4, 5, 120)), '1850-01-02 03:04:05.00012')
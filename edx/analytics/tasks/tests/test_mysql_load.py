@@ -3,6 +3,7 @@ Ensure we can write to MySQL data sources.
 """
 from __future__ import absolute_import
 
+from functools import partial
 import textwrap
 
 import luigi
@@ -13,7 +14,7 @@ from mock import MagicMock
 from mock import patch
 from mock import sentinel
 
-from edx.analytics.tasks.mysql_load import MysqlInsertTask, coerce_for_mysql_connect
+from edx.analytics.tasks.mysql_load import MysqlInsertTask, coerce_for_mysql_connect, format_for_load_data
 from edx.analytics.tasks.tests import unittest
 from edx.analytics.tasks.tests.target import FakeTarget
 from edx.analytics.tasks.tests.config import with_luigi_config
@@ -52,6 +53,22 @@ class InsertIntoMysqlDummyTableWithIndexes(InsertToMysqlDummyTable):
         ]
 
 
+class InsertToMysqlDummyTableWithCustomInitCopy(InsertToMysqlDummyTable):
+    """
+    Define table for testing that keeps some of its rows when overwritten.
+    """
+    def init_copy(self, connection):
+        connection.cursor().execute("DELETE FROM dummy_table WHERE interval_start < '2014-01-01'")
+
+
+class InsertToMysqlDummyTableWithCustomCreateTable(InsertToMysqlDummyTable):
+    """
+    Define table for testing that is created by its own query.
+    """
+    def create_table(self, connection):
+        connection.cursor().execute("CREATE TABLE IF NOT EXISTS dummy_table (course_id VARCHAR(255) UNIQUE)")
+
+
 class InsertToPredefinedMysqlDummyTable(InsertToMysqlDummyTable):
     """
     Define table for testing without definitions (since table is externally defined).
@@ -71,7 +88,9 @@ class MysqlInsertTaskTestCase(unittest.TestCase):
         self.mock_mysql_connector = patcher.start()
         self.addCleanup(patcher.stop)
 
-    def create_task(self, credentials=None, source=None, insert_chunk_size=100, cls=InsertToMysqlDummyTable):
+    def create_task(self, credentials=None, source=None, insert_chunk_size=100, cls=InsertToMysqlDummyTable,
+                    load_strategy='insert', use_staging_table=False, overwrite=False, bulk_load=False,
+                    load_connections=1):
         """
          Emulate execution of a generic MysqlTask.
         """
@@ -80,7 +99,12 @@ class MysqlInsertTaskTestCase(unittest.TestCase):
         luigi.task.Register.clear_instance_cache()
         task = cls(
             credentials=sentinel.ignored,
-            insert_chunk_size=insert_chunk_size
+            insert_chunk_size=insert_chunk_size,
+            load_strategy=load_strategy,
+            use_staging_table=use_staging_table,
+            overwrite=overwrite,
+            bulk_load=bulk_load,
+            load_connections=load_connections
         )
 
         if not credentials:
@@ -114,6 +138,12 @@ class MysqlInsertTaskTestCase(unittest.TestCase):
     def test_parameters_from_config(self):
         t = InsertToMysqlDummyTable(credentials=sentinel.credentials)
         self.assertEquals(t.database, 'foobar')
+        self.assertEquals(t.insert_chunk_size, 100)
+
+    @with_luigi_config('database-export', 'insert_chunk_size', '10000')
+    def test_insert_chunk_size_from_config(self):
+        t = InsertToMysqlDummyTable(credentials=sentinel.credentials)
+        self.assertEquals(t.insert_chunk_size, 10000)
 
     def test_run(self):
         self.create_task().run()
@@ -222,6 +252,31 @@ class MysqlInsertTaskTestCase(unittest.TestCase):
         with self.assertRaises(Exception):
             task.insert_rows(MagicMock())
 
+    def test_insert_multiple_rows_limited_by_statement_size(self):
+        task = self.create_task(source=self._get_source_string(4))
+        # Each row of unicode values is estimated at 122 bytes, so only two of them fit in a statement.
+        task.max_statement_size = 250
+        cursor = MagicMock()
+        task.insert_rows(cursor)
+        execute_calls = cursor.execute.mock_calls
+        self.assertEquals(len(execute_calls), 2)
+        expected_row_args = self._get_expected_query_args(4)
+        self.assertEquals(execute_calls[0][1][1], expected_row_args[:10])
+        self.assertEquals(execute_calls[1][1][1], expected_row_args[10:])
+
+    def test_get_max_statement_size(self):
+        task = self.create_task()
+        connection = MagicMock()
+        connection.cursor.return_value.fetchone.return_value = (4194304,)
+        self.assertEquals(task.get_max_statement_size(connection), 2097152)
+        connection.cursor.return_value.execute.assert_called_once_with("SELECT @@max_allowed_packet")
+
+    def test_get_max_statement_size_unknown(self):
+        task = self.create_task()
+        connection = MagicMock()
+        connection.cursor.return_value.fetchone.return_value = None
+        self.assertEquals(task.get_max_statement_size(connection), 1024 * 1024)
+
     def test_insert_row_to_predefined_table(self):
         task = self.create_task(cls=InsertToPredefinedMysqlDummyTable)
         cursor = MagicMock()
@@ -231,6 +286,265 @@ class MysqlInsertTaskTestCase(unittest.TestCase):
         row_args = cursor.execute.call_args[0][1]
         self.assertEquals(row_args, self._get_expected_query_args(1))
 
+    def get_loaded_data(self, task):
+        """Run load_rows() and return the query that was executed and the contents of the file that it loaded."""
+        loaded = {}
+
+        def read_data_file(query, params):
+            """Read the file before it is deleted."""
+            loaded['query'] = query
+            with open(params[0], 'r') as data_file:
+                loaded['data'] = data_file.read()
+
+        cursor = MagicMock()
+        cursor.execute.side_effect = read_data_file
+        task.load_rows(cursor)
+        self.assertEquals(cursor.execute.call_count, 1)
+        return loaded['query'], loaded['data']
+
+    def test_load_rows(self):
+        task = self.create_task(source=self._get_source_string(2), load_strategy='load_data')
+        query, data = self.get_loaded_data(task)
+        self.assertEquals(
+            query,
+            "LOAD DATA LOCAL INFILE %s INTO TABLE dummy_table CHARACTER SET utf8 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            "(course_id,interval_start,interval_end,label,count)"
+        )
+        self.assertEquals(data, self._get_source_string(2))
+
+    def test_load_rows_with_nulls_and_escapes(self):
+        source = 'course1\t2014-05-01\tNone\tback\\slash\t\\N\n'
+        task = self.create_task(source=source, load_strategy='load_data')
+        _query, data = self.get_loaded_data(task)
+        self.assertEquals(data, 'course1\t2014-05-01\t\\N\tback\\\\slash\t\\N\n')
+
+    def test_load_rows_not_square(self):
+        source = self._get_source_string(4).replace('ACTIVE', 'AC\tTIVE', 1)
+        task = self.create_task(source=source, load_strategy='load_data')
+        with self.assertRaises(Exception):
+            task.load_rows(MagicMock())
+
+    def test_run_with_load_data(self):
+        task = self.create_task(load_strategy='load_data')
+        task.run()
+        mock_connect = self.mock_mysql_connector.connect
+        self.assertTrue(any('client_flags' in kwargs for _args, kwargs in mock_connect.call_args_list))
+        queries = [args[0] for args, _kwargs in mock_connect.return_value.cursor.return_value.execute.call_args_list]
+        self.assertTrue(any(query.startswith('LOAD DATA LOCAL INFILE') for query in queries))
+        self.assertTrue(mock_connect.return_value.commit.called)
+
+    def test_run_with_unknown_load_strategy(self):
+        with self.assertRaises(ValueError):
+            self.create_task(load_strategy='foo').run()
+
+    def get_executed_queries(self):
+        """Returns the queries that were executed on any connection."""
+        mock_cursor = self.mock_mysql_connector.connect.return_value.cursor.return_value
+        return [args[0] for args, _kwargs in mock_cursor.execute.call_args_list]
+
+    def test_run_with_staging_table(self):
+        task = self.create_task(
+            cls=InsertIntoMysqlDummyTableWithIndexes, source=self._get_source_string(2), use_staging_table=True,
+            overwrite=True
+        )
+        task.run()
+
+        queries = self.get_executed_queries()
+        staging_queries = queries[queries.index('DROP TABLE IF EXISTS dummy_table__staging'):]
+        self.assertEquals(staging_queries[:8], [
+            "DROP TABLE IF EXISTS dummy_table__staging",
+            "DROP TABLE IF EXISTS dummy_table__old",
+            "CREATE TABLE IF NOT EXISTS dummy_table__staging "
+            "(id BIGINT(20) NOT NULL AUTO_INCREMENT,course_id VARCHAR(255),"
+            "interval_start DATETIME,interval_end DATETIME,label VARCHAR(255),"
+            "count INT,created TIMESTAMP DEFAULT NOW(),PRIMARY KEY (id))",
+            self._get_expected_query(2).replace('dummy_table', 'dummy_table__staging'),
+            "ALTER TABLE dummy_table__staging ADD INDEX (course_id),ADD INDEX (interval_start,interval_end)",
+            "RENAME TABLE dummy_table TO dummy_table__old, dummy_table__staging TO dummy_table",
+            "DROP TABLE dummy_table__old",
+            "DELETE FROM table_updates where `target_table`='dummy_table'",
+        ])
+        # The table being served is never emptied.
+        self.assertNotIn("DELETE FROM dummy_table", queries)
+        self.assertTrue(self.mock_mysql_connector.connect.return_value.commit.called)
+
+    def test_run_with_staging_table_failure(self):
+        task = self.create_task(use_staging_table=True, overwrite=True)
+        task._insert_rows_with_cursors = MagicMock(side_effect=Exception("Failed to insert rows"))
+        with self.assertRaises(Exception):
+            task.run()
+
+        queries = self.get_executed_queries()
+        self.assertFalse(any(query.startswith('RENAME TABLE') for query in queries))
+        self.assertTrue(self.mock_mysql_connector.connect.return_value.rollback.called)
+
+    def test_staging_table_without_overwrite(self):
+        self.create_task(use_staging_table=True).run()
+
+        queries = self.get_executed_queries()
+        self.assertNotIn("DROP TABLE IF EXISTS dummy_table__staging", queries)
+        self.assertIn(self._get_expected_query(1), queries)
+
+    def test_staging_table_with_custom_init_copy(self):
+        task = self.create_task(cls=InsertToMysqlDummyTableWithCustomInitCopy, use_staging_table=True, overwrite=True)
+        task.run()
+
+        queries = self.get_executed_queries()
+        self.assertNotIn("DROP TABLE IF EXISTS dummy_table__staging", queries)
+        self.assertIn("DELETE FROM dummy_table WHERE interval_start < '2014-01-01'", queries)
+
+    def test_staging_table_with_custom_create_table(self):
+        task = self.create_task(cls=InsertToMysqlDummyTableWithCustomCreateTable, use_staging_table=True, overwrite=True)
+        task.run()
+
+        queries = self.get_executed_queries()
+        staging_queries = queries[queries.index("CREATE TABLE IF NOT EXISTS dummy_table (course_id VARCHAR(255) UNIQUE)"):]
+        self.assertEquals(staging_queries[:5], [
+            "CREATE TABLE IF NOT EXISTS dummy_table (course_id VARCHAR(255) UNIQUE)",
+            "SELECT @@max_allowed_packet",
+            "DROP TABLE IF EXISTS dummy_table__staging",
+            "DROP TABLE IF EXISTS dummy_table__old",
+            "CREATE TABLE dummy_table__staging LIKE dummy_table",
+        ])
+        self.assertFalse(any(query.startswith('ALTER TABLE') for query in queries))
+
+    def test_run_with_load_connections(self):
+        self.create_task(use_staging_table=True, overwrite=True).run()
+        single_connection_count = self.mock_mysql_connector.connect.call_count
+        single_connection_queries = len(self.get_executed_queries())
+
+        task = self.create_task(
+            source=self._get_source_string(4), insert_chunk_size=1, use_staging_table=True, overwrite=True,
+            load_connections=3
+        )
+        task.run()
+
+        self.assertEquals(self.mock_mysql_connector.connect.call_count, 2 * single_connection_count + 2)
+        queries = self.get_executed_queries()[single_connection_queries:]
+        insert_query = self._get_expected_query(1).replace('dummy_table', 'dummy_table__staging')
+        self.assertEquals(queries.count(insert_query), 4)
+        self.assertLess(
+            max(index for index, query in enumerate(queries) if query == insert_query),
+            queries.index("RENAME TABLE dummy_table TO dummy_table__old, dummy_table__staging TO dummy_table")
+        )
+        self.assertTrue(self.mock_mysql_connector.connect.return_value.close.called)
+
+    def test_run_with_load_connections_and_load_data(self):
+        task = self.create_task(use_staging_table=True, overwrite=True, load_connections=2, load_strategy='load_data')
+        task.run()
+
+        queries = self.get_executed_queries()
+        self.assertEquals(len([query for query in queries if query.startswith('LOAD DATA LOCAL INFILE')]), 2)
+
+    def test_run_with_invalid_load_connections(self):
+        with self.assertRaises(ValueError):
+            self.create_task(use_staging_table=True, load_connections=0).run()
+
+    def test_load_rows_with_several_cursors(self):
+        task = self.create_task(source=self._get_source_string(3), load_strategy='load_data')
+        loaded = {}
+
+        def read_data_file(cursor_name, _query, params):
+            """Read the file before it is deleted."""
+            with open(params[0], 'r') as data_file:
+                loaded[cursor_name] = data_file.read()
+
+        cursors = [MagicMock(), MagicMock()]
+        cursors[0].execute.side_effect = partial(read_data_file, 'first')
+        cursors[1].execute.side_effect = partial(read_data_file, 'second')
+        task._load_rows_with_cursors(cursors)  # pylint: disable=protected-access
+
+        rows = self._get_source_string(3).splitlines(True)
+        self.assertEquals(loaded, {'first': rows[0] + rows[2], 'second': rows[1]})
+
+    def test_insert_rows_with_failing_cursor(self):
+        task = self.create_task(source=self._get_source_string(20), insert_chunk_size=1)
+        failing_cursor = MagicMock()
+        failing_cursor.execute.side_effect = Exception("Failed to insert rows")
+        with self.assertRaisesRegexp(Exception, "Failed to insert rows"):
+            task._insert_rows_with_cursors([MagicMock(), failing_cursor])  # pylint: disable=protected-access
+
+    def test_bulk_load_new_table(self):
+        mock_cursor = self.mock_mysql_connector.connect.return_value.cursor.return_value
+        # The table doesn't exist yet, the server allows 4MB packets, and the marker exists once it has been written.
+        mock_cursor.fetchone.side_effect = [None, (4194304,), (1,)]
+        task = self.create_task(cls=InsertIntoMysqlDummyTableWithIndexes, bulk_load=True, overwrite=True)
+        task.run()
+
+        queries = self.get_executed_queries()
+        load_queries = queries[queries.index("CREATE DATABASE IF NOT EXISTS to_database") + 1:]
+        self.assertEquals(load_queries[:10], [
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+            "CREATE TABLE IF NOT EXISTS dummy_table "
+            "(id BIGINT(20) NOT NULL AUTO_INCREMENT,course_id VARCHAR(255),"
+            "interval_start DATETIME,interval_end DATETIME,label VARCHAR(255),"
+            "count INT,created TIMESTAMP DEFAULT NOW(),PRIMARY KEY (id))",
+            "CREATE TABLE IF NOT EXISTS dummy_table "
+            "(id BIGINT(20) NOT NULL AUTO_INCREMENT,course_id VARCHAR(255),"
+            "interval_start DATETIME,interval_end DATETIME,label VARCHAR(255),"
+            "count INT,created TIMESTAMP DEFAULT NOW(),PRIMARY KEY (id),"
+            "INDEX (course_id),INDEX (interval_start,interval_end))",
+            "SELECT @@max_allowed_packet",
+            "SET SESSION unique_checks=0, foreign_key_checks=0",
+            "DELETE FROM table_updates where `target_table`='dummy_table'",
+            "DELETE FROM dummy_table",
+            self._get_expected_query(1),
+            "ALTER TABLE dummy_table ADD INDEX (course_id),ADD INDEX (interval_start,interval_end)",
+            "SET SESSION unique_checks=1, foreign_key_checks=1",
+        ])
+
+    def test_bulk_load_new_table_without_overwrite(self):
+        mock_cursor = self.mock_mysql_connector.connect.return_value.cursor.return_value
+        mock_cursor.fetchone.side_effect = [(4194304,), (1,)]
+        task = self.create_task(cls=InsertIntoMysqlDummyTableWithIndexes, bulk_load=True)
+        task.run()
+
+        queries = self.get_executed_queries()
+        self.assertNotIn(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s", queries
+        )
+        self.assertIn("SET SESSION unique_checks=0, foreign_key_checks=0", queries)
+        self.assertFalse(any(query.startswith('ALTER TABLE') for query in queries))
+
+    def test_bulk_load_with_custom_create_table(self):
+        task = self.create_task(cls=InsertToMysqlDummyTableWithCustomCreateTable, bulk_load=True, overwrite=True)
+        task.run()
+
+        queries = self.get_executed_queries()
+        self.assertNotIn(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s", queries
+        )
+        self.assertFalse(any(query.startswith('SET SESSION') for query in queries))
+
+    def test_bulk_load_existing_table(self):
+        mock_cursor = self.mock_mysql_connector.connect.return_value.cursor.return_value
+        mock_cursor.fetchone.return_value = (1,)
+        task = self.create_task(cls=InsertIntoMysqlDummyTableWithIndexes, bulk_load=True)
+        task.run()
+
+        queries = self.get_executed_queries()
+        self.assertIn("SET SESSION unique_checks=0, foreign_key_checks=0", queries)
+        self.assertFalse(any(query.startswith('ALTER TABLE') for query in queries))
+
+    def test_bulk_load_staging_table(self):
+        task = self.create_task(
+            cls=InsertIntoMysqlDummyTableWithIndexes, bulk_load=True, use_staging_table=True, overwrite=True
+        )
+        task.run()
+
+        queries = self.get_executed_queries()
+        self.assertNotIn(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s", queries
+        )
+        self.assertLess(
+            queries.index("SET SESSION unique_checks=0, foreign_key_checks=0"),
+            queries.index("DROP TABLE IF EXISTS dummy_table__staging")
+        )
+        self.assertEquals(
+            len([query for query in queries if query.startswith('ALTER TABLE dummy_table__staging ADD INDEX')]), 1
+        )
+
     @with_luigi_config(('database-export', 'database', 'foobar'))
     def test_create_database(self):
         task = self.create_task()
@@ -277,3 +591,23 @@ class MySQLLoadHelperFuncTests(unittest.TestCase):
     def test_coerce_for_mysql_connect(self):
         for input, output in self.COERCE_TEST_CASES:
             self.assertEqual(coerce_for_mysql_connect(input), output)
+
+    LOAD_DATA_TEST_CASES = [
+        (None, '\\N'),
+        ('None', '\\N'),
+        (u'None', '\\N'),
+        ('\\N', '\\N'),
+        (1, '1'),
+        (2L, '2'),
+        (True, '1'),
+        (False, '0'),
+        (0.1, '0.1'),
+        ('abc', 'abc'),
+        ('\xe5\x8c\x85\xe5\xad\x90', '\xe5\x8c\x85\xe5\xad\x90'),
+        (u'\u5305\u5b50', '\xe5\x8c\x85\xe5\xad\x90'),
+        ('a\tb\nc\\d\0e', 'a\\tb\\nc\\\\d\\0e'),
+    ]
+
+    def test_format_for_load_data(self):
+        for input, output in self.LOAD_DATA_TEST_CASES:
+            self.assertEqual(format_for_load_data(input), output)
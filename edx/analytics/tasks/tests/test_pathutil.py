@@ -1,15 +1,36 @@
 """Test selection of event log files."""
 
 import datetime
+import os
+import shutil
+import tempfile
 
-from mock import patch
+from mock import MagicMock, patch
 
-from luigi.date_interval import Month
+import luigi.task
+from luigi.date_interval import Month, Custom
 
-from edx.analytics.tasks.pathutil import EventLogSelectionTask
+from edx.analytics.tasks.pathutil import EventLogSelectionTask, PathSetTask, get_date_pattern_segments
 from edx.analytics.tasks.url import UncheckedExternalURL
 from edx.analytics.tasks.tests import unittest
 from edx.analytics.tasks.tests.config import with_luigi_config
+from edx.analytics.tasks.tests.fake_s3 import FakeS3Connection, patch_s3_connection
+
+
+class PathSetTaskTest(unittest.TestCase):
+    """Test selection of files using PathSetTask."""
+
+    def test_listed_paths_are_not_checked_again(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        for filename in ['tracking.log', 'other.txt']:
+            with open(os.path.join(temp_dir, filename), 'w') as output_file:
+                output_file.write('contents')
+
+        requirements = list(PathSetTask(src=[temp_dir], include=['*.log']).requires())
+
+        self.assertEquals([task.url for task in requirements], [os.path.join(temp_dir, 'tracking.log')])
+        self.assertIsInstance(requirements[0], UncheckedExternalURL)
 
 
 class EventLogSelectionTaskTest(unittest.TestCase):
@@ -60,9 +81,9 @@ class EventLogSelectionTaskTest(unittest.TestCase):
     COMPLETE_SOURCE_PATHS = COMPLETE_SOURCE_PATHS_1 + COMPLETE_SOURCE_PATHS_2
     SOURCE = [SOURCE_1, SOURCE_2]
 
-    @patch('edx.analytics.tasks.pathutil.boto.connect_s3')
-    def test_requires(self, connect_s3_mock):
-        s3_conn_mock = connect_s3_mock.return_value
+    def test_requires(self):
+        s3_conn_mock = MagicMock()
+        patch_s3_connection(self, s3_conn_mock)
         bucket_mock = s3_conn_mock.get_bucket.return_value
 
         class FakeKey(object):
@@ -172,6 +193,66 @@ class EventLogSelectionTaskTest(unittest.TestCase):
             'FakeServerGroup/tracking.log-20140401-1395254574.gz',
         ])
 
+    def test_first_matching_pattern_provides_date(self):
+        task = EventLogSelectionTask(
+            source=self.SOURCE,
+            interval=Month.parse('2014-03'),
+            pattern=[
+                r'.*/(?P<date>\d{8})-\d{8}\.gz',
+                r'.*-(?P<date>\d{8})\.gz',
+            ],
+            expand_interval=datetime.timedelta(0),
+        )
+        self.assertTrue(task.should_include_url(self.SOURCE_1 + 'FakeServerGroup/20140318-20130101.gz'))
+        self.assertFalse(task.should_include_url(self.SOURCE_1 + 'FakeServerGroup/20130101-20140318.gz'))
+        self.assertTrue(task.should_include_url(self.SOURCE_1 + 'FakeServerGroup/tracking-20140318.gz'))
+        self.assertEquals(len(task._compile_patterns()), 1)
+
+    def test_patterns_that_cannot_be_combined(self):
+        task = EventLogSelectionTask(
+            source=self.SOURCE,
+            interval=Month.parse('2014-03'),
+            pattern=[
+                r'.*/(?P<date>\d{8})/(\w+)\.\2\.gz',
+                r'(?i).*/TRACKING-(?P<date>\d{8})\.gz',
+                r'.*/backup/.*\.gz',
+                r'.*/(?P<date>\d{8})\.gz',
+            ],
+            expand_interval=datetime.timedelta(0),
+        )
+        self.assertTrue(task.should_include_url(self.SOURCE_1 + '20140318/foo.foo.gz'))
+        self.assertFalse(task.should_include_url(self.SOURCE_1 + '20140318/foo.bar.gz'))
+        self.assertTrue(task.should_include_url(self.SOURCE_1 + 'tracking-20140318.gz'))
+        self.assertTrue(task.should_include_url(self.SOURCE_1 + 'backup/20120101.gz'))
+        self.assertFalse(task.should_include_url(self.SOURCE_1 + 'other/20120101.gz'))
+        self.assertEquals(len(task._compile_patterns()), 3)
+
+    def test_patterns_with_same_group_names(self):
+        task = EventLogSelectionTask(
+            source=self.SOURCE,
+            interval=Month.parse('2014-03'),
+            pattern=[
+                r'.*/(?P<host>[^/]+)/tracking-(?P<date>\d{8})\.gz',
+                r'.*/(?P<host>[^/]+)/backup-(?P<date>\d{8})\.gz',
+            ],
+            expand_interval=datetime.timedelta(0),
+        )
+        self.assertTrue(task.should_include_url(self.SOURCE_1 + 'FakeServerGroup/tracking-20140318.gz'))
+        self.assertTrue(task.should_include_url(self.SOURCE_1 + 'FakeServerGroup/backup-20140318.gz'))
+        self.assertFalse(task.should_include_url(self.SOURCE_1 + 'FakeServerGroup/backup-20130318.gz'))
+        self.assertEquals(len(task._compile_patterns()), 2)
+
+    def test_too_many_groups_to_combine(self):
+        task = EventLogSelectionTask(
+            source=self.SOURCE,
+            interval=Month.parse('2014-03'),
+            pattern=[r'.*/(a)(b)(c)-{0}-(?P<date>\d{{8}})\.gz'.format(index) for index in range(60)],
+            expand_interval=datetime.timedelta(0),
+        )
+        self.assertTrue(task.should_include_url(self.SOURCE_1 + 'abc-59-20140318.gz'))
+        self.assertFalse(task.should_include_url(self.SOURCE_1 + 'abc-60-20140318.gz'))
+        self.assertEquals(len(task._compile_patterns()), 4)
+
     @with_luigi_config('event-logs', 'pattern', 'foobar')
     def test_pattern_from_config(self):
         task = EventLogSelectionTask(
@@ -186,3 +267,233 @@ class EventLogSelectionTaskTest(unittest.TestCase):
             pattern=['baz']
         )
         self.assertEquals(task.pattern, ('baz',))
+
+
+class EventLogSelectionTaskListingTest(unittest.TestCase):
+    """Test parallel and cached listing of event log files in S3."""
+
+    SOURCE = 's3://collection-bucket/logs/'
+    PATTERN = r'.*?FakeServerGroup\d?/tracking.log-(?P<date>\d{8}).*\.gz'
+
+    def setUp(self):
+        self.s3_conn = FakeS3Connection()
+        self.bucket = self.s3_conn.create_bucket('collection-bucket')
+        for path in [
+            'logs/FakeServerGroup/tracking.log-20140227.gz',
+            'logs/FakeServerGroup/tracking.log-20140318.gz',
+            'logs/FakeServerGroup/tracking.log-20140319-1395256622.gz',
+            'logs/FakeServerGroup/tracking.log-20140402-1395645654.gz',
+            'logs/FakeServerGroup2/tracking.log-20140301.gz',
+            'logs/FakeServerGroup2/tracking.log-20140302.gz',
+            'logs/FakeServerGroup2/empty/',
+            'logs/tracking.log-20140310.gz',
+            'other/FakeServerGroup/tracking.log-20140318.gz',
+        ]:
+            self.bucket.set_contents(path, '' if path.endswith('/') else 'contents')
+
+        patch_s3_connection(self, self.s3_conn)
+
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def get_selected_urls(self, patterns=None):
+        """Run the selection task and return the URLs that were selected."""
+        luigi.task.Register.clear_instance_cache()
+        task = EventLogSelectionTask(
+            source=[self.SOURCE],
+            interval=Month.parse('2014-03'),
+            pattern=patterns or [self.PATTERN],
+            expand_interval=datetime.timedelta(0),
+        )
+        return [url_task.url for url_task in task.requires()]
+
+    def test_parallel_listing(self):
+        self.assertItemsEqual(self.get_selected_urls(), [
+            self.SOURCE + 'FakeServerGroup/tracking.log-20140318.gz',
+            self.SOURCE + 'FakeServerGroup/tracking.log-20140319-1395256622.gz',
+            self.SOURCE + 'FakeServerGroup2/tracking.log-20140301.gz',
+            self.SOURCE + 'FakeServerGroup2/tracking.log-20140302.gz',
+        ])
+        self.assertItemsEqual(self.bucket.list_calls, [
+            ('logs/', '/', ''),
+            ('logs/FakeServerGroup/', '', ''),
+            ('logs/FakeServerGroup2/', '', ''),
+        ])
+
+    def test_listing_without_cache(self):
+        self.get_selected_urls()
+        self.assertEquals(os.listdir(self.cache_dir), [])
+
+    def get_selected_urls_with_cache(self, patterns=None):
+        """Run the selection task with the listing cache enabled."""
+        return with_luigi_config('event-logs', 'listing_cache', self.cache_dir)(self.get_selected_urls)(patterns)
+
+    def test_incremental_listing_with_cache(self):
+        # The patterns fix the layout of the keys in each folder, but can't be used to list just the dates in the
+        # interval, since one of them is for another source.
+        patterns = [
+            r's3://collection-bucket/logs/[^/]+/tracking\.log-(?P<date>\d{8}).*\.gz',
+            r's3://other-bucket/logs/[^/]+/tracking\.log-(?P<date>\d{8}).*\.gz',
+        ]
+        self.get_selected_urls_with_cache(patterns)
+        self.assertEquals(len(os.listdir(self.cache_dir)), 1)
+
+        self.bucket.set_contents('logs/FakeServerGroup/tracking.log-20140320.gz', 'contents')
+        self.bucket.list_calls = []
+
+        selected_urls = self.get_selected_urls_with_cache(patterns)
+
+        self.assertItemsEqual(selected_urls, [
+            self.SOURCE + 'FakeServerGroup/tracking.log-20140318.gz',
+            self.SOURCE + 'FakeServerGroup/tracking.log-20140319-1395256622.gz',
+            self.SOURCE + 'FakeServerGroup/tracking.log-20140320.gz',
+            self.SOURCE + 'FakeServerGroup2/tracking.log-20140301.gz',
+            self.SOURCE + 'FakeServerGroup2/tracking.log-20140302.gz',
+        ])
+        # Only the first prefix has a file dated before the interval that can be used as a marker.  The source's folders
+        # are listed once more while trying to derive the date prefixes from the first pattern.
+        self.assertItemsEqual(self.bucket.list_calls, [
+            ('logs/', '/', ''),
+            ('logs/', '/', ''),
+            ('logs/FakeServerGroup/', '', 'logs/FakeServerGroup/tracking.log-20140227.gz'),
+            ('logs/FakeServerGroup2/', '', ''),
+        ])
+
+    def test_cache_ignored_without_fixed_layout(self):
+        self.get_selected_urls_with_cache()
+        # This sorts before files for earlier dates that could otherwise be used as the marker.
+        self.bucket.set_contents('logs/FakeServerGroup/archive/FakeServerGroup/tracking.log-20140320.gz', 'contents')
+        self.bucket.list_calls = []
+
+        selected_urls = self.get_selected_urls_with_cache()
+
+        self.assertIn(self.SOURCE + 'FakeServerGroup/archive/FakeServerGroup/tracking.log-20140320.gz', selected_urls)
+        self.assertIn(('logs/FakeServerGroup/', '', ''), self.bucket.list_calls)
+
+
+class DatePatternSegmentsTest(unittest.TestCase):
+    """Test derivation of the path segments preceding the date group of a pattern."""
+
+    def test_anchored_pattern(self):
+        self.assertEquals(
+            get_date_pattern_segments(r's3://bucket/logs/[^/]+/tracking\.log-(?P<date>\d{8}).*\.gz'),
+            [
+                ('literal', 's3:'),
+                ('literal', ''),
+                ('literal', 'bucket'),
+                ('literal', 'logs'),
+                ('folder', None),
+                ('date', 'tracking.log-'),
+            ]
+        )
+
+    def test_folder_wildcards(self):
+        self.assertEquals(
+            get_date_pattern_segments(r'/logs/[^/]*?/(?P<date>\d{8})'),
+            None
+        )
+        self.assertEquals(
+            get_date_pattern_segments(r'/logs/[^/_]+/(?P<date>\d{8})'),
+            [('literal', ''), ('literal', 'logs'), ('folder', None), ('date', '')]
+        )
+
+    def test_unconstrained_patterns(self):
+        for pattern in [
+            r'.*tracking.log-(?P<date>\d{8}).*\.gz',
+            r's3://bucket/logs/.*/tracking\.log-(?P<date>\d{8}).*\.gz',
+            r's3://bucket/logs/[^/]+/tracking.log-(?P<date>\d{8}).*\.gz',
+            r's3://bucket/logs/[^/]+/tracking\.log-(?P<date>\d{4}-\d{2}-\d{2})',
+            r'(?i)s3://bucket/logs/tracking\.log-(?P<date>\d{8})',
+            r's3://bucket/logs/tracking\.log-\d{8}',
+        ]:
+            self.assertIsNone(get_date_pattern_segments(pattern), pattern)
+
+
+class EventLogSelectionTaskDatePrefixTest(unittest.TestCase):
+    """Test listing of only the prefixes that can contain files for the dates in the interval."""
+
+    INTERVAL = Custom.parse('2014-03-18-2014-03-20')
+
+    def setUp(self):
+        self.key_paths = [
+            'FakeServerGroup/tracking.log-20140227.gz',
+            'FakeServerGroup/tracking.log-20140318.gz',
+            'FakeServerGroup/tracking.log-20140319-1395256622.gz',
+            'FakeServerGroup/tracking.log-20140402-1395645654.gz',
+            'FakeServerGroup2/tracking.log-20140319.gz',
+            'FakeServerGroup2/tracking.log.gz',
+            'tracking.log-20140319.gz',
+        ]
+
+    def create_task(self, source, pattern):
+        """Create a selection task for the interval."""
+        luigi.task.Register.clear_instance_cache()
+        return EventLogSelectionTask(
+            source=[source],
+            interval=self.INTERVAL,
+            pattern=[pattern],
+            expand_interval=datetime.timedelta(0),
+        )
+
+    def get_expected_urls(self, source):
+        """Return the URLs of the files that are dated in the interval."""
+        return [
+            source + 'FakeServerGroup/tracking.log-20140318.gz',
+            source + 'FakeServerGroup/tracking.log-20140319-1395256622.gz',
+            source + 'FakeServerGroup2/tracking.log-20140319.gz',
+        ]
+
+    def test_s3_date_prefixes(self):
+        s3_conn = FakeS3Connection()
+        patch_s3_connection(self, s3_conn)
+        bucket = s3_conn.create_bucket('collection-bucket')
+        for path in self.key_paths:
+            bucket.set_contents('logs/' + path, 'contents')
+
+        source = 's3://collection-bucket/logs/'
+        task = self.create_task(source, r's3://collection-bucket/logs/[^/]+/tracking\.log-(?P<date>\d{8}).*\.gz')
+
+        self.assertItemsEqual([url_task.url for url_task in task.requires()], self.get_expected_urls(source))
+        expected_list_calls = [('logs/', '/', '')]
+        for folder in ['FakeServerGroup', 'FakeServerGroup2']:
+            for date_string in ['20140318', '20140319']:
+                expected_list_calls.append(('logs/{0}/tracking.log-{1}'.format(folder, date_string), '', ''))
+        self.assertItemsEqual(bucket.list_calls, expected_list_calls)
+
+    def test_local_date_prefixes(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        for path in self.key_paths:
+            full_path = os.path.join(temp_dir, path)
+            if not os.path.exists(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            with open(full_path, 'w') as output_file:
+                output_file.write('contents')
+
+        source = temp_dir + '/'
+        task = self.create_task(source, temp_dir + r'/[^/]+/tracking\.log-(?P<date>\d{8}).*\.gz')
+
+        with patch.object(task, '_get_all_local_urls', wraps=task._get_all_local_urls) as list_all_mock:
+            with patch('edx.analytics.tasks.pathutil.os.listdir', wraps=os.listdir) as listdir_mock:
+                self.assertItemsEqual([url_task.url for url_task in task.requires()], self.get_expected_urls(source))
+            self.assertFalse(list_all_mock.called)
+
+        # Each folder is listed once, rather than once for each date.
+        listed_paths = [args[0] for args, _kwargs in listdir_mock.call_args_list]
+        self.assertItemsEqual(listed_paths, set(listed_paths))
+
+    def test_fallback_to_full_listing(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        os.makedirs(os.path.join(temp_dir, 'FakeServerGroup'))
+        with open(os.path.join(temp_dir, 'FakeServerGroup', 'tracking.log-20140318.gz'), 'w') as output_file:
+            output_file.write('contents')
+
+        task = self.create_task(temp_dir, r'.*tracking.log-(?P<date>\d{8}).*\.gz')
+
+        with patch.object(task, '_get_all_local_urls', wraps=task._get_all_local_urls) as list_all_mock:
+            self.assertEquals(
+                [url_task.url for url_task in task.requires()],
+                [os.path.join(temp_dir, 'FakeServerGroup', 'tracking.log-20140318.gz')]
+            )
+            list_all_mock.assert_called_once_with(temp_dir)
@@ -1,8 +1,17 @@
 """Tests for S3--related utility functionality."""
-from mock import MagicMock
+import gzip
+import os
+import StringIO
+import tempfile
+import threading
+
+from boto.exception import S3ResponseError
+from mock import MagicMock, patch
 
 from edx.analytics.tasks import s3_util
 from edx.analytics.tasks.tests import unittest
+from edx.analytics.tasks.tests.config import with_luigi_config
+from edx.analytics.tasks.tests.fake_s3 import FakeS3Connection, FakeS3Key, patch_s3_connection
 
 
 class GenerateS3SourcesTestCase(unittest.TestCase):
@@ -132,3 +141,355 @@ class ScalableS3ClientTestCase(unittest.TestCase):
         output = list(generator)
         expected_output = [(1, 0, 250), (2, 250, 250), (3, 500, 250), (4, 750, 150)]
         self.assertEquals(output, expected_output)
+
+
+class S3ConnectionPoolTestCase(unittest.TestCase):
+    """Tests for sharing S3 connections between targets and threads."""
+
+    def setUp(self):
+        self.connect_s3 = MagicMock(side_effect=lambda *_args: FakeS3Connection())
+        patcher = patch('edx.analytics.tasks.s3_util.boto.connect_s3', self.connect_s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = s3_util.S3ConnectionPool()
+
+    def test_reuse_released_connection(self):
+        connection = self.pool.acquire()
+        self.pool.release(connection)
+        self.assertIs(self.pool.acquire(), connection)
+        self.assertEquals(self.pool.connections_created, 1)
+        self.assertEquals(self.pool.connections_reused, 1)
+
+    def test_acquired_connections_are_not_shared(self):
+        self.assertIsNot(self.pool.acquire(), self.pool.acquire())
+        self.assertEquals(self.pool.connections_created, 2)
+
+    def test_separate_credentials(self):
+        connection = self.pool.acquire(('key1', 'secret1'))
+        self.pool.release(connection, ('key1', 'secret1'))
+        self.assertIsNot(self.pool.acquire(('key2', 'secret2')), connection)
+        self.connect_s3.assert_called_with('key2', 'secret2')
+        self.assertIs(self.pool.acquire(('key1', 'secret1')), connection)
+
+    def test_thread_connection(self):
+        connection = self.pool.get_thread_connection()
+        self.assertIs(self.pool.get_thread_connection(), connection)
+
+        other_connections = []
+        thread = threading.Thread(target=lambda: other_connections.append(self.pool.get_thread_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_connections[0], connection)
+        self.assertEquals(self.pool.connections_created, 2)
+
+    def test_forked_process(self):
+        connection = self.pool.get_thread_connection()
+        self.pool.release(self.pool.acquire())
+
+        with patch('edx.analytics.tasks.s3_util.os.getpid', return_value=self.pool.pid + 1):
+            self.assertIsNot(self.pool.get_thread_connection(), connection)
+            self.assertEquals(self.pool.connections_reused, 0)
+
+        self.assertEquals(self.pool.connections_created, 3)
+
+    def test_thread_buckets_release(self):
+        with patch('edx.analytics.tasks.s3_util.CONNECTION_POOL', self.pool):
+            thread_buckets = s3_util.ThreadBuckets('bucket', validate=False)
+            bucket = thread_buckets.get()
+            self.assertIs(thread_buckets.get(), bucket)
+            thread_buckets.release()
+            s3_util.ThreadBuckets('bucket', validate=False).get()
+
+        self.assertEquals(self.pool.connections_created, 1)
+        self.assertEquals(self.pool.connections_reused, 1)
+
+    def test_clients_share_connection(self):
+        with patch('edx.analytics.tasks.s3_util.CONNECTION_POOL', self.pool):
+            clients = [s3_util.ScalableS3Client() for _ in xrange(10)]
+            self.assertEquals(self.connect_s3.call_count, 0)
+            connections = set(client.s3 for client in clients)
+
+        self.assertEquals(len(connections), 1)
+        self.assertEquals(self.connect_s3.call_count, 1)
+
+
+class ScalableS3ClientMultipartTestCase(unittest.TestCase):
+    """Tests for uploading parts of large files concurrently."""
+
+    CONTENTS = ''.join(chr(i % 256) for i in xrange(1000))
+
+    def setUp(self):
+        self.connection = FakeS3Connection()
+        self.bucket = self.connection.create_bucket('bucket')
+        patch_s3_connection(self, self.connection)
+        # Use 10 parts of 100 bytes for 1000 bytes of data.
+        patcher = patch('edx.analytics.tasks.s3_util.MINIMUM_BYTES_PER_CHUNK', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        sleep_patcher = patch('edx.analytics.tasks.s3_util.time.sleep')
+        self.mock_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+        file_descriptor, self.local_path = tempfile.mkstemp()
+        self.addCleanup(os.remove, self.local_path)
+        with os.fdopen(file_descriptor, 'wb') as local_file:
+            local_file.write(self.CONTENTS)
+
+        self.client = s3_util.ScalableS3Client()
+
+    def get_retry_delays(self):
+        """Return the delays slept before retrying, ignoring the polling done by the thread pool's own threads."""
+        return [args[0] for _name, args, _kwargs in self.mock_sleep.mock_calls if args[0] >= 1]
+
+    def upload(self):
+        """Upload the local file to s3://bucket/path/to/key in parts."""
+        self.client._upload_multipart(  # pylint: disable=protected-access
+            self.local_path, 's3://bucket/path/to/key', self.bucket, 'path/to/key', len(self.CONTENTS)
+        )
+
+    @with_luigi_config('s3', 'multipart_upload_threads', '3')
+    def test_upload(self):
+        self.upload()
+
+        self.assertEquals(self.bucket.get_key('path/to/key').contents, self.CONTENTS)
+        self.assertEquals(self.bucket.multipart_uploads, {})
+        self.assertEquals(self.get_retry_delays(), [])
+
+    @with_luigi_config('s3', 'multipart_upload_threads', '1')
+    def test_retry_with_backoff(self):
+        self.bucket.part_upload_failures = 2
+
+        self.upload()
+
+        self.assertEquals(self.bucket.get_key('path/to/key').contents, self.CONTENTS)
+        self.assertEquals(self.get_retry_delays(), [1, 2])
+
+    @with_luigi_config('s3', 'multipart_upload_threads', '1')
+    def test_persistent_failure(self):
+        self.bucket.part_upload_failures = s3_util.MAX_PART_UPLOAD_ATTEMPTS
+
+        with self.assertRaises(S3ResponseError):
+            self.upload()
+
+        self.assertEquals(self.get_retry_delays(), [1, 2, 4])
+        self.assertIsNone(self.bucket.get_key('path/to/key'))
+        self.assertEquals(self.bucket.multipart_uploads, {})
+
+    @patch('edx.analytics.tasks.s3_util.compute_md5')
+    def test_digest_mismatch(self, compute_md5_mock):
+        compute_md5_mock.return_value = ('0' * 32, 'AAAAAAAAAAAAAAAAAAAAAA==', 100)
+
+        with self.assertRaises(S3ResponseError):
+            self.upload()
+
+        self.assertIsNone(self.bucket.get_key('path/to/key'))
+        self.assertEquals(self.bucket.multipart_uploads, {})
+
+
+class S3StreamingWriterTestCase(unittest.TestCase):
+    """Tests for writing to S3 without a local temporary file."""
+
+    def setUp(self):
+        self.connection = FakeS3Connection()
+        self.bucket = self.connection.create_bucket('bucket')
+        self.connection_pool = patch_s3_connection(self, self.connection)
+
+        self.client = s3_util.ScalableS3Client()
+
+    def create_writer(self, part_size=100):
+        """Return a writer for s3://bucket/path/to/key that uploads parts of the given size."""
+        with patch('edx.analytics.tasks.s3_util.MINIMUM_BYTES_PER_CHUNK', 10):
+            return s3_util.S3StreamingWriter('s3://bucket/path/to/key', self.client, part_size=part_size)
+
+    def test_small_file(self):
+        with self.create_writer() as writer:
+            writer.write('foo')
+            writer.write('bar')
+
+        self.assertEquals(self.bucket.get_key('path/to/key').contents, 'foobar')
+        self.assertIsNone(writer.multipart)
+
+    @with_luigi_config('s3', 'multipart_upload_threads', '2')
+    def test_large_file(self):
+        lines = ['line {0}\n'.format(i) for i in xrange(100)]
+        with self.create_writer() as writer:
+            for line in lines:
+                writer.write(line)
+
+        self.assertEquals(self.bucket.get_key('path/to/key').contents, ''.join(lines))
+        self.assertEquals(len(writer.pending_parts), 8)
+        self.assertEquals(self.bucket.multipart_uploads, {})
+
+    def test_exception_while_writing(self):
+        with self.assertRaises(RuntimeError):
+            with self.create_writer() as writer:
+                writer.write('x' * 250)
+                raise RuntimeError()
+
+        self.assertIsNone(self.bucket.get_key('path/to/key'))
+        self.assertTrue(writer.multipart.cancelled)
+        self.assertEquals(self.bucket.multipart_uploads, {})
+
+    def test_upload_cancelled_if_never_closed(self):
+        writer = self.create_writer()
+        writer.write('x' * 250)
+
+        # The pool's threads may briefly hold references to the writer, so it is finalized explicitly rather than by
+        # waiting for it to be garbage collected.
+        writer.__del__()
+
+        self.assertIsNone(self.bucket.get_key('path/to/key'))
+        self.assertTrue(writer.multipart.cancelled)
+        self.assertEquals(self.bucket.multipart_uploads, {})
+
+    def test_abort_after_close(self):
+        writer = self.create_writer()
+        writer.write('x' * 250)
+        writer.close()
+
+        writer.abort()
+
+        self.assertEquals(self.bucket.get_key('path/to/key').contents, 'x' * 250)
+        self.assertFalse(writer.multipart.cancelled)
+
+    @with_luigi_config('s3', 'multipart_upload_threads', '2')
+    def test_close_on_another_thread(self):
+        acquiring_threads = []
+        acquire = self.connection_pool.acquire
+
+        def record_acquiring_thread(*args):
+            """Remember which thread checked out a connection."""
+            acquiring_threads.append(threading.current_thread())
+            return acquire(*args)
+
+        with patch.object(self.connection_pool, 'acquire', side_effect=record_acquiring_thread):
+            writer = self.create_writer()
+            writer.write('x' * 250)
+            thread = threading.Thread(target=writer.close)
+            thread.start()
+            thread.join()
+
+        self.assertEquals(self.bucket.get_key('path/to/key').contents, 'x' * 250)
+        self.assertEquals(self.bucket.multipart_uploads, {})
+        # The upload is completed with a connection of the closing thread, not one reserved by the writing thread.
+        self.assertIn(thread, acquiring_threads)
+        self.assertEquals(self.connection_pool.thread_state.__dict__, {})
+
+    def test_write_after_close(self):
+        writer = self.create_writer()
+        writer.close()
+        with self.assertRaises(ValueError):
+            writer.write('foo')
+
+    def test_gzip_output(self):
+        contents = ''.join('line {0}\n'.format(i) for i in xrange(1000))
+        with self.create_writer() as writer:
+            with gzip.GzipFile(mode='wb', fileobj=writer) as gzip_file:
+                gzip_file.write(contents)
+
+        compressed = self.bucket.get_key('path/to/key').contents
+        self.assertEquals(gzip.GzipFile(fileobj=StringIO.StringIO(compressed)).read(), contents)
+
+    def test_target_writes_are_streamed(self):
+        target = s3_util.S3HdfsTarget('s3://bucket/path/to/key')
+        with target.open('w') as output_file:
+            self.assertIsInstance(output_file, s3_util.S3StreamingWriter)
+            output_file.write('foo')
+
+        self.assertEquals(self.bucket.get_key('path/to/key').contents, 'foo')
+
+
+class S3RangedReaderTestCase(unittest.TestCase):
+    """Tests for reading S3 objects in concurrently fetched ranges."""
+
+    CONTENTS = ''.join('line {0}\n'.format(i) for i in xrange(100))
+
+    def setUp(self):
+        self.connection = FakeS3Connection()
+        self.bucket = self.connection.create_bucket('bucket')
+        self.bucket.set_contents('path/to/key', self.CONTENTS)
+        patch_s3_connection(self, self.connection)
+
+        sleep_patcher = patch('edx.analytics.tasks.s3_util.time.sleep')
+        self.mock_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def create_reader(self, range_size=7):
+        """Return a reader for the test object that fetches small ranges."""
+        return s3_util.S3RangedReader(
+            'path/to/key', len(self.CONTENTS), s3_util.ThreadBuckets('bucket'), range_size=range_size, num_threads=3
+        )
+
+    def test_read_all(self):
+        with self.create_reader() as reader:
+            self.assertEquals(reader.read(), self.CONTENTS)
+            self.assertEquals(reader.read(), '')
+
+    def test_read_blocks(self):
+        with self.create_reader() as reader:
+            blocks = []
+            while True:
+                block = reader.read(10)
+                if not block:
+                    break
+                self.assertLessEqual(len(block), 10)
+                blocks.append(block)
+
+        self.assertEquals(''.join(blocks), self.CONTENTS)
+
+    def test_iterate_lines(self):
+        with self.create_reader() as reader:
+            self.assertEquals(list(reader), self.CONTENTS.splitlines(True))
+
+    def test_range_larger_than_object(self):
+        with self.create_reader(range_size=10000) as reader:
+            self.assertEquals(reader.read(), self.CONTENTS)
+
+    def test_truncated_range(self):
+        reader = self.create_reader()
+        self.bucket.set_contents('path/to/key', self.CONTENTS[:20])
+
+        with self.assertRaises(IOError):
+            reader.read()
+
+    def test_retry_range(self):
+        get_contents_as_string = FakeS3Key.get_contents_as_string
+        failures = [S3ResponseError(500, 'Internal Error')] * 2
+
+        def fail_twice(key, headers=None):
+            """Fail the first two requests for the first range."""
+            if headers['Range'].startswith('bytes=0-') and failures:
+                raise failures.pop()
+            return get_contents_as_string(key, headers=headers)
+
+        with patch.object(FakeS3Key, 'get_contents_as_string', autospec=True, side_effect=fail_twice):
+            with self.create_reader() as reader:
+                self.assertEquals(reader.read(), self.CONTENTS)
+
+        self.assertEquals(
+            sorted(args[0] for _name, args, _kwargs in self.mock_sleep.mock_calls if args[0] >= 1), [1, 2]
+        )
+
+    @with_luigi_config('s3', 'ranged_read_threshold', '100')
+    def test_target_reads_are_ranged(self):
+        target = s3_util.S3HdfsTarget('s3://bucket/path/to/key')
+        with target.open('r') as input_file:
+            self.assertIsInstance(input_file, s3_util.S3RangedReader)
+            self.assertEquals(input_file.read(), self.CONTENTS)
+
+    @with_luigi_config('s3', 'ranged_read_threshold', '100000')
+    @patch('edx.analytics.tasks.s3_util.HdfsTarget.open')
+    def test_small_target_reads_are_not_ranged(self, hdfs_open_mock):
+        self.assertIs(s3_util.S3HdfsTarget('s3://bucket/path/to/key').open('r'), hdfs_open_mock.return_value)
+
+    @patch('edx.analytics.tasks.s3_util.HdfsTarget.open')
+    def test_ranged_reads_disabled_by_default(self, hdfs_open_mock):
+        with patch.object(s3_util.ScalableS3Client, 'open_ranged_reader') as open_ranged_reader_mock:
+            self.assertIs(s3_util.S3HdfsTarget('s3://bucket/path/to/key').open('r'), hdfs_open_mock.return_value)
+        self.assertFalse(open_ranged_reader_mock.called)
+
+    @with_luigi_config('s3', 'ranged_read_threshold', '100')
+    def test_missing_object(self):
+        with self.assertRaises(IOError):
+            s3_util.S3HdfsTarget('s3://bucket/missing').open('r')
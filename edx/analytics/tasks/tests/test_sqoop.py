@@ -1,11 +1,12 @@
 """Tests for Sqoop import task."""
 
+import datetime
 import textwrap
 import json
 
 from mock import MagicMock, patch, sentinel, Mock
 
-from edx.analytics.tasks.sqoop import SqoopImportFromMysql
+from edx.analytics.tasks.sqoop import SqoopImportFromMysql, read_checkpoint
 from edx.analytics.tasks.tests import unittest
 from edx.analytics.tasks.tests.target import FakeTarget
 
@@ -25,9 +26,17 @@ class SqoopImportFromMysqlTestCase(unittest.TestCase):
         self.mock_run = patcher2.start()
         self.addCleanup(patcher2.stop)
 
+        # Incremental imports look up the largest value of the check column.
+        patcher3 = patch('edx.analytics.tasks.sqoop.mysql.connector')
+        self.mock_mysql_connector = patcher3.start()
+        self.addCleanup(patcher3.stop)
+        self.mock_cursor = self.mock_mysql_connector.connect.return_value.cursor.return_value
+        self.mock_cursor.fetchone.return_value = (120L,)
+
     def create_task(self, num_mappers=None, where=None, verbose=False,
                     columns=None, null_string=None, fields_terminated_by=None, delimiter_replacement=None,
-                    overwrite=False, direct=True, mysql_delimiters=True):
+                    overwrite=False, direct=True, mysql_delimiters=True, incremental=None, check_column=None,
+                    last_value=None):
         """Create a SqoopImportFromMysql with specified options."""
         task = SqoopImportFromMysql(
             credentials=sentinel.ignored,
@@ -44,6 +53,9 @@ class SqoopImportFromMysqlTestCase(unittest.TestCase):
             overwrite=overwrite,
             direct=direct,
             mysql_delimiters=mysql_delimiters,
+            incremental=incremental,
+            check_column=check_column,
+            last_value=last_value,
         )
         return task
 
@@ -204,3 +216,77 @@ class SqoopImportFromMysqlTestCase(unittest.TestCase):
         self.assertTrue(task.output().remove.called)
         self.assertTrue(task.attempted_removal)
         self.assertTrue(task.complete())
+
+    def run_incremental_task(self, **kwargs):
+        """Run an incremental import, and return the Sqoop arguments and the metadata."""
+        task_kwargs = {'incremental': 'append', 'check_column': 'id', 'last_value': '100'}
+        task_kwargs.update(kwargs)
+        task = self.create_task(**task_kwargs)
+        self.run_task(task)
+        metadata = json.loads(task.metadata_output().buffer.read())
+        return self.get_call_args_after_run(), metadata
+
+    def test_incremental_append(self):
+        arglist, metadata = self.run_incremental_task()
+        self.assertTrue(self.mock_mysql_connector.connect.return_value.close.called)
+        self.mock_cursor.execute.assert_called_once_with("SELECT MAX(id) FROM example_table")
+        self.assertEquals(arglist[-10:], [
+            '--incremental', 'append', '--check-column', 'id', '--last-value', '100', '--where', "id<='120'",
+            '--direct', '--mysql-delimiters'
+        ])
+        self.assertEquals(metadata['last_value'], '120')
+        self.assertEquals(metadata['check_column'], 'id')
+        self.assertTrue(metadata['succeeded'])
+
+    def test_incremental_with_where(self):
+        arglist, _metadata = self.run_incremental_task(where='id<50')
+        self.mock_cursor.execute.assert_called_once_with("SELECT MAX(id) FROM example_table WHERE id<50")
+        self.assertEquals(arglist[-4:-2], ['--where', "(id<50)AND(id<='120')"])
+
+    def test_incremental_without_last_value(self):
+        arglist, _metadata = self.run_incremental_task(last_value=None)
+        self.assertNotIn('--last-value', arglist)
+
+    def test_incremental_empty_table(self):
+        self.mock_cursor.fetchone.return_value = (None,)
+        arglist, metadata = self.run_incremental_task()
+        # The where clause doesn't match any rows, since there are none after the last value.
+        self.assertIn("id<='100'", arglist)
+        self.assertEquals(metadata['last_value'], '100')
+
+    def test_incremental_lastmodified(self):
+        self.mock_cursor.fetchone.return_value = (datetime.datetime(2014, 1, 2, 3, 4, 5),)
+        arglist, metadata = self.run_incremental_task(
+            incremental='lastmodified', check_column='modified', last_value='2014-01-01 00:00:00'
+        )
+        self.mock_cursor.execute.assert_called_once_with("SELECT NOW()")
+        # The next import includes rows modified at exactly this time, so this one doesn't.
+        self.assertIn("modified<'2014-01-02 03:04:05'", arglist)
+        self.assertEquals(metadata['last_value'], '2014-01-02 03:04:05')
+
+    def test_incremental_failure(self):
+        self.mock_run.side_effect = Exception('Sqoop failed')
+        task = self.create_task(incremental='append', check_column='id', last_value='100')
+        with self.assertRaises(Exception):
+            self.run_task(task)
+        metadata = json.loads(task.metadata_output().buffer.read())
+        self.assertNotIn('last_value', metadata)
+
+    def test_unknown_incremental_mode(self):
+        with self.assertRaises(ValueError):
+            self.run_incremental_task(incremental='merge')
+        self.assertFalse(self.mock_run.called)
+
+    def test_full_import_marked_as_succeeded(self):
+        task = self.create_task()
+        self.run_task(task)
+        metadata = json.loads(task.metadata_output().buffer.read())
+        self.assertTrue(metadata['succeeded'])
+        self.assertIsNone(metadata['incremental'])
+
+    def test_read_checkpoint(self):
+        checkpoint = '{"succeeded": true, "incremental": "append", "check_column": "id", "last_value": "120"}'
+        self.assertEquals(read_checkpoint(FakeTarget(checkpoint), 'id'), (True, '120'))
+        self.assertEquals(read_checkpoint(FakeTarget(checkpoint), 'modified'), (True, None))
+        self.assertEquals(read_checkpoint(FakeTarget('{"succeeded": true, "incremental": null}'), 'id'), (True, None))
+        self.assertEquals(read_checkpoint(FakeTarget('{"start_time": "2014-01-01T00:00:00"}'), 'id'), (False, None))
@@ -1,4 +1,10 @@
 """Tests for URL-related functionality."""
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
 import luigi
 import luigi.format
 import luigi.hdfs
@@ -6,6 +12,7 @@ import luigi.s3
 
 from edx.analytics.tasks import url
 from edx.analytics.tasks.tests import unittest
+from edx.analytics.tasks.tests.fake_s3 import FakeS3Connection, patch_s3_connection
 
 
 class TargetFromUrlTestCase(unittest.TestCase):
@@ -69,3 +76,49 @@ class UrlPathJoinTestCase(unittest.TestCase):
     def test_multiple_elements(self):
         self.assertEquals(url.url_path_join('s3://foo', 'bar', 'baz'), 's3://foo/bar/baz')
         self.assertEquals(url.url_path_join('s3://foo', 'bar/bing', 'baz'), 's3://foo/bar/bing/baz')
+
+
+class ExistingUrlsTestCase(unittest.TestCase):
+    """Tests for get_existing_urls()."""
+
+    def setUp(self):
+        self.s3_conn = FakeS3Connection()
+        self.bucket = self.s3_conn.create_bucket('foo')
+        patch_s3_connection(self, self.s3_conn)
+
+    def test_s3_keys_checked_individually(self):
+        self.bucket.set_contents('bar/baz', 'contents')
+        existing = url.get_existing_urls(['s3://foo/bar/baz', 's3n://foo/bar/missing'])
+        self.assertEquals(existing, set(['s3://foo/bar/baz']))
+        self.assertEquals(self.bucket.list_calls, [])
+
+    def test_s3_folder_listed(self):
+        for index in range(20):
+            self.bucket.set_contents('bar/file{0}'.format(index), 'contents')
+        self.bucket.set_contents('bar/subdir/file', 'contents')
+        urls = ['s3://foo/bar/file{0}'.format(index) for index in range(30)] + ['s3://foo/bar/subdir/']
+
+        existing = url.get_existing_urls(urls)
+
+        self.assertEquals(existing, set(urls[:20] + ['s3://foo/bar/subdir/']))
+        self.assertEquals(self.bucket.list_calls, [('bar/', '/', '')])
+
+    def test_local_paths(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'file')
+        with open(path, 'w') as output_file:
+            output_file.write('contents')
+
+        existing = url.get_existing_urls([path, 'file://' + path, os.path.join(temp_dir, 'missing')])
+
+        self.assertEquals(existing, set([path, 'file://' + path]))
+
+    @patch('edx.analytics.tasks.url.luigi.hdfs.listdir')
+    def test_hdfs_directories_listed(self, listdir_mock):
+        listdir_mock.return_value = ['hdfs://namenode/data/file1', 'hdfs://namenode/data/file2']
+
+        existing = url.get_existing_urls(['hdfs:///data/file1', 'hdfs:///data/file3'])
+
+        self.assertEquals(existing, set(['hdfs:///data/file1']))
+        listdir_mock.assert_called_once_with('/data')
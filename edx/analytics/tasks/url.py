@@ -10,7 +10,9 @@ Examples::
 """
 from __future__ import absolute_import
 
+import logging
 import os
+from multiprocessing.pool import ThreadPool
 import urlparse
 
 import luigi
@@ -19,7 +21,12 @@ import luigi.format
 import luigi.hdfs
 import luigi.s3
 
-from edx.analytics.tasks.s3_util import ScalableS3Client, S3HdfsTarget
+from edx.analytics.tasks.s3_util import (
+    ScalableS3Client, S3HdfsTarget, get_s3_bucket_key_names, get_existing_s3_keys, DEFAULT_LISTING_THREADS
+)
+
+
+log = logging.getLogger(__name__)
 
 
 class ExternalURL(luigi.ExternalTask):
@@ -77,6 +84,59 @@ def get_target_from_url(url):
     return target_class(url, **kwargs)
 
 
+def get_existing_urls(urls, num_threads=DEFAULT_LISTING_THREADS):
+    """
+    Determine which of the given URLs refer to existing files or directories.
+
+    S3 URLs are checked using concurrent listings of their parent "folders" and HEAD requests, HDFS URLs by listing their
+    parent directories concurrently, and local paths directly.
+
+    Returns:
+        A set containing the URLs that exist.
+    """
+    key_names_for_bucket = {}
+    hdfs_urls_for_directory = {}
+    existing_urls = set()
+    for url in urls:
+        parsed_url = urlparse.urlparse(url)
+        target_class = URL_SCHEME_TO_TARGET_CLASS.get(parsed_url.scheme, DEFAULT_TARGET_CLASS)
+        if issubclass(target_class, (S3HdfsTarget, luigi.s3.S3Target)):
+            bucket_name, key_name = get_s3_bucket_key_names(url)
+            key_names_for_bucket.setdefault(bucket_name, {})[key_name] = url
+        elif issubclass(target_class, luigi.hdfs.HdfsTarget):
+            directory = os.path.dirname(parsed_url.path.rstrip('/'))
+            hdfs_urls_for_directory.setdefault(directory, {})[parsed_url.path.rstrip('/')] = url
+        elif os.path.exists(parsed_url.path):
+            existing_urls.add(url)
+
+    for bucket_name, url_for_key_name in key_names_for_bucket.iteritems():
+        for key_name in get_existing_s3_keys(bucket_name, url_for_key_name.keys(), num_threads=num_threads):
+            existing_urls.add(url_for_key_name[key_name])
+
+    if hdfs_urls_for_directory:
+        directories = hdfs_urls_for_directory.keys()
+        pool = ThreadPool(min(num_threads, len(directories)))
+        try:
+            listings = pool.map(_list_hdfs_directory, directories)
+        finally:
+            pool.close()
+            pool.join()
+        for directory, listed_paths in zip(directories, listings):
+            url_for_path = hdfs_urls_for_directory[directory]
+            existing_urls.update(url_for_path[path] for path in listed_paths if path in url_for_path)
+
+    return existing_urls
+
+
+def _list_hdfs_directory(directory):
+    """Return the paths of the entries in an HDFS directory, or an empty list if it can't be listed."""
+    try:
+        return [urlparse.urlparse(path).path.rstrip('/') for path in luigi.hdfs.listdir(directory)]
+    except luigi.hdfs.HDFSCliError:
+        log.debug('Unable to list HDFS directory %s', directory)
+        return []
+
+
 def url_path_join(url, *extra_path):
     """
     Extend the path component of the given URL.  Relative paths extend the
@@ -18,6 +18,9 @@ log = logging.getLogger(__name__)
 UNKNOWN_COUNTRY = "UNKNOWN"
 UNKNOWN_CODE = "UNKNOWN"
 
+# Copy the geolocation data in large blocks, so that reads from S3 can keep several range requests in flight.
+GEOLOCATION_DATA_COPY_BUFFER_SIZE = 1024 * 1024
+
 
 class GeolocationMixin(object):
     """
@@ -74,7 +77,7 @@ class BaseGeolocation(object):
         self.temporary_data_file = tempfile.NamedTemporaryFile(prefix='geolocation_data')
         with self.geolocation_data_target().open() as geolocation_data_input:
             while True:
-                transfer_buffer = geolocation_data_input.read(1024)
+                transfer_buffer = geolocation_data_input.read(GEOLOCATION_DATA_COPY_BUFFER_SIZE)
                 if transfer_buffer:
                     self.temporary_data_file.write(transfer_buffer)
                 else:
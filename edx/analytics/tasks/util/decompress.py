@@ -0,0 +1,343 @@
+"""
+Read input files as a stream of lines, decompressing them if necessary.
+
+Unlike `gzip.GzipFile`, nothing here calls `tell()` or `seek()` on the underlying file, so these utilities can read
+directly from the file-like objects returned when opening S3 and HDFS targets.
+
+Gzip data can either be decompressed in process using zlib or by piping it through an external command like `pigz` or
+`zcat`, which is typically much faster and runs in parallel with the python code that consumes the output. Run this
+module as a script to compare the throughput of the available backends on some files::
+
+    python -m edx.analytics.tasks.util.decompress /path/to/tracking.log-20140101.gz
+"""
+
+import argparse
+from distutils.spawn import find_executable
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import luigi
+
+
+log = logging.getLogger(__name__)
+
+
+# Read from the underlying file in large blocks, since each read from S3 or HDFS has a relatively high fixed cost.
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Tells zlib to expect a gzip header and trailer instead of a raw zlib stream.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Names of the gzip decompression backends. "auto" uses the first of the external commands that is installed and falls
+# back to in-process decompression if none of them are.
+PYTHON_BACKEND = 'python'
+AUTO_BACKEND = 'auto'
+GZIP_COMMANDS = {
+    'pigz': ['pigz', '-dc'],
+    'zcat': ['zcat'],
+}
+AUTO_BACKEND_ORDER = ['pigz', 'zcat']
+
+
+def is_gzip_path(path):
+    """Return True if the file at the given path is expected to be gzip compressed."""
+    return path.endswith('.gz')
+
+
+def get_gzip_command(backend):
+    """
+    Return the command line to use to decompress gzip data with the named backend, or None to decompress in process.
+
+    The in-process backend is used when the requested command is not installed.
+    """
+    if backend == AUTO_BACKEND:
+        candidates = AUTO_BACKEND_ORDER
+    elif backend in GZIP_COMMANDS:
+        candidates = [backend]
+    elif backend == PYTHON_BACKEND:
+        candidates = []
+    else:
+        raise ValueError('Unknown gzip decompression backend {0}'.format(backend))
+
+    for name in candidates:
+        if find_executable(GZIP_COMMANDS[name][0]):
+            return GZIP_COMMANDS[name]
+
+    if backend != PYTHON_BACKEND:
+        log.warning('Unable to find a gzip decompression command for backend %s, decompressing in process', backend)
+    return None
+
+
+def iter_target_chunks(input_target, buffer_size=READ_BUFFER_SIZE, gzip_command=None):
+    """
+    Open the target and yield its contents in blocks, decompressing them if the path ends in ".gz".
+
+    If a `gzip_command` is given, compressed data is piped through that command instead of being decompressed in
+    process.
+    """
+    with input_target.open('r') as input_file:
+        if is_gzip_path(input_target.path):
+            if gzip_command:
+                chunks = iter_command_output_chunks(gzip_command, input_file, buffer_size)
+            else:
+                chunks = iter_gzip_chunks(input_file, buffer_size)
+        else:
+            chunks = iter_chunks(input_file, buffer_size)
+
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            chunks.close()
+
+
+def iter_local_split_chunks(path, start, end, buffer_size=READ_BUFFER_SIZE):
+    """
+    Yield the contents of the lines of an uncompressed local file that start within the byte range [start, end).
+
+    This follows the same rules as hadoop's line record reader, so splitting a file into adjacent byte ranges and
+    reading each of them produces every line of the file exactly once, no matter where the boundaries fall.
+    """
+    with open(path, 'rb') as input_file:
+        if start > 0:
+            # The line that contains the byte just before the start of the range belongs to the previous split.
+            input_file.seek(start - 1)
+            input_file.readline()
+
+        remaining = end - input_file.tell()
+        chunk = ''
+        while remaining > 0:
+            chunk = input_file.read(min(buffer_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+        # Finish the last line that starts within the range.
+        if chunk and not chunk.endswith('\n'):
+            rest_of_line = input_file.readline()
+            if rest_of_line:
+                yield rest_of_line
+
+
+def iter_chunks(input_file, buffer_size=READ_BUFFER_SIZE):
+    """Yield the contents of a file-like object in blocks of (at most) `buffer_size` bytes."""
+    while True:
+        chunk = input_file.read(buffer_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_gzip_chunks(input_file, buffer_size=READ_BUFFER_SIZE):
+    """
+    Decompress gzip data read from a file-like object that only needs to support `read()`.
+
+    Files that consist of several concatenated gzip members are decompressed completely, as they are by `gzip`, and
+    trailing zero padding is ignored.  Each block of compressed data is decompressed into blocks of at most
+    `buffer_size` bytes, so highly compressible data doesn't expand into one huge string.
+
+    Raises:
+        IOError: if the file ends part way through a gzip member, which `gzip` reports as a failed CRC check.
+    """
+    # The decompressor of the member being read, or None between members.
+    decompressor = None
+    for compressed in iter_chunks(input_file, buffer_size):
+        while compressed:
+            if decompressor is None:
+                if not compressed.strip('\x00'):
+                    break
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+
+            chunk = decompressor.decompress(compressed, buffer_size)
+            if chunk:
+                yield chunk
+            if decompressor.unconsumed_tail:
+                compressed = decompressor.unconsumed_tail
+                continue
+
+            # Any data after the end of a gzip member is either the start of another member or padding.
+            compressed = decompressor.unused_data
+            if compressed:
+                chunk = decompressor.flush()
+                if chunk:
+                    yield chunk
+                decompressor = None
+
+    if decompressor is not None:
+        # The decompressor can't be copied once it has been flushed.
+        complete = _is_member_complete(decompressor)
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+        if not complete:
+            raise IOError('Compressed file ended before the end of the gzip member was reached')
+
+
+def _is_member_complete(decompressor):
+    """
+    Return True if the decompressor has read the whole of its gzip member, including the trailer with its CRC.
+
+    zlib in python 2 doesn't say whether a stream has ended unless there is data after it, so a copy of the decompressor
+    is given one more byte, which is only left unused if the member is complete.
+    """
+    probe = decompressor.copy()
+    try:
+        probe.decompress('\x00')
+    except zlib.error:
+        return False
+    return probe.unused_data == '\x00'
+
+
+def iter_command_output_chunks(command, input_file, buffer_size=READ_BUFFER_SIZE):
+    """
+    Pipe the contents of a file-like object through a command and yield its output in blocks.
+
+    Local files are passed directly to the command as its standard input. The contents of any other file, for example
+    an S3 or HDFS file, are copied to the command by a background thread.
+    """
+    try:
+        stdin = input_file.fileno()
+    except (AttributeError, IOError, ValueError):
+        stdin = subprocess.PIPE
+
+    process = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    writer = None
+    writer_errors = []
+    if stdin == subprocess.PIPE:
+        writer = threading.Thread(
+            target=_copy_to_process, args=(input_file, process.stdin, buffer_size, writer_errors)
+        )
+        writer.daemon = True
+        writer.start()
+
+    finished = False
+    try:
+        output_fd = process.stdout.fileno()
+        while True:
+            # Read directly from the pipe, returning whatever is available instead of waiting for a full buffer.
+            chunk = os.read(output_fd, buffer_size)
+            if not chunk:
+                break
+            yield chunk
+        finished = True
+    finally:
+        # Don't leave the process running if the caller stopped reading early.
+        if not finished and process.poll() is None:
+            process.kill()
+        stderr = process.stderr.read()
+        return_code = process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        if writer is not None:
+            writer.join()
+
+    if writer_errors:
+        exc_info = writer_errors[0]
+        raise exc_info[0], exc_info[1], exc_info[2]
+    if return_code != 0:
+        raise IOError('Command {0} failed with exit code {1}: {2}'.format(' '.join(command), return_code, stderr))
+
+
+def _copy_to_process(input_file, process_stdin, buffer_size, errors):
+    """Copy the file into the standard input of a process, recording any exception raised in `errors`."""
+    try:
+        for chunk in iter_chunks(input_file, buffer_size):
+            process_stdin.write(chunk)
+    except IOError:
+        # The process exited before consuming all of its input, it will report its own error.
+        pass
+    except Exception:  # pylint: disable=broad-except
+        errors.append(sys.exc_info())
+    finally:
+        try:
+            process_stdin.close()
+        except IOError:
+            pass
+
+
+def iter_line_batches(chunks):
+    """
+    Split a sequence of blocks into lines, yielding a list of the lines completed by each block.
+
+    Lines include their trailing newline character, except for the last line if the data doesn't end with one.
+    """
+    partial_line = []
+    for chunk in chunks:
+        end = chunk.find('\n')
+        if end < 0:
+            partial_line.append(chunk)
+            continue
+
+        partial_line.append(chunk[:end + 1])
+        lines = [''.join(partial_line)]
+        start = end + 1
+        end = chunk.find('\n', start)
+        while end >= 0:
+            lines.append(chunk[start:end + 1])
+            start = end + 1
+            end = chunk.find('\n', start)
+
+        partial_line = [chunk[start:]] if start < len(chunk) else []
+        yield lines
+
+    if partial_line:
+        yield [''.join(partial_line)]
+
+
+def iter_lines(chunks):
+    """Split a sequence of blocks into lines, including their trailing newline character."""
+    for lines in iter_line_batches(chunks):
+        for line in lines:
+            yield line
+
+
+def benchmark_backends(paths, backends, buffer_size=READ_BUFFER_SIZE):
+    """
+    Decompress each file with each backend and split it into lines, and return the throughput of each backend.
+
+    The result is a list of (backend, decompressed bytes, seconds) tuples, in the order of `backends`. Backends that are
+    not available are skipped.
+    """
+    results = []
+    for backend in backends:
+        gzip_command = get_gzip_command(backend)
+        if backend != PYTHON_BACKEND and gzip_command is None:
+            continue
+
+        num_bytes = 0
+        start_time = time.time()
+        for path in paths:
+            chunks = iter_target_chunks(luigi.LocalTarget(path), buffer_size, gzip_command=gzip_command)
+            for lines in iter_line_batches(chunks):
+                num_bytes += sum(len(line) for line in lines)
+        results.append((backend, num_bytes, time.time() - start_time))
+
+    return results
+
+
+def main():
+    """Compare the throughput of the gzip decompression backends on the files named on the command line."""
+    parser = argparse.ArgumentParser(description='Measure the throughput of the gzip decompression backends.')
+    parser.add_argument('paths', nargs='+', help='local gzip files to decompress')
+    parser.add_argument(
+        '--backend', action='append', dest='backends',
+        help='a backend to measure, may be repeated (default: python, pigz and zcat)'
+    )
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    backends = arguments.backends or ([PYTHON_BACKEND] + AUTO_BACKEND_ORDER)
+    for backend, num_bytes, elapsed in benchmark_backends(arguments.paths, backends):
+        print '{0:>8}: {1} bytes in {2:.3f} seconds ({3:.1f} MB/s)'.format(
+            backend, num_bytes, elapsed, num_bytes / 1024.0 / 1024.0 / max(elapsed, 0.001)
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,12 @@
 """Support running map reduce jobs using a manifest file to store the input paths."""
 
+import atexit
+import hashlib
+import itertools
 import logging
+import os
+import shutil
+import tempfile
 
 import luigi
 from luigi import configuration
@@ -11,6 +17,9 @@ from edx.analytics.tasks.url import url_path_join, get_target_from_url, Unchecke
 
 CONFIG_SECTION = 'manifest'
 
+# Read and write staged manifests in large blocks.
+COPY_BUFFER_SIZE = 1024 * 1024
+
 log = logging.getLogger(__name__)
 
 
@@ -36,16 +45,7 @@ class URLManifestTask(luigi.Task):
         return [UncheckedExternalURL(url) for url in self.urls]
 
     def output(self):
-        config = configuration.get_config()
-        base_url = config.get(CONFIG_SECTION, 'path')
-        target = get_target_from_url(url_path_join(base_url, str(hash(self))) + '.manifest')
-        lib_jar = config.get(CONFIG_SECTION, 'lib_jar', None)
-        if lib_jar:
-            target.lib_jar = [lib_jar]
-        input_format = config.get(CONFIG_SECTION, 'input_format', None)
-        if input_format:
-            target.input_format = input_format
-        return target
+        return get_manifest_target(str(hash(self)))
 
     def run(self):
         with self.output().open('w') as manifest_file:
@@ -54,23 +54,125 @@ class URLManifestTask(luigi.Task):
                 manifest_file.write('\n')
 
 
+class StagedURLManifestTask(luigi.Task):
+    """
+    Provides a manifest that has already been written to a local file by stream_manifest().
+
+    The manifest is named using the digest of its contents, so the list of paths doesn't have to be held in a parameter.
+    Note that the paths in the manifest are not checked for existence.
+
+    The staged file is local to the process that called stream_manifest(), and is removed when that process exits, so
+    the manifest can only be written by that process.  Running the task anywhere else fails instead of guessing at the
+    contents.
+
+    Parameters:
+        digest: the MD5 hex digest of the contents of the manifest.
+        staged_path: the local path of the file that contains the manifest.
+    """
+
+    digest = luigi.Parameter()
+    staged_path = luigi.Parameter(significant=False)
+
+    def output(self):
+        return get_manifest_target(self.digest)
+
+    def run(self):
+        if not os.path.exists(self.staged_path):
+            raise IOError(
+                'The staged file {0} for manifest {1} no longer exists. Manifests can only be written by the process '
+                'that staged them, so rerun the task that requires this manifest.'.format(self.staged_path, self.digest)
+            )
+
+        with open(self.staged_path, 'r') as staged_file:
+            with self.output().open('w') as manifest_file:
+                shutil.copyfileobj(staged_file, manifest_file, COPY_BUFFER_SIZE)
+
+
+def get_manifest_target(name):
+    """Return the target for the manifest with the given name, annotated with the input format needed to read it."""
+    config = configuration.get_config()
+    base_url = config.get(CONFIG_SECTION, 'path')
+    target = get_target_from_url(url_path_join(base_url, name) + '.manifest')
+    lib_jar = config.get(CONFIG_SECTION, 'lib_jar', None)
+    if lib_jar:
+        target.lib_jar = [lib_jar]
+    input_format = config.get(CONFIG_SECTION, 'input_format', None)
+    if input_format:
+        target.input_format = input_format
+    return target
+
+
+# Maps the digest of each manifest staged by this process to the path of its local file.
+STAGED_MANIFEST_PATHS = {}
+
+
+def stream_manifest(paths):
+    """
+    Write paths to a local manifest file as they are generated, and return a task that provides that manifest.
+
+    The digest of the contents is computed incrementally and used to name the manifest. Building the same manifest again
+    in the same process reuses the file that was staged the first time.
+    """
+    digest = hashlib.md5()
+    file_descriptor, staged_path = tempfile.mkstemp(prefix='manifest', suffix='.manifest')
+    try:
+        with os.fdopen(file_descriptor, 'w', COPY_BUFFER_SIZE) as staged_file:
+            for path in paths:
+                line = path + '\n'
+                staged_file.write(line)
+                digest.update(line)
+    except Exception:
+        os.remove(staged_path)
+        raise
+
+    hex_digest = digest.hexdigest()
+    if hex_digest in STAGED_MANIFEST_PATHS:
+        os.remove(staged_path)
+    else:
+        STAGED_MANIFEST_PATHS[hex_digest] = staged_path
+
+    return StagedURLManifestTask(digest=hex_digest, staged_path=STAGED_MANIFEST_PATHS[hex_digest])
+
+
+def remove_staged_manifests():
+    """Delete all of the manifest files staged by this process."""
+    for staged_path in STAGED_MANIFEST_PATHS.itervalues():
+        if os.path.exists(staged_path):
+            os.remove(staged_path)
+    STAGED_MANIFEST_PATHS.clear()
+
+
+atexit.register(remove_staged_manifests)
+
+
 def convert_tasks_to_manifest_if_necessary(input_tasks):  # pylint: disable=invalid-name
     """
     Provide a manifest for the input paths if there are too many of them.
 
-    The configuration section "manifest" can contain a "threshold" option which, when exceeded, causes this function
-    to return a URLManifestTask instead of the original input_tasks.
+    The configuration section "manifest" can contain a "threshold" option which, when reached, causes this function
+    to return a StagedURLManifestTask instead of the original input_tasks. The input paths are streamed into the
+    manifest as they are generated, and only the first `threshold` of them are held in memory.
     """
     all_input_tasks = task.flatten(input_tasks)
-    targets = task.flatten(task.getpaths(all_input_tasks))
     threshold = configuration.get_config().getint(CONFIG_SECTION, 'threshold', -1)
-    if threshold > 0 and len(targets) >= threshold:
-        log.debug(
-            'Using manifest since %d inputs are greater than or equal to the threshold %d', len(targets), threshold
-        )
-        return [URLManifestTask(urls=[target.path for target in targets])]
-    else:
+    if threshold <= 0:
+        log.debug('Directly processing files since no manifest threshold is set')
+        return all_input_tasks
+
+    paths = generate_target_paths(all_input_tasks)
+    first_paths = list(itertools.islice(paths, threshold))
+    if len(first_paths) < threshold:
         log.debug(
-            'Directly processing files since %d inputs are less than the threshold %d', len(targets), threshold
+            'Directly processing files since %d inputs are less than the threshold %d', len(first_paths), threshold
         )
         return all_input_tasks
+
+    log.debug('Using manifest since the number of inputs is greater than or equal to the threshold %d', threshold)
+    return [stream_manifest(itertools.chain(first_paths, paths))]
+
+
+def generate_target_paths(tasks):
+    """Yield the path of each output target of each of the tasks, without building a list of all of the targets."""
+    for input_task in tasks:
+        for target in task.flatten(task.getpaths(input_task)):
+            yield target.path
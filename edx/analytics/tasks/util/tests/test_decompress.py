@@ -0,0 +1,190 @@
+"""Tests for streaming decompression of input files."""
+
+import gzip
+import os
+import shutil
+import StringIO
+import tempfile
+
+import luigi
+from mock import patch
+
+from edx.analytics.tasks.tests import unittest
+from edx.analytics.tasks.util.decompress import (
+    iter_gzip_chunks, iter_lines, iter_command_output_chunks, iter_target_chunks, get_gzip_command, benchmark_backends,
+    iter_local_split_chunks
+)
+
+
+class ForwardOnlyFile(object):
+    """A file-like object that doesn't support `tell()` or `seek()`, like files read from S3."""
+
+    def __init__(self, contents):
+        self.buffer = StringIO.StringIO(contents)
+
+    def read(self, size):
+        """Read at most `size` bytes."""
+        return self.buffer.read(size)
+
+
+def compress(*members):
+    """Return the gzip compressed form of each member, concatenated."""
+    compressed = StringIO.StringIO()
+    for member in members:
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as gzip_file:
+            gzip_file.write(member)
+    return compressed.getvalue()
+
+
+class GzipChunksTest(unittest.TestCase):
+    """Tests for iter_gzip_chunks()."""
+
+    def decompress(self, compressed, buffer_size=3):
+        """Decompress the data using a small buffer so that every boundary condition is exercised."""
+        return ''.join(iter_gzip_chunks(ForwardOnlyFile(compressed), buffer_size=buffer_size))
+
+    def test_single_member(self):
+        self.assertEquals(self.decompress(compress('foo\nbar\n')), 'foo\nbar\n')
+
+    def test_multiple_members(self):
+        self.assertEquals(self.decompress(compress('foo\n', 'bar\n', 'baz')), 'foo\nbar\nbaz')
+
+    def test_trailing_padding(self):
+        self.assertEquals(self.decompress(compress('foo\n') + '\x00' * 10), 'foo\n')
+
+    def test_large_buffer(self):
+        self.assertEquals(self.decompress(compress('foo\n', 'bar\n'), buffer_size=1024), 'foo\nbar\n')
+
+    def test_empty(self):
+        self.assertEquals(self.decompress(''), '')
+
+    def test_truncated(self):
+        compressed = compress(os.urandom(50000))
+        for truncated in (compressed[:-20], compressed[:-3], compress('foo\n') + compressed[:-20]):
+            with self.assertRaisesRegexp(IOError, 'ended before the end of the gzip member'):
+                self.decompress(truncated, buffer_size=1024)
+
+    def test_output_blocks_limited(self):
+        chunks = list(iter_gzip_chunks(ForwardOnlyFile(compress('x' * 100000)), buffer_size=1024))
+        self.assertEquals(''.join(chunks), 'x' * 100000)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 1024)
+
+
+class LocalSplitChunksTest(unittest.TestCase):
+    """Tests for iter_local_split_chunks()."""
+
+    CONTENTS = 'first line\n\nx\na much longer line than the others\nno trailing newline'
+
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.path = os.path.join(temp_dir, 'tracking.log')
+        with open(self.path, 'wb') as input_file:
+            input_file.write(self.CONTENTS)
+
+    def read_splits(self, split_size):
+        """Return the lines read from each split of the file."""
+        size = len(self.CONTENTS)
+        return [
+            list(iter_lines(iter_local_split_chunks(self.path, start, min(start + split_size, size), buffer_size=4)))
+            for start in xrange(0, size, split_size)
+        ]
+
+    def test_every_line_read_once(self):
+        expected_lines = list(iter_lines([self.CONTENTS]))
+        for split_size in xrange(1, len(self.CONTENTS) + 1):
+            lines = [line for split_lines in self.read_splits(split_size) for line in split_lines]
+            self.assertEquals(lines, expected_lines, 'split size {0}'.format(split_size))
+
+    def test_split_boundaries(self):
+        self.assertEquals(
+            self.read_splits(12),
+            [
+                ['first line\n', '\n'],
+                ['x\n', 'a much longer line than the others\n'],
+                [],
+                [],
+                ['no trailing newline'],
+                [],
+            ]
+        )
+
+
+class IterLinesTest(unittest.TestCase):
+    """Tests for iter_lines()."""
+
+    def test_lines_spanning_chunks(self):
+        self.assertEquals(
+            list(iter_lines(['fo', 'o\nb', 'a', 'r\n\nbaz\n'])),
+            ['foo\n', 'bar\n', '\n', 'baz\n']
+        )
+
+    def test_no_trailing_newline(self):
+        self.assertEquals(list(iter_lines(['foo\nba', 'r'])), ['foo\n', 'bar'])
+
+    def test_carriage_returns_preserved(self):
+        self.assertEquals(list(iter_lines(['foo\r\nb\rar\n'])), ['foo\r\n', 'b\rar\n'])
+
+
+class GzipCommandTest(unittest.TestCase):
+    """Tests for decompressing data with an external command."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.path = os.path.join(self.temp_dir, 'tracking.log.gz')
+        with open(self.path, 'wb') as compressed_file:
+            compressed_file.write(compress('foo\n', 'bar\n'))
+
+    def read_target(self, gzip_command):
+        """Return the decompressed contents of the test file."""
+        return ''.join(iter_target_chunks(luigi.LocalTarget(self.path), gzip_command=gzip_command))
+
+    def test_local_file(self):
+        self.assertEquals(self.read_target(['gzip', '-dc']), 'foo\nbar\n')
+
+    def test_same_output_as_python(self):
+        self.assertEquals(self.read_target(['gzip', '-dc']), self.read_target(None))
+
+    def test_forward_only_file(self):
+        chunks = iter_command_output_chunks(['gzip', '-dc'], ForwardOnlyFile(compress('foo\n')), buffer_size=3)
+        self.assertEquals(''.join(chunks), 'foo\n')
+
+    def test_stop_reading_early(self):
+        chunks = iter_command_output_chunks(['gzip', '-dc'], ForwardOnlyFile(compress('foo\n' * 1000)), buffer_size=3)
+        next(chunks)
+        chunks.close()
+
+    def test_command_failure(self):
+        with self.assertRaises(IOError):
+            list(iter_command_output_chunks(['gzip', '-dc'], ForwardOnlyFile('not compressed')))
+
+    def test_benchmark(self):
+        results = benchmark_backends([self.path], ['python'])
+        self.assertEquals([(backend, num_bytes) for backend, num_bytes, _elapsed in results], [('python', 8)])
+
+
+class GetGzipCommandTest(unittest.TestCase):
+    """Tests for selecting a gzip decompression backend."""
+
+    @patch('edx.analytics.tasks.util.decompress.find_executable')
+    def test_auto_prefers_pigz(self, find_executable_mock):
+        find_executable_mock.return_value = '/usr/bin/pigz'
+        self.assertEquals(get_gzip_command('auto'), ['pigz', '-dc'])
+
+    @patch('edx.analytics.tasks.util.decompress.find_executable')
+    def test_auto_falls_back_to_zcat(self, find_executable_mock):
+        find_executable_mock.side_effect = lambda name: '/bin/zcat' if name == 'zcat' else None
+        self.assertEquals(get_gzip_command('auto'), ['zcat'])
+
+    @patch('edx.analytics.tasks.util.decompress.find_executable')
+    def test_missing_command_falls_back_to_python(self, find_executable_mock):
+        find_executable_mock.return_value = None
+        self.assertIsNone(get_gzip_command('pigz'))
+
+    def test_python(self):
+        self.assertIsNone(get_gzip_command('python'))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_gzip_command('bzip2')
@@ -1,10 +1,16 @@
 """Ensure manifest files are created appropriately."""
 
+import hashlib
+import os
+
 import luigi
 from mock import patch
 
 from edx.analytics.tasks.url import UncheckedExternalURL
-from edx.analytics.tasks.util.manifest import URLManifestTask, convert_tasks_to_manifest_if_necessary
+from edx.analytics.tasks.util.manifest import (
+    URLManifestTask, StagedURLManifestTask, convert_tasks_to_manifest_if_necessary, stream_manifest,
+    remove_staged_manifests, STAGED_MANIFEST_PATHS
+)
 from edx.analytics.tasks.tests import unittest
 from edx.analytics.tasks.tests.config import with_luigi_config, OPTION_REMOVED
 from edx.analytics.tasks.tests.target import FakeTarget
@@ -58,15 +64,83 @@ class URLManifestTaskTest(unittest.TestCase):
         self.assertItemsEqual(self.task.requires(), [UncheckedExternalURL(self.SOURCE_URL)])
 
 
+class StagedURLManifestTaskTest(unittest.TestCase):
+    """Ensure manifests streamed to a local file are named and written appropriately."""
+
+    def tearDown(self):
+        remove_staged_manifests()
+
+    MANIFEST_BASE_PATH = '/tmp/manifest'
+
+    def test_stream_manifest(self):
+        task = stream_manifest(path for path in ['s3://foo/bar', 's3://foo/baz'])
+
+        expected_content = 's3://foo/bar\ns3://foo/baz\n'
+        self.assertEquals(task.digest, hashlib.md5(expected_content).hexdigest())
+        with open(task.staged_path, 'r') as staged_file:
+            self.assertEquals(staged_file.read(), expected_content)
+
+    def test_same_manifest_staged_once(self):
+        first_task = stream_manifest(['s3://foo/bar'])
+        second_task = stream_manifest(['s3://foo/bar'])
+
+        self.assertEquals(first_task.digest, second_task.digest)
+        self.assertEquals(first_task.staged_path, second_task.staged_path)
+        self.assertTrue(os.path.exists(first_task.staged_path))
+        self.assertEquals(STAGED_MANIFEST_PATHS.values(), [first_task.staged_path])
+
+    def test_remove_staged_manifests(self):
+        task = stream_manifest(['s3://foo/bar'])
+
+        remove_staged_manifests()
+
+        self.assertFalse(os.path.exists(task.staged_path))
+        self.assertEquals(STAGED_MANIFEST_PATHS, {})
+
+    @with_luigi_config('manifest', 'path', MANIFEST_BASE_PATH)
+    @patch('edx.analytics.tasks.util.manifest.get_target_from_url')
+    def test_manifest_file_construction(self, get_target_from_url_mock):
+        fake_target = FakeTarget()
+        get_target_from_url_mock.return_value = fake_target
+        task = stream_manifest(['s3://foo/bar'])
+
+        task.run()
+
+        self.assertEquals(fake_target.buffer.read(), 's3://foo/bar\n')
+        get_target_from_url_mock.assert_called_once_with(
+            '{0}/{1}.manifest'.format(self.MANIFEST_BASE_PATH, task.digest)
+        )
+
+    @with_luigi_config('manifest', 'path', MANIFEST_BASE_PATH)
+    @patch('edx.analytics.tasks.util.manifest.get_target_from_url')
+    def test_missing_staged_file(self, get_target_from_url_mock):
+        task = stream_manifest(['s3://foo/bar'])
+        remove_staged_manifests()
+
+        with self.assertRaisesRegexp(IOError, 'no longer exists'):
+            task.run()
+        self.assertFalse(get_target_from_url_mock.called)
+
+
 class ConversionTest(unittest.TestCase):
     """Ensure large numbers of inputs are correctly converted into manifest tasks when appropriate."""
 
+    def tearDown(self):
+        remove_staged_manifests()
+
     @with_luigi_config('manifest', 'threshold', 1)
     def test_over_threshold(self):
         tasks = convert_tasks_to_manifest_if_necessary([FakeTask(), FakeTask()])
 
         self.assertEquals(len(tasks), 1)
-        self.assertIsInstance(tasks[0], URLManifestTask)
+        self.assertIsInstance(tasks[0], StagedURLManifestTask)
+
+    @with_luigi_config('manifest', 'threshold', 2)
+    def test_manifest_contains_all_paths(self):
+        tasks = convert_tasks_to_manifest_if_necessary([FakeTask(), FakeTask(), FakeTask()])
+
+        with open(tasks[0].staged_path, 'r') as staged_file:
+            self.assertEquals(staged_file.read(), '/tmp/foo\n' * 3)
 
     @with_luigi_config('manifest', 'threshold', 3)
     def test_under_threshold(self):
@@ -89,7 +163,7 @@ class ConversionTest(unittest.TestCase):
         tasks = convert_tasks_to_manifest_if_necessary(MultiTargetTask())
 
         self.assertEquals(len(tasks), 1)
-        self.assertIsInstance(tasks[0], URLManifestTask)
+        self.assertIsInstance(tasks[0], StagedURLManifestTask)
 
     @with_luigi_config('manifest', 'threshold', -1)
     def test_negative_threshold(self):